@@ -14,79 +14,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 import numpy as np
 from collections import namedtuple
-import dateutil.parser
-from datetime import datetime, timedelta
-
-global foreground_use
-global data_rx
-global data_tx
-
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.BufferedReader(gzip.open(path, 'rU')) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield apply(DARecord._make, (repacked,))
-    except:
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except:
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def parse_file(file, lancs):
-    global foreground_use
-    global data_rx
-    global data_tx
-
-    logs_to_parse = ['app', 'screen', 'hf', 'net']
+from datetime import datetime
+from da_common import read_device_file, make_sure_path_exists, feed_parser, pop_option, list_devices, parse_devices, open_result_store, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
+from hourly_stats import HourlyStats, set_median_mode
 
+global output
+global hourly_stats
+
+# Per-device hourly means, computed by device_parser (possibly in a worker process)
+# and added to the global accumulators by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('Foreground', 'DataRx', 'DataTx'))
+
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app', 'screen', 'hf', 'net']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['hourly_stats']
+
+def parse_device_file(device):
+    return feed_parser(device_parser(device.Path, device.FileName), read_device_file(device.Path, device.Lancs, device.Cache, logs_to_parse))
+
+def device_parser(file, fname):
     current_hour = None
     current_day = None
     no_of_days = 0
@@ -100,7 +51,10 @@ def parse_file(file, lancs):
     all_data_rx = [[] for hour in range(0,24)]
     all_data_tx = [[] for hour in range(0,24)]
 
-    for row in (read_file_lancs(file) if lancs else read_file(file)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -114,7 +68,7 @@ def parse_file(file, lancs):
             current_day = date_time[0]
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # An app is in the foreground so log its process id
         if 'importance' in entry_val and row_value == 'foreground':
@@ -146,128 +100,156 @@ def parse_file(file, lancs):
             if app_id not in last_app_data:
                 last_app_data[app_id] = [None, None]
             if entry_val[3] == 'rx_bytes':
+                row_number = row.Number
                 app_last_rx = last_app_data[app_id][0]
                 if app_last_rx == None:
                     pass
-                elif int(row_value) > app_last_rx:
-                    all_data_rx[current_hour].append(int(row_value) - app_last_rx)
-                elif int(row_value) < app_last_rx:
-                    all_data_rx[current_hour].append(int(row_value))
-                last_app_data[app_id][0] = int(row_value)
+                elif row_number > app_last_rx:
+                    all_data_rx[current_hour].append(row_number - app_last_rx)
+                elif row_number < app_last_rx:
+                    all_data_rx[current_hour].append(row_number)
+                last_app_data[app_id][0] = row_number
             elif entry_val[3] == 'tx_bytes':
+                row_number = row.Number
                 app_last_tx = last_app_data[app_id][1]
                 if app_last_tx == None:
                     pass
-                elif int(row_value) > app_last_tx:
-                    all_data_tx[current_hour].append(int(row_value) - app_last_tx)
-                elif int(row_value) < app_last_tx:
-                    all_data_tx[current_hour].append(int(row_value))
-                last_app_data[app_id][1] = int(row_value)
+                elif row_number > app_last_tx:
+                    all_data_tx[current_hour].append(row_number - app_last_tx)
+                elif row_number < app_last_tx:
+                    all_data_tx[current_hour].append(row_number)
+                last_app_data[app_id][1] = row_number
 
 
-    if no_of_days != 0:
+    if no_of_days == 0:
+        return None
 
-        mean_app_foreground_use = [(ihour/no_of_days) for ihour in app_foreground_use]
-        if not all(i == 0 for i in mean_app_foreground_use):
-            [foreground_use[i].append(mean_app_foreground_use[i]) for i in range(0,24)]
+    mean_app_foreground_use = [(ihour/no_of_days) for ihour in app_foreground_use]
+    mean_rx = [(sum(ihour)/no_of_days) for ihour in all_data_rx]
+    mean_tx = [(sum(ihour)/no_of_days) for ihour in all_data_tx]
+    return DeviceResult(mean_app_foreground_use, mean_rx, mean_tx)
 
-        mean_rx = [(sum(ihour)/no_of_days) for ihour in all_data_rx]
-        mean_tx = [(sum(ihour)/no_of_days) for ihour in all_data_tx]
-        if not all(i == 0 for i in mean_rx):
-            [data_rx[i].append(mean_rx[i]) for i in range(0,24)]
-        if not all(i == 0 for i in mean_tx):
-            [data_tx[i].append(mean_tx[i]) for i in range(0,24)]
+def merge_device_result(result):
+    global hourly_stats
 
-def calculate_print_summaries():
-    global foreground_use
-    global data_rx
-    global data_tx
-
-    foreground_total = [0 if not hour else sum(hour) for hour in foreground_use]
-    data_rx_total = [0 if not hour else sum(hour) for hour in data_rx]
-    data_tx_total = [0 if not hour else sum(hour) for hour in data_tx]
+    if result == None:
+        return
 
-    foreground_mean = [0 if not hour else np.mean(hour) for hour in foreground_use]
-    data_rx_mean = [0 if not hour else np.mean(hour) for hour in data_rx]
-    data_tx_mean = [0 if not hour else np.mean(hour) for hour in data_tx]
+    if not all(i == 0 for i in result.Foreground):
+        hourly_stats.add('foreground', result.Foreground)
 
-    foreground_no_of_devices = [0 if not hour else len(hour) for hour in foreground_use]
-    data_rx_no_of_devices = [0 if not hour else len(hour) for hour in data_rx]
-    data_tx_no_of_devices = [0 if not hour else len(hour) for hour in data_tx]
+    if not all(i == 0 for i in result.DataRx):
+        hourly_stats.add('data_rx', result.DataRx)
+    if not all(i == 0 for i in result.DataTx):
+        hourly_stats.add('data_tx', result.DataTx)
 
-    foreground_min = [0 if not hour else np.min(hour) for hour in foreground_use]
-    data_rx_min = [0 if not hour else np.min(hour) for hour in data_rx]
-    data_tx_min = [0 if not hour else np.min(hour) for hour in data_tx]
-
-    foreground_max = [0 if not hour else np.max(hour) for hour in foreground_use]
-    data_rx_max = [0 if not hour else np.max(hour) for hour in data_rx]
-    data_tx_max = [0 if not hour else np.max(hour) for hour in data_tx]
+def calculate_print_summaries():
+    global hourly_stats
+    global output
 
-    foreground_med = [0 if not hour else np.median(hour) for hour in foreground_use]
-    data_rx_med = [0 if not hour else np.median(hour) for hour in data_rx]
-    data_tx_med = [0 if not hour else np.median(hour) for hour in data_tx]
+    # Hourly totals, means, no of devices, mins, maxs and medians across devices
+    foreground, data_rx, data_tx = hourly_stats.summaries(['foreground', 'data_rx', 'data_tx'])
+    foreground_total, foreground_mean, foreground_no_of_devices, foreground_min, foreground_max, foreground_med = foreground
+    data_rx_total, data_rx_mean, data_rx_no_of_devices, data_rx_min, data_rx_max, data_rx_med = data_rx
+    data_tx_total, data_tx_mean, data_tx_no_of_devices, data_tx_min, data_tx_max, data_tx_med = data_tx
 
-    with open('total_out/all_totals_hourly.csv', 'a') as f:
+    with output.open('total_out/all_totals_hourly.csv', 'a') as f:
         f.write('{0};{1}\n'.format('foreground total', foreground_total))
         f.write('{0};{1}\n'.format('data rx total', data_rx_total))
         f.write('{0};{1}\n'.format('data tx total', data_tx_total))
-    with open('total_out/all_means_hourly.csv', 'a') as f:
+    with output.open('total_out/all_means_hourly.csv', 'a') as f:
         f.write('{0};{1}\n'.format('foreground mean', foreground_mean))
         f.write('{0};{1}\n'.format('data rx mean', data_rx_mean))
         f.write('{0};{1}\n'.format('data tx mean', data_tx_mean))
-    with open('total_out/all_deviceNo_hourly.csv', 'a') as f:
+    with output.open('total_out/all_deviceNo_hourly.csv', 'a') as f:
         f.write('{0};{1}\n'.format('foreground no of devices', foreground_no_of_devices))
         f.write('{0};{1}\n'.format('data rx no of devices', data_rx_no_of_devices))
         f.write('{0};{1}\n'.format('data tx no of devices', data_tx_no_of_devices))
-    with open('total_out/all_mins_hourly.csv', 'a') as f:
+    with output.open('total_out/all_mins_hourly.csv', 'a') as f:
         f.write('{0};{1}\n'.format('foreground min', foreground_min))
         f.write('{0};{1}\n'.format('data rx min', data_rx_min))
         f.write('{0};{1}\n'.format('data tx min', data_tx_min))
-    with open('total_out/all_maxs_hourly.csv', 'a') as f:
+    with output.open('total_out/all_maxs_hourly.csv', 'a') as f:
         f.write('{0};{1}\n'.format('foreground max', foreground_max))
         f.write('{0};{1}\n'.format('data rx max', data_rx_max))
         f.write('{0};{1}\n'.format('data tx max', data_tx_max))
-    with open('total_out/all_meds_hourly.csv', 'a') as f:
+    with output.open('total_out/all_meds_hourly.csv', 'a') as f:
         f.write('{0};{1}\n'.format('foreground med', foreground_med))
         f.write('{0};{1}\n'.format('data rx med', data_rx_med))
         f.write('{0};{1}\n'.format('data tx med', data_tx_med))
-    with open('total_out/all_hourly.csv', 'a') as f:
+    with output.open('total_out/all_hourly.csv', 'a') as f:
         f.write('{0};{1};{2};{3};{4};{5};{6}\n'.format('foreground use', foreground_total, foreground_mean, foreground_no_of_devices, foreground_min, foreground_max, foreground_med))
         f.write('{0};{1};{2};{3};{4};{5};{6}\n'.format('data rx', data_rx_total, data_rx_mean, data_rx_no_of_devices, data_rx_min, data_rx_max, data_rx_med))
         f.write('{0};{1};{2};{3};{4};{5};{6}\n'.format('data tx', data_tx_total, data_tx_mean, data_tx_no_of_devices, data_tx_min, data_tx_max, data_tx_med))
 
 
-if __name__ == '__main__':
-    global foreground_use
-    global data_rx
-    global data_tx
-
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    lancs = bool(len(sys.argv) > 3)
+def init_report():
+    global hourly_stats
+    global output
 
-    startTime = datetime.now()
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
-    foreground_use = [[] for x in range(0,24)]
-    data_rx = [[] for x in range(0,24)]
-    data_tx = [[] for x in range(0,24)]
+    # Hourly foreground use, rx and tx values of each device
+    hourly_stats = HourlyStats()
 
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('total_out/')
     output_files = ['all_totals_hourly.csv', 'all_means_hourly.csv', 'all_deviceNo_hourly.csv', 'all_mins_hourly.csv', 'all_maxs_hourly.csv', 'all_meds_hourly.csv', 'all_hourly.csv']
     for of_name in output_files:
-        with open('total_out/' + of_name, 'w') as f:
+        with output.open('total_out/' + of_name, 'w') as f:
             f.write('')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        parse_file(fullfpath, lancs)
+def finish_report():
+    global output
 
     calculate_print_summaries()
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('all_data_foreground', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    median = pop_option(args, '--median', 'exact')
+    set_median_mode(median)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    lancs = bool(len(args) > 3)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'all_data_foreground')
+
+    init_report()
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache)
+    options = [str(lancs), median]
+    checkpoint = open_checkpoint(checkpoint_path, 'all_data_foreground', devices, [], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'all_data_foreground', devices, [], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'all_data_foreground', []), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'all_data_foreground', devices, [], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'all_data_foreground', []), progress, checkpoint)
+    for device, result in devices_results:
+        merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Census of the apps installed on devices: the no. of devices each app is
+# installed on, by market and by whether the app has the INTERNET permission.
+# Apps and markets are interned to indices into integer arrays, and the apps
+# installed on at least a threshold of devices (or the top k) are selected
+# without sorting every app seen. The selection can be written as a mapping
+# file like Greater50InstallsApps.csv and as an app list file like
+# app-greater50-installs-on-devices-at-least-14-days.csv.
+
+import numpy as np
+from da_common import read_app_mapping
+
+def app_names(fp):
+    """
+    Give a file pointer fp, extract app names from a DA analysed/apps-installed file
+    Assumes file is formated as
+    "time | <count> | CSV of app names, each name colon separated with perms"
+    Returns the (name, market, has INTERNET permission) of each app, read a line at a time.
+    """
+    app_dict = {}
+    for line in fp:
+        items = line.rstrip('\r\n').split('|')
+        if len(items) < 3:
+            print('Error, expecting line with at least three items', line[:20] + '...')
+            continue
+        for app in items[2].split(','):
+            if len(app) > 2:
+                #string is of form "app_name:perms_list:market" since version 1.1.6 of DA
+                #we'll simply ignore data from older versions of DA.
+                app_details = app.split(':')
+                if len(app_details) < 3:
+                    continue
+                name = app_details[0].split('@')[0]
+                #for the moment, the last app status wins; does it matter if this changes over time?
+                app_dict[name] = (app_details[-1], 'android.permission.INTERNET' in app_details[1])
+    return [(name, market, has_internet) for name, (market, has_internet) in app_dict.items()]
+
+def summarise_apps_file(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as fp:
+        return app_names(fp)
+
+class AppCensus(object):
+    """
+    No. of devices each app is installed on, and of those by market and by whether the
+    app has the INTERNET permission. add_device(apps) adds the (name, market, has
+    internet) of each app installed on one device, each app once.
+    """
+    def __init__(self):
+        self.apps = {}
+        self.names = []
+        self.markets = {}
+        self.market_names = []
+        self.counts = np.zeros(1024, dtype=np.int64)
+        self.market_counts = np.zeros((1024, 4), dtype=np.int64)
+        # Columns: without, with the INTERNET permission
+        self.internet_counts = np.zeros((1024, 2), dtype=np.int64)
+
+    def app(self, name):
+        index = self.apps.get(name)
+        if index == None:
+            index = len(self.names)
+            if index == len(self.counts):
+                self.counts = np.concatenate((self.counts, np.zeros_like(self.counts)))
+                self.market_counts = np.concatenate((self.market_counts, np.zeros_like(self.market_counts)))
+                self.internet_counts = np.concatenate((self.internet_counts, np.zeros_like(self.internet_counts)))
+            self.apps[name] = index
+            self.names.append(name)
+        return index
+
+    def market(self, name):
+        index = self.markets.get(name)
+        if index == None:
+            index = len(self.market_names)
+            if index == self.market_counts.shape[1]:
+                self.market_counts = np.concatenate((self.market_counts, np.zeros_like(self.market_counts)), axis=1)
+            self.markets[name] = index
+            self.market_names.append(name)
+        return index
+
+    def add_device(self, apps):
+        apps = list(apps)
+        if not apps:
+            return
+        rows = np.array([self.app(name) for name, market, has_internet in apps])
+        markets = np.array([self.market(market) for name, market, has_internet in apps])
+        internet = np.array([has_internet for name, market, has_internet in apps], dtype=np.int64)
+        # Each app is added once per device, so the rows are distinct
+        self.counts[rows] += 1
+        self.market_counts[rows, markets] += 1
+        self.internet_counts[rows, internet] += 1
+
+    def select(self, threshold=1, top=None):
+        """
+        Return the indices of the apps installed on at least threshold devices (and only
+        the top apps by no. of devices if top is given), by no. of devices and then name,
+        both descending. Only the apps selected are sorted.
+        """
+        counts = self.counts[:len(self.names)]
+        if top != None and top < len(counts):
+            # Apps tied with the top'th are candidates, cut after sorting by name
+            threshold = max(threshold, np.partition(counts, len(counts) - top)[len(counts) - top])
+        rows = np.flatnonzero(counts >= threshold)
+        rows = sorted(rows.tolist(), key=lambda row: (counts[row], self.names[row]), reverse=True)
+        return rows if top == None else rows[:top]
+
+    def detail(self, row):
+        # No. of devices by market and by INTERNET permission ('Internet_True'/'Internet_False')
+        detail = dict((market, int(count)) for market, count in zip(self.market_names, self.market_counts[row]) if count > 0)
+        for has_internet in (False, True):
+            count = int(self.internet_counts[row, int(has_internet)])
+            if count > 0:
+                detail['Internet_' + str(has_internet)] = count
+        return detail
+
+def write_mapping(f, census, rows, practices_path=None):
+    """
+    Write the apps rows of census to the open file f as a mapping file (app;name;practice,
+    by app), taking the name and practice of each app from the mapping file at
+    practices_path if it has the app, else with the app as its name and no practice.
+    """
+    known = {}
+    if practices_path != None:
+        for record in read_app_mapping(practices_path):
+            known[record.FullName] = record
+    for app in sorted(census.names[row] for row in rows):
+        record = known.get(app)
+        f.write('{0};{1};{2}\n'.format(app, app if record == None else record.Name, '' if record == None else record.Practice))
+
+def write_applist(f, census, rows):
+    # Write the apps rows of census to the open file f as an app list file (one app per line)
+    for app in sorted(census.names[row] for row in rows):
+        f.write(app + '\n')
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Census of the apps installed on devices with at least 14 days of logging,
+# from the app|installed rows of the device files (so no apps-installed files
+# need extracting first). Each device's distinct apps inside its 04:00 to 04:00
+# window are counted in an AppCensus (app_census.py), and the apps installed
+# on at least install_threshold devices are written as a mapping file and an
+# app list file, the inputs of the other scripts. Also a report of report_engine.py,
+# so the census comes out of the same pass over the device files as the others.
+
+import sys
+from collections import namedtuple
+from datetime import datetime
+from da_common import make_sure_path_exists, parse_windowed_device, pop_option, list_devices, parse_devices, open_result_store, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
+from app_census import AppCensus, write_mapping, write_applist
+
+global output
+global no_of_ignored_files
+global census
+global device_apps
+global practices_path
+
+# Minimum no. of devices an app is installed on to be in the mapping and app list files
+install_threshold = 50
+
+# Per-device distinct apps installed, as (name, market, has INTERNET permission)
+DeviceResult = namedtuple('DeviceResult', ('FileName', 'Apps'))
+
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app']
+entry_types_to_parse = ['app|installed']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['no_of_ignored_files', 'census', 'device_apps']
+
+def parse_device_file(device):
+    # The date window is found while the device file is parsed, so it is only read once
+    return parse_windowed_device(lambda start_date, end_date: device_parser(device.Path, device.FileName, start_date, end_date), device, entry_types_to_parse)
+
+def ignore_device(fname):
+    global no_of_ignored_files
+
+    print("No start or end dates, or under 14 days of logging, for file: " + fname)
+    no_of_ignored_files+=1
+
+def installed_apps(value):
+    """
+    Return the (name, market, has INTERNET permission) of each app of an app|installed
+    row value (name@version:...:uid:market, comma separated).
+    """
+    apps = []
+    for app_entry in value.split(','):
+        installed_details = app_entry.split('@')
+        if len(installed_details) > 1:
+            app_info = installed_details[1].split(':')
+            apps.append((installed_details[0], app_info[-1], any('android.permission.INTERNET' in field for field in app_info[1:-2])))
+    return apps
+
+def device_parser(file_path, fname, start_date, end_date):
+    # The last status of each app installed inside the window wins
+    apps = {}
+
+    while True:
+        row = yield
+        if row is None:
+            break
+        row_date = row.Date
+
+        if not row.EntryType.startswith('app|installed') or row_date == '(invalid date)':
+            continue
+
+        if row_date[:-9] < start_date or row_date[:-9] >= end_date:
+            continue
+
+        for name, market, has_internet in installed_apps(row.Value.strip()):
+            apps[name] = (market, has_internet)
+
+    return DeviceResult(fname, [(name, market, has_internet) for name, (market, has_internet) in apps.items()])
+
+def merge_device_result(result):
+    global census
+    global device_apps
+
+    census.add_device(result.Apps)
+    device_apps.append((result.FileName, len(result.Apps)))
+
+def init_report(mapping_path=None):
+    global output
+    global no_of_ignored_files
+    global census
+    global device_apps
+    global practices_path
+
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
+
+    no_of_ignored_files = 0
+    census = AppCensus()
+    device_apps = []
+    # Names and practices of the apps already in this mapping are kept in the new one
+    practices_path = mapping_path
+
+    make_sure_path_exists('app_installs/')
+
+def finish_report():
+    global output
+    global census
+    global device_apps
+    global practices_path
+
+    rows = census.select(1)
+    with output.open('app_installs/app_installs.csv', 'w') as f:
+        f.write('app,devices,internet,' + ','.join(census.market_names) + '\n')
+        for row in rows:
+            f.write('{0},{1},{2},{3}\n'.format(census.names[row], census.counts[row], census.internet_counts[row, 1],
+                                               ','.join(str(count) for count in census.market_counts[row, :len(census.market_names)])))
+
+    with output.open('app_installs/device_apps.csv', 'w') as f:
+        f.write('device,apps\n')
+        for fname, no_of_apps in device_apps:
+            f.write('{0},{1}\n'.format(fname, no_of_apps))
+
+    # The mapping and app list files, the inputs of the other scripts
+    selected = census.select(install_threshold)
+    with output.open('app_installs/Greater{0}InstallsApps.csv'.format(install_threshold), 'w') as f:
+        write_mapping(f, census, selected, practices_path)
+    with output.open('app_installs/app-greater{0}-installs-on-devices-at-least-14-days.csv'.format(install_threshold), 'w') as f:
+        write_applist(f, census, selected)
+    print("{0} apps installed on at least {1} devices".format(len(selected), install_threshold))
+
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('app_installs', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    index = pop_option(args, '--index')
+    install_threshold = int(pop_option(args, '--threshold', install_threshold))
+    practices = pop_option(args, '--practices')
+
+    if len(args) < 3:
+        print('Usage: ' + args[0] + ' <device ids file> <path of device files> [lancs] [--threshold N] [--practices mapping file] [--workers N] [--cache dir] [--store dir] [--index dir] [--profile file] [--profile-stats file] [--progress seconds] [--status file] [--checkpoint file] [--checkpoint-interval seconds] [--resume] [--shard i/N] [--merge files]')
+        sys.exit(1)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    lancs = bool(len(args) > 3)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'app_installs')
+
+    init_report(practices)
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache, index)
+    options = [str(lancs), str(install_threshold)]
+    mappings = [] if practices == None else [practices]
+    checkpoint = open_checkpoint(checkpoint_path, 'app_installs', devices, mappings, options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'app_installs', devices, mappings, options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'app_installs', mappings), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'app_installs', devices, mappings, options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'app_installs', mappings), progress, checkpoint)
+    for device, result in devices_results:
+        if result == None:
+            ignore_device(device.FileName)
+        else:
+            merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
+
+    # **** For checking timings *****
+    endFilesTime = datetime.now()
+    print("All files summarised in {0}".format(str((endFilesTime - startTime))))
+    print("No. of ignored files: {0}".format(str(no_of_ignored_files)))
@@ -14,95 +14,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
-import numpy as np
-from collections import namedtuple, OrderedDict
-import dateutil.parser
-from datetime import datetime, timedelta
-
-global apps                             #List of apps installed on 50 or more devices
+from collections import namedtuple
+from datetime import datetime
+from da_common import read_device_file, read_practice_table, practice_rollup, make_sure_path_exists, feed_parser, pop_option, list_devices, parse_devices, open_result_store, time_gap, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
+from hourly_stats import HourlyStats, set_median_mode
+
+global output
+global practice_table                   #Apps installed on 50 or more devices and their practices, compiled to integer codes
 global devices_apps_foreground_use      #Hourly mean no of foreground instances for apps across devices whilst the device is in use - 'in use' means screen on and unlocked
 global devices_apps_foreground_other    #Hourly mean no of foreground instances for apps across devices other than when the device is in use
-global devices_use_durations            #Hourly mean time device was on across devices
-global devices_use_instances            #Hourly mean no of times device was on across devices
-
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.BufferedReader(gzip.open(path, 'rU')) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield apply(DARecord._make, (repacked,))
-    except Exception as ex:
-        print(ex)
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except Exception as ex:
-        print(ex)
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-AppRecord = namedtuple('AppRecord', ('FullName', 'Name', 'Practice'))
-def read_app_mapping(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=';')
-        for row in map(AppRecord._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def get_t_gap(first, second):
-    return (dateutil.parser.parse(second) - dateutil.parser.parse(first)).total_seconds()
-
-def parse_file(file, lancs):
-    global apps
-    global devices_apps_foreground_use
-    global devices_apps_foreground_other
-    global devices_use_durations
-    global devices_use_instances
+global devices_use                      #Hourly mean time device was on ('durations') and mean no of times device was on ('instances') across devices
+
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app', 'screen', 'hf']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['devices_apps_foreground_use', 'devices_apps_foreground_other', 'devices_use']
+
+# Per-device hourly means, computed by device_parser (possibly in a worker process)
+# and added to the global accumulators by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('ForegroundUse', 'ForegroundOther', 'UseDurations', 'UseInstances'))
 
-    logs_to_parse = ['app', 'screen', 'hf']
+def parse_device_file(device):
+    return feed_parser(device_parser(device.Path, device.FileName), read_device_file(device.Path, device.Lancs, device.Cache, logs_to_parse))
+
+def device_parser(file, fname):
+    global practice_table
 
     current_hour = None
     current_day = None
@@ -114,12 +52,15 @@ def parse_file(file, lancs):
     screen_on = False
     screen_unlocked = False
 
-    screen_on_start_time = None
+    screen_on_row = None
     screen_on_times = [[] for x in range(0,24)]
 
     last_importance_app_pid = None
 
-    for row in (read_file_lancs(file) if lancs else read_file(file)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -133,7 +74,7 @@ def parse_file(file, lancs):
             current_day = date_time[0]
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # An app is in the foreground so log its process id
         if 'importance' in entry_val and 'foreground' in row_value:
@@ -146,7 +87,7 @@ def parse_file(file, lancs):
             app_name = row_value.split(":")[0]
 
             # The app pids for the app importance and app name logs don't match, so ignore it
-            if app_name in apps and entry_val[1] == last_importance_app_pid:
+            if app_name in practice_table and entry_val[1] == last_importance_app_pid:
                 # The user is using the device
                 if screen_on and screen_unlocked:
                     # Increment the number of times it was in the foreground
@@ -172,210 +113,246 @@ def parse_file(file, lancs):
         elif row_entry_type.startswith('screen|power'):
             if 'off' in row_value:
                 screen_on = False
-                if screen_on_start_time != None:
-                    screen_on_times[current_hour].append(get_t_gap(screen_on_start_time, row_date))
-                    screen_on_start_time = None
+                if screen_on_row != None:
+                    screen_on_times[current_hour].append(time_gap(screen_on_row.Time, row.Time))
+                    screen_on_row = None
             else:
                 screen_on = True
-                screen_on_start_time = row_date
-
-
-    if no_of_days != 0:
-
-        # Foreground apps whilst device was in use - i.e. screen on and unlocked
-        for app, data in app_foreground_use.items():
-            # Calculate hourly means for the device app foregound instances
-            mean_app_foreground_use = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
-            if not all(i == 0 for i in mean_app_foreground_use):
-                if app not in devices_apps_foreground_use:
-                    devices_apps_foreground_use[app] = [[] for x in range(0,24)]
-                [devices_apps_foreground_use[app][i].append(mean_app_foreground_use[i]) for i in range(0,24)]
-
-        # Foreground apps whilst device other than in use
-        for app, data in app_foreground_other.items():
-            # Calculate hourly means for the device app foregound instances
-            mean_app_foreground_other = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
-            if not all(i == 0 for i in mean_app_foreground_other):
-                if app not in devices_apps_foreground_other:
-                    devices_apps_foreground_other[app] = [[] for x in range(0,24)]
-                [devices_apps_foreground_other[app][i].append(mean_app_foreground_other[i]) for i in range(0,24)]
-
-        # Screen on/off times - sessions of use in seconds within an hour, averaged across the hour
-        mean_hourly_device_use_durations = [(sum(hour_use_time)/no_of_days) for hour_use_time in screen_on_times]
-        mean_hourly_device_use_instances = [(len(hour_use_time)/no_of_days) for hour_use_time in screen_on_times]
-        if not all(i == 0 for i in mean_hourly_device_use_durations):
-            [devices_use_durations[i].append(mean_hourly_device_use_durations[i]) for i in range(0,24)]
-        if not all(i == 0 for i in mean_hourly_device_use_instances):
-            [devices_use_instances[i].append(mean_hourly_device_use_instances[i]) for i in range(0,24)]
-
-def get_practice_name(app):
-    global apps
-    for key, val in apps.items():
-        if key == app:
-            return val
-    print('App {0} not found'.format(app))
-    return
+                screen_on_row = row
+
+
+    if no_of_days == 0:
+        return None
+
+    # Foreground apps whilst device was in use - i.e. screen on and unlocked
+    foreground_use_means = []
+    for app, data in app_foreground_use.items():
+        # Calculate hourly means for the device app foregound instances
+        mean_app_foreground_use = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
+        if not all(i == 0 for i in mean_app_foreground_use):
+            foreground_use_means.append((app, mean_app_foreground_use))
+
+    # Foreground apps whilst device other than in use
+    foreground_other_means = []
+    for app, data in app_foreground_other.items():
+        # Calculate hourly means for the device app foregound instances
+        mean_app_foreground_other = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
+        if not all(i == 0 for i in mean_app_foreground_other):
+            foreground_other_means.append((app, mean_app_foreground_other))
+
+    # Screen on/off times - sessions of use in seconds within an hour, averaged across the hour
+    mean_hourly_device_use_durations = [(sum(hour_use_time)/no_of_days) for hour_use_time in screen_on_times]
+    mean_hourly_device_use_instances = [(len(hour_use_time)/no_of_days) for hour_use_time in screen_on_times]
+
+    return DeviceResult(foreground_use_means, foreground_other_means, mean_hourly_device_use_durations, mean_hourly_device_use_instances)
+
+def merge_device_result(result):
+    global devices_apps_foreground_use
+    global devices_apps_foreground_other
+    global devices_use
+
+    if result == None:
+        return
+
+    for app, mean_app_foreground_use in result.ForegroundUse:
+        devices_apps_foreground_use.add(app, mean_app_foreground_use)
+
+    for app, mean_app_foreground_other in result.ForegroundOther:
+        devices_apps_foreground_other.add(app, mean_app_foreground_other)
+
+    if not all(i == 0 for i in result.UseDurations):
+        devices_use.add('durations', result.UseDurations)
+    if not all(i == 0 for i in result.UseInstances):
+        devices_use.add('instances', result.UseInstances)
+
+def get_practice_code(app):
+    global practice_table
+
+    code = practice_table.practice_code(app)
+    if code < 0:
+        print('App {0} not found'.format(app))
+        # Apps not in the mapping are summed under the practice None, after the others
+        return len(practice_table.practices)
+    return code
 
 def calculate_print_app_foreground():
     global devices_apps_foreground_use
     global devices_apps_foreground_other
+    global output
+
+    global practice_table
 
-    practices_foreground = OrderedDict()
-    practices_other = OrderedDict()
+    # Practice code and hourly means of each app, summed by practice below
+    foreground_codes = []
+    foreground_means = []
+    other_codes = []
+    other_means = []
 
     # App foregound use summary
-    for app, data in devices_apps_foreground_use.items():
-        total_i = [0 if not hour else sum(hour) for hour in data]
-        mean_i = [0 if not hour else np.mean(hour) for hour in data]
-        no_of_devices = [0 if not hour else len(hour) for hour in data]
-        min_i = [0 if not hour else np.min(hour) for hour in data]
-        max_i = [0 if not hour else np.max(hour) for hour in data]
-        med_i = [0 if not hour else np.median(hour) for hour in data]
-
-        with open('use_out/app_foreground_use_hourly.csv', 'a') as f:
+    for app, summary in zip(devices_apps_foreground_use.keys(), devices_apps_foreground_use.summaries()):
+        total_i, mean_i, no_of_devices, min_i, max_i, med_i = summary
+
+        with output.open('use_out/app_foreground_use_hourly.csv', 'a') as f:
             f.write('{0};{1};{2};{3};{4};{5};{6}\n'.format(app, total_i, mean_i, no_of_devices, min_i, max_i, med_i))
-        with open('use_out/app_use_totals_hourly.csv', 'a') as f:
+        with output.open('use_out/app_use_totals_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, total_i))
-        with open('use_out/app_use_means_hourly.csv', 'a') as f:
+        with output.open('use_out/app_use_means_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, mean_i))
-        with open('use_out/app_use_deviceNo_hourly.csv', 'a') as f:
+        with output.open('use_out/app_use_deviceNo_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, no_of_devices))
-        with open('use_out/app_use_mins_hourly.csv', 'a') as f:
+        with output.open('use_out/app_use_mins_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, min_i))
-        with open('use_out/app_use_maxs_hourly.csv', 'a') as f:
+        with output.open('use_out/app_use_maxs_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, max_i))
-        with open('use_out/app_use_meds_hourly.csv', 'a') as f:
+        with output.open('use_out/app_use_meds_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, med_i))
 
-        practice = get_practice_name(app)
-        if practice not in practices_foreground:
-            practices_foreground[practice]  = [[] for i in range(0,24)]
-        [practices_foreground[practice][i].append(mean_i[i]) for i in range(0,24)]
+        foreground_codes.append(get_practice_code(app))
+        foreground_means.append(mean_i)
 
     # App foregound other summary
-    for app, data in devices_apps_foreground_other.items():
-        total_i = [0 if not hour else sum(hour) for hour in data]
-        mean_i = [0 if not hour else np.mean(hour) for hour in data]
-        no_of_devices = [0 if not hour else len(hour) for hour in data]
-        min_i = [0 if not hour else np.min(hour) for hour in data]
-        max_i = [0 if not hour else np.max(hour) for hour in data]
-        med_i = [0 if not hour else np.median(hour) for hour in data]
-
-        with open('use_out/app_foreground_other_hourly.csv', 'a') as f:
+    for app, summary in zip(devices_apps_foreground_other.keys(), devices_apps_foreground_other.summaries()):
+        total_i, mean_i, no_of_devices, min_i, max_i, med_i = summary
+
+        with output.open('use_out/app_foreground_other_hourly.csv', 'a') as f:
             f.write('{0};{1};{2};{3};{4};{5};{6}\n'.format(app, total_i, mean_i, no_of_devices, min_i, max_i, med_i))
-        with open('use_out/app_other_totals_hourly.csv', 'a') as f:
+        with output.open('use_out/app_other_totals_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, total_i))
-        with open('use_out/app_other_means_hourly.csv', 'a') as f:
+        with output.open('use_out/app_other_means_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, mean_i))
-        with open('use_out/app_other_deviceNo_hourly.csv', 'a') as f:
+        with output.open('use_out/app_other_deviceNo_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, no_of_devices))
-        with open('use_out/app_other_mins_hourly.csv', 'a') as f:
+        with output.open('use_out/app_other_mins_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, min_i))
-        with open('use_out/app_other_maxs_hourly.csv', 'a') as f:
+        with output.open('use_out/app_other_maxs_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, max_i))
-        with open('use_out/app_other_meds_hourly.csv', 'a') as f:
+        with output.open('use_out/app_other_meds_hourly.csv', 'a') as f:
             f.write('{0};{1}\n'.format(app, med_i))
 
-        practice = get_practice_name(app)
-        if practice not in practices_other:
-            practices_other[practice]  = [[] for i in range(0,24)]
-        [practices_other[practice][i].append(mean_i[i]) for i in range(0,24)]
+        other_codes.append(get_practice_code(app))
+        other_means.append(mean_i)
 
-    with open('use_out/practice_hourly_use_summaries_foreground.csv', 'w') as f:
+    with output.open('use_out/practice_hourly_use_summaries_foreground.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('use_out/practice_hourly_use_summaries_other.csv', 'w') as f:
+    with output.open('use_out/practice_hourly_use_summaries_other.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
     # PRACTICE SUMMARY
-    for practice, data in practices_foreground.items():
-        total_foreground_use = [0 if not hour else sum(hour) for hour in data]
-        with open('use_out/practice_hourly_use_summaries_foreground.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+    practice_names = practice_table.practices + [None]
+    codes, totals = practice_rollup(foreground_codes, foreground_means)
+    for code, total_foreground_use in zip(codes, totals.tolist()):
+        with output.open('use_out/practice_hourly_use_summaries_foreground.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_names[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_foreground_use[i]))
             f.write('\n')
 
-    for practice, data in practices_other.items():
-        total_other_use = [0 if not hour else sum(hour) for hour in data]
-        with open('use_out/practice_hourly_use_summaries_other.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+    codes, totals = practice_rollup(other_codes, other_means)
+    for code, total_other_use in zip(codes, totals.tolist()):
+        with output.open('use_out/practice_hourly_use_summaries_other.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_names[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_other_use[i]))
             f.write('\n')
 
 def calculate_print_device_use():
-    global devices_use_durations
-    global devices_use_instances
+    global devices_use
+    global output
 
     # Device use summary
-    # Calculate device use durations summary - hourly totals, means, no of devices, mins, maxs, medians across devices
-    dur_total_device_use = [0 if not hour else sum(hour) for hour in devices_use_durations]
-    dur_mean_device_use = [0 if not hour else np.mean(hour) for hour in devices_use_durations]
-    dur_devices_device_use = [0 if not hour else len(hour) for hour in devices_use_durations]
-    dur_min_device_use = [0 if not hour else np.min(hour) for hour in devices_use_durations]
-    dur_max_device_use = [0 if not hour else np.max(hour) for hour in devices_use_durations]
-    dur_med_device_use = [0 if not hour else np.median(hour) for hour in devices_use_durations]
-    # Calculate number of device uses summary - hourly totals, means, no of devices, mins, maxs, medians across devices
-    no_total_device_use = [0 if not hour else sum(hour) for hour in devices_use_instances]
-    no_mean_device_use = [0 if not hour else np.mean(hour) for hour in devices_use_instances]
-    no_devices_device_use = [0 if not hour else len(hour) for hour in devices_use_instances]
-    no_min_device_use = [0 if not hour else np.min(hour) for hour in devices_use_instances]
-    no_max_device_use = [0 if not hour else np.max(hour) for hour in devices_use_instances]
-    no_med_device_use = [0 if not hour else np.median(hour) for hour in devices_use_instances]
+    # Calculate device use durations and number of device uses summaries - hourly totals, means, no of devices, mins, maxs, medians across devices
+    durations, instances = devices_use.summaries(['durations', 'instances'])
+    dur_total_device_use, dur_mean_device_use, dur_devices_device_use, dur_min_device_use, dur_max_device_use, dur_med_device_use = durations
+    no_total_device_use, no_mean_device_use, no_devices_device_use, no_min_device_use, no_max_device_use, no_med_device_use = instances
 
     # Write device use summary to file
-    with open('use_out/device_use_hourly.csv', 'a') as f:
+    with output.open('use_out/device_use_hourly.csv', 'a') as f:
         f.write('durations;\nduration totals;{0}\nmean durations;{1}\nno. devices;{2}\nmin duration;{3}\nmax duration;{4}\nmedian duration;{5}\n'.format(dur_total_device_use, dur_mean_device_use, dur_devices_device_use, dur_min_device_use, dur_max_device_use, dur_med_device_use))
         f.write('no. of device uses;\nno. of device uses totals;{0}\nmean no.;{1}\nno. devices;{2}\nmin no.;{3}\nmax no.;{4}\nmedian no.;{5}\n'.format(no_total_device_use, no_mean_device_use, no_devices_device_use, no_min_device_use, no_max_device_use, no_med_device_use))
 
-if __name__ == '__main__':
-    global apps
+def init_report(pathOfAppMappingFile):
+    global practice_table
     global devices_apps_foreground_use
     global devices_apps_foreground_other
-    global devices_use_durations
-    global devices_use_instances
-
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    pathOfAppMappingFile = sys.argv[3]
-    lancs = bool(len(sys.argv) > 4)
+    global devices_use
+    global output
 
-    startTime = datetime.now()
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
-    apps = {}
-    devices_apps_foreground_use = {}
-    devices_apps_foreground_other = {}
-    for app in read_app_mapping(pathOfAppMappingFile):
-        apps[app.FullName] = app.Practice
+    practice_table = read_practice_table(pathOfAppMappingFile)
+    devices_apps_foreground_use = HourlyStats()
+    devices_apps_foreground_other = HourlyStats()
 
-    devices_use_durations = [[] for x in range(0,24)]
-    devices_use_instances = [[] for x in range(0,24)]
+    devices_use = HourlyStats()
 
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('use_out/')
     output_files = ['device_use_hourly.csv', 'app_foreground_use_hourly.csv', 'app_use_totals_hourly.csv', 'app_use_means_hourly.csv', 'app_use_deviceNo_hourly.csv', 'app_use_mins_hourly.csv', 'app_use_maxs_hourly.csv', 'app_use_meds_hourly.csv']
     output_files_other = ['app_foreground_other_hourly.csv', 'app_other_totals_hourly.csv', 'app_other_means_hourly.csv', 'app_other_deviceNo_hourly.csv', 'app_other_mins_hourly.csv', 'app_other_maxs_hourly.csv', 'app_other_meds_hourly.csv']
     for of_name in output_files + output_files_other:
-        with open('use_out/' + of_name, 'w') as f:
+        with output.open('use_out/' + of_name, 'w') as f:
             f.write('')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        parse_file(fullfpath, lancs)
+def finish_report():
+    global output
 
     calculate_print_app_foreground()
     calculate_print_device_use()
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('app_use_time', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    median = pop_option(args, '--median', 'exact')
+    set_median_mode(median)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    pathOfAppMappingFile = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'app_use_time')
+
+    init_report(pathOfAppMappingFile)
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache)
+    options = [str(lancs), median]
+    checkpoint = open_checkpoint(checkpoint_path, 'app_use_time', devices, [pathOfAppMappingFile], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'app_use_time', devices, [pathOfAppMappingFile], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'app_use_time', [pathOfAppMappingFile]), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'app_use_time', devices, [pathOfAppMappingFile], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'app_use_time', [pathOfAppMappingFile]), progress, checkpoint)
+    for device, result in devices_results:
+        merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
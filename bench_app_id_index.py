@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Benchmark of the app id <-> name bookkeeping done for one device by the
+# device parsers: AppIdIndex against the earlier scans of a name -> id dict.
+
+import os
+import sys
+from datetime import datetime
+from da_common import AppIdIndex, read_file, pop_option
+from bench_read_file import write_synthetic_file
+
+def installed_apps(row_value):
+    for app_entry in row_value.split(','):
+        installed_details = app_entry.split('@')
+        if len(installed_details) > 1:
+            app_info = installed_details[1].split(':')
+            yield installed_details[0], app_info[len(app_info) - 2]
+
+def map_with_dict_scans(rows):
+    # The bookkeeping used before AppIdIndex
+    ids_names = {}
+    current_app_name_id_mapping = {}
+    no_of_mapped_rows = 0
+    for entry_type, row_value in rows:
+        entry_val = entry_type.split('|')
+        if entry_type.startswith('net|app'):
+            app_id = entry_val[2]
+            app_name = None
+            for key, val in current_app_name_id_mapping.items():
+                if val == app_id:
+                    app_name = key
+            if app_name != None:
+                no_of_mapped_rows += 1
+        elif entry_type.startswith('app|installed'):
+            for temp_name, temp_app_id in installed_apps(row_value):
+                if temp_app_id not in ids_names:
+                    ids_names[temp_app_id] = temp_name
+                elif ids_names[temp_app_id] != temp_name:
+                    for key, val in current_app_name_id_mapping.items():
+                        if val == temp_app_id and key != temp_name:
+                            current_app_name_id_mapping[key] = ''
+                    ids_names[temp_app_id] = temp_name
+                current_app_name_id_mapping[temp_name] = temp_app_id
+    return no_of_mapped_rows
+
+def map_with_index(rows):
+    app_ids = AppIdIndex()
+    no_of_mapped_rows = 0
+    for entry_type, row_value in rows:
+        entry_val = entry_type.split('|')
+        if entry_type.startswith('net|app'):
+            if app_ids.name(entry_val[2]) != None:
+                no_of_mapped_rows += 1
+        elif entry_type.startswith('app|installed'):
+            for temp_name, temp_app_id in installed_apps(row_value):
+                app_ids.install(temp_name, temp_app_id)
+    return no_of_mapped_rows
+
+def time_mapping(name, mapping, rows):
+    startTime = datetime.now()
+    no_of_mapped_rows = mapping(rows)
+    seconds = (datetime.now() - startTime).total_seconds()
+    print('{0}: {1} net|app rows mapped in {2:.2f}s'.format(name, no_of_mapped_rows, seconds))
+    return seconds
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    no_of_lines = int(pop_option(args, '--lines', 1000000))
+    path = args[1] if len(args) > 1 else 'bench_app_id_index.csv.gz'
+
+    if not os.path.exists(path):
+        print('Writing {0} lines to {1}'.format(no_of_lines, path))
+        write_synthetic_file(path, no_of_lines)
+
+    rows = [(row.EntryType, row.Value.strip()) for row in read_file(path, ['net', 'app'])]
+
+    scans = time_mapping('dict scans', map_with_dict_scans, rows)
+    index = time_mapping('AppIdIndex', map_with_index, rows)
+    print('Speed up per device: {0:.1f}x'.format(scans / index))
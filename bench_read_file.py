@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Microbenchmark of the device file tokenizer in da_common.py against the
+# original reduce/namedtuple reader, on a synthetic gzipped DA log.
+
+import gzip
+import io
+import os
+import sys
+import random
+from datetime import datetime, timedelta
+from functools import reduce
+from da_common import DARecord, read_file, log_filter, pop_option
+
+def write_synthetic_file(path, no_of_lines, seed=1):
+    random.seed(seed)
+    apps = ['com.app{0}'.format(i) for i in range(0,150)]
+    installed = ';'.join('{0}@1.0:{1}:market'.format(app, 10000 + i) for i, app in enumerate(apps))
+    t = datetime(2014, 3, 1, 10, 0, 0)
+    with gzip.open(path, 'wt') as f:
+        for n in range(1, no_of_lines + 1):
+            t += timedelta(seconds=random.randint(0, 30))
+            r = random.random()
+            if r < 0.0005:
+                entry_type, value = 'app|installed', installed
+            elif r < 0.4:
+                entry_type, value = 'net|app|{0}|{1}'.format(random.randint(10000, 10149), random.choice(['rx_bytes', 'tx_bytes'])), random.randint(0, 10**9)
+            elif r < 0.55:
+                entry_type, value = 'app|{0}|importance'.format(random.randint(100, 999)), 'foreground'
+            elif r < 0.65:
+                entry_type, value = random.choice(['screen|power', 'hf|locked']), random.choice(['on', 'off', 'true', 'false'])
+            else:
+                entry_type, value = random.choice(['battery|level', 'wifi|scan', 'location|lat', 'cpu|freq', 'sensor|light']), random.randint(0, 100)
+            f.write('{0};{0};{1}.{2:03d}+0100;{3};{4}\n'.format(n, t.strftime('%Y-%m-%dT%H:%M:%S'), random.randint(0, 999), entry_type, value))
+
+def read_file_reduce(path):
+    # The reader used before the tokenizer, kept as the benchmark baseline
+    with io.TextIOWrapper(io.BufferedReader(gzip.open(path))) as data:
+        for line in data:
+            e = line.split(';')
+            value = reduce(lambda x, y: x + ',' + y, e[4:])
+            repacked = e[0:4] + [value]
+            yield DARecord._make(repacked)
+
+def check_truncated(path, logs_to_parse):
+    """
+    Check that read_file with logs_to_parse keeps the same rows of a gzipped device file
+    cut off half way (as by an interrupted download) as filtering the rows of read_file
+    without logs_to_parse, which reads the lines one at a time.
+    """
+    truncated_path = path + '.truncated.gz'
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(truncated_path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    row_filter = log_filter(logs_to_parse)
+    filtered = list(read_file(truncated_path, logs_to_parse))
+    expected = [row for row in read_file(truncated_path) if row_filter.keep(row.EntryType, row.Value)]
+    os.remove(truncated_path)
+    print('Truncated file: {0} rows read filtered, {1} by lines'.format(len(filtered), len(expected)))
+    return filtered == expected
+
+def time_reader(name, rows):
+    startTime = datetime.now()
+    no_of_rows = 0
+    for row in rows:
+        no_of_rows += 1
+    seconds = (datetime.now() - startTime).total_seconds()
+    print('{0}: {1} rows yielded in {2:.2f}s'.format(name, no_of_rows, seconds))
+    return seconds
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    no_of_lines = int(pop_option(args, '--lines', 10000000))
+    path = args[1] if len(args) > 1 else 'bench_read_file.csv.gz'
+
+    if not os.path.exists(path):
+        print('Writing {0} lines to {1}'.format(no_of_lines, path))
+        write_synthetic_file(path, no_of_lines)
+
+    baseline = time_reader('reduce reader', read_file_reduce(path))
+    tokenizer = time_reader('read_file', read_file(path))
+    filtered = time_reader("read_file, logs_to_parse ['app', 'screen', 'hf']", read_file(path, ['app', 'screen', 'hf']))
+    print('Speed up: {0:.2f}x, filtered: {1:.2f}x'.format(baseline / tokenizer, baseline / filtered))
+
+    if not check_truncated(path, ['app', 'screen', 'hf']):
+        print('Rows of the truncated file differ')
+        sys.exit(1)
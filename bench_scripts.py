@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Benchmark of the analysis scripts on a synthetic Device Analyzer data set.
+# Writes the data set (device files, device ids file and mapping files) at the
+# requested scale if it does not exist, then runs the main path of each script
+# in a fresh process and reports rows/sec, peak RSS and the time of each phase.
+# Every run is appended to a JSON results file and compared with the previous
+# run on the same data set.
+
+import os
+import io
+import sys
+import gzip
+import json
+import random
+import resource
+import platform
+import importlib
+import contextlib
+import multiprocessing
+from collections import namedtuple
+from datetime import datetime, timedelta
+from time import perf_counter
+from da_common import list_devices, parse_devices, read_device_file, pop_option
+
+# Scale of a synthetic data set: no. of devices, days of logging per device, no. of
+# installed apps, net|app samples per hour, sms and phone calls per day, and whether
+# the device files are plain Lancaster csv files instead of gzipped DA logs
+DatasetConfig = namedtuple('DatasetConfig', ('Devices', 'Days', 'Apps', 'AppDataRate', 'SmsRate', 'PhoneRate', 'Lancs', 'Seed'))
+
+# Name: the script benchmarked; Mapping: index of the mapping file its init_report
+# takes (as in report_engine.REPORTS), or None if it takes none
+BenchScript = namedtuple('BenchScript', ('Name', 'Mapping', 'Windowed'))
+SCRIPTS = [
+    BenchScript('all_data_foreground', None, False),
+    BenchScript('parse_everything', 0, False),
+    BenchScript('overall_summary', 0, False),
+    BenchScript('app_use_time', 0, False),
+    BenchScript('data_sms_phonecalls', 1, False),
+    BenchScript('day_of_week_totals', 0, True),
+    BenchScript('practice_data_demand', 0, False),
+    BenchScript('output_anomaly', None, True),
+    BenchScript('device_count_hours_days', None, False),
+    BenchScript('app_installs', 0, True),
+    # Every report in a single pass
+    BenchScript('report_engine', None, False),
+]
+
+PRACTICES = ['Watching', 'Social', 'Communicating', 'Browsing', 'Gaming']
+BACKGROUND_TYPES = ['battery|level', 'wifi|scan', 'location|lat', 'net|mobile|rx_bytes', 'cpu|freq']
+
+def synthetic_apps(no_of_apps):
+    # The apps device_count_hours_days.py counts are always installed
+    apps = ['com.facebook.katana', 'com.snapchat.android']
+    return (apps + ['com.bench.app{0}'.format(i) for i in range(0, max(no_of_apps - len(apps), 0))])[:max(no_of_apps, 1)]
+
+def device_events(config, apps, start):
+    """
+    Return (time, kind, arg) of the events of one device, in time order: per day, the
+    app data samples, foreground apps, screen and lock changes, sms and phone calls,
+    background logs and a list of the installed apps.
+    """
+    events = []
+    for day in range(0, config.Days):
+        day_start = start + timedelta(days=day)
+        def at():
+            return day_start + timedelta(seconds=random.uniform(0, 86400))
+        events.append((day_start, 'installed', None))
+        for sample in range(0, config.AppDataRate * 24):
+            for app in random.sample(apps, min(len(apps), random.randint(1, 3))):
+                events.append((day_start + timedelta(seconds=(sample + random.random()) * 3600 / config.AppDataRate), 'data', app))
+        for switch in range(0, random.randint(40, 120)):
+            events.append((at(), 'foreground', random.choice(apps)))
+        for change in range(0, random.randint(20, 60)):
+            events.append((at(), 'screen', None))
+            events.append((at(), 'locked', None))
+        for sms in range(0, random.randint(0, 2 * config.SmsRate)):
+            events.append((at(), 'sms', random.randint(0, 1)))
+        for call in range(0, random.randint(0, 2 * config.PhoneRate)):
+            call_start = at()
+            events.append((call_start, 'offhook', None))
+            events.append((call_start + timedelta(seconds=random.randint(10, 1800)), 'idle', None))
+        for log in range(0, 24 * 20):
+            events.append((at(), 'background', random.choice(BACKGROUND_TYPES)))
+    events.sort(key=lambda event: event[0])
+    return events
+
+def device_lines(config, apps, start):
+    # The lines of one synthetic device file
+    uids = dict((app, 10000 + i) for i, app in enumerate(apps))
+    separator = ',' if config.Lancs else ';'
+    installed = separator.join('{0}@1.0:{1}:market'.format(app, uids[app]) for app in apps)
+    counters = dict((app, [random.randint(0, 1000), random.randint(0, 1000)]) for app in apps)
+    sms = [0, 0]
+    n = 0
+    for t, kind, arg in device_events(config, apps, start):
+        rows = []
+        if kind == 'installed':
+            rows.append(('app|installed', installed))
+        elif kind == 'data':
+            for k, label in enumerate(('rx_bytes', 'tx_bytes')):
+                # Counters occasionally restart, as after a reboot
+                counters[arg][k] = random.randint(0, 100) if random.random() < 0.01 else counters[arg][k] + random.randint(0, 50000)
+                rows.append(('net|app|{0}|{1}'.format(uids[arg], label), counters[arg][k]))
+        elif kind == 'foreground':
+            pid = random.randint(100, 999)
+            rows.append(('app|{0}|importance'.format(pid), 'foreground'))
+            rows.append(('app|{0}|name'.format(pid), arg + ':' + arg))
+        elif kind == 'screen':
+            rows.append(('screen|power', random.choice(['on', 'off'])))
+        elif kind == 'locked':
+            rows.append(('hf|locked', random.choice(['true', 'false'])))
+        elif kind == 'sms':
+            sms[arg] += random.randint(1, 2)
+            rows.append(('sms|count|' + ('inbox', 'sent')[arg], sms[arg]))
+        elif kind == 'offhook' or kind == 'idle':
+            rows.append(('phone|' + kind, ''))
+        else:
+            rows.append((arg, random.randint(0, 100)))
+        for entry_type, value in rows:
+            n += 1
+            date = t.strftime('%Y-%m-%dT%H:%M:%S') + '.{0:03d}+0100'.format(random.randint(0, 999))
+            if random.random() < 0.001:
+                date = '(invalid date)'
+            yield '{0};{0};{1};{2};{3}\n'.format(n, date, entry_type, value)
+
+def write_synthetic_dataset(path, config):
+    """
+    Write a synthetic data set to the directory path: a device file per device, the
+    device ids file (ids.txt, or ids_lancs.txt for Lancaster files), the app practice
+    mapping (mapping.csv) and the app list (applist.csv). Returns the no. of rows written.
+    """
+    random.seed(config.Seed)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    apps = synthetic_apps(config.Apps)
+    fnames = ['device{0:04d}'.format(d) for d in range(0, config.Devices)]
+    no_of_rows = 0
+    for d, fname in enumerate(fnames):
+        start = datetime(2014, 3, 1, random.randint(0, 23), random.randint(0, 59), 0) + timedelta(days=d % 30)
+        if config.Lancs:
+            f = open(os.path.join(path, fname + '.csv'), 'w')
+        else:
+            f = gzip.open(os.path.join(path, fname + '.csv.gz'), 'wt')
+        with f:
+            for line in device_lines(config, apps, start):
+                f.write(line)
+                no_of_rows += 1
+    with open(os.path.join(path, 'ids_lancs.txt' if config.Lancs else 'ids.txt'), 'w') as f:
+        for d, fname in enumerate(fnames):
+            f.write(fname + '\n' if config.Lancs else '{0} {1} 2014-01-01 2014-03-01 40 0.9 10 1 0.9\n'.format(d, fname))
+    with open(os.path.join(path, 'mapping.csv'), 'w') as f:
+        for i, app in enumerate(apps):
+            f.write('{0};{1};{2}\n'.format(app, app.split('.')[-1].capitalize(), PRACTICES[i % len(PRACTICES)]))
+    with open(os.path.join(path, 'applist.csv'), 'w') as f:
+        for app in apps:
+            f.write(app + '\n')
+    return no_of_rows
+
+def dataset_paths(path, config):
+    # (device ids file, path of device files, mapping files) of a data set
+    ids = os.path.join(path, 'ids_lancs.txt' if config.Lancs else 'ids.txt')
+    return ids, path + os.sep, (os.path.join(path, 'mapping.csv'), os.path.join(path, 'applist.csv'))
+
+def open_dataset(path, config):
+    """
+    Return the description of the data set of config in the directory path, writing
+    the data set first unless the directory already holds it.
+    """
+    manifest_path = os.path.join(path, 'dataset.json')
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['Config'] == config._asdict():
+            return manifest
+    except (OSError, ValueError):
+        pass
+    print('Writing synthetic data set to {0}'.format(path))
+    no_of_rows = write_synthetic_dataset(path, config)
+    ids, pathOfFiles, mapping_paths = dataset_paths(path, config)
+    size = sum(os.path.getsize(device.Path) for device in list_devices(ids, pathOfFiles, config.Lancs))
+    manifest = {'Config': config._asdict(), 'Rows': no_of_rows, 'Bytes': size}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+def script_reports(script, mapping_paths):
+    """
+    Return the (report, module) pairs a benchmarked script runs, after init_report, as
+    report_engine.py does: all reports for report_engine, else just the script itself.
+    """
+    import report_engine
+    if script.Name == 'report_engine':
+        modules = report_engine.init_reports(report_engine.REPORTS, mapping_paths)
+        report_engine.selected_modules = modules
+        return modules
+    module = importlib.import_module(script.Name)
+    if script.Mapping == None:
+        module.init_report()
+    else:
+        module.init_report(mapping_paths[script.Mapping])
+    return [(script, module)]
+
+def run_script(script, path, config, workers):
+    """
+    Run the main path of script on the data set in path, in the current process, and
+    return its timings. The phases are:
+      Read: decompressing and splitting the rows the script keeps, as a separate pass
+      Parse: the device parsers, less the Read pass (with workers > 1, wall time of
+        the parallel parse including reading)
+      Summarise: init_report, merging the device results and finish_report, less Write
+      Write: writing the output files
+    """
+    import report_engine
+    ids, pathOfFiles, mapping_paths = dataset_paths(path, config)
+    devices = list_devices(ids, pathOfFiles, config.Lancs)
+    work = os.path.join(path, 'out', script.Name)
+    if not os.path.isdir(work):
+        os.makedirs(work)
+    os.chdir(work)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        modules = script_reports(script, mapping_paths)
+        init_seconds = perf_counter() - start
+
+        logs = report_engine.reports_logs_to_parse(modules)
+        packages = report_engine.reports_packages_to_parse(modules)
+        start = perf_counter()
+        no_of_kept_rows = 0
+        for device in devices:
+            for row in read_device_file(device.Path, device.Lancs, None, logs, packages):
+                no_of_kept_rows += 1
+        read_seconds = perf_counter() - start
+
+        if script.Name == 'report_engine':
+            parse_device_file = report_engine.parse_device_file
+        else:
+            parse_device_file = modules[0][1].parse_device_file
+        parse_seconds = 0.0
+        merge_seconds = 0.0
+        start = perf_counter()
+        for device, result in parse_devices(parse_device_file, devices, workers):
+            merge_start = perf_counter()
+            parse_seconds += merge_start - start
+            if script.Name == 'report_engine':
+                report_engine.merge_device(modules, device.FileName, result[0], result[1])
+            elif script.Windowed and result == None:
+                modules[0][1].ignore_device(device.FileName)
+            else:
+                modules[0][1].merge_device_result(result)
+            start = perf_counter()
+            merge_seconds += start - merge_start
+
+        for report, module in modules:
+            module.finish_report()
+        finish_seconds = perf_counter() - start
+
+    write_seconds = sum(module.output.seconds() for report, module in modules)
+    phases = {'Read': read_seconds,
+              'Parse': parse_seconds if workers > 1 else max(parse_seconds - read_seconds, 0.0),
+              'Summarise': init_seconds + merge_seconds + finish_seconds - write_seconds,
+              'Write': write_seconds}
+    return {'Seconds': init_seconds + parse_seconds + merge_seconds + finish_seconds, 'KeptRows': no_of_kept_rows, 'Phases': phases}
+
+def bench_script(script, path, config, workers):
+    # run_script in a fresh process, with the peak RSS of the process and its workers
+    timings = run_script(script, path, config, workers)
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in KB on Linux
+    timings['PeakRSS'] = peak_rss * 1024
+    return timings
+
+def previous_run(runs, dataset, workers):
+    # The last run on the same data set with the same no. of workers, or None
+    for run in reversed(runs):
+        if run['Dataset']['Config'] == dataset['Config'] and run['Workers'] == workers:
+            return run
+    return None
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    results_path = pop_option(args, '--results', 'bench_scripts.json')
+    script_names = pop_option(args, '--scripts')
+    devices = int(pop_option(args, '--devices', 20))
+    days = int(pop_option(args, '--days', 30))
+    apps = int(pop_option(args, '--apps', 60))
+    app_data_rate = int(pop_option(args, '--app-data-rate', 12))
+    sms_rate = int(pop_option(args, '--sms-rate', 10))
+    phone_rate = int(pop_option(args, '--phone-rate', 4))
+    seed = int(pop_option(args, '--seed', 1))
+
+    # The positional args are only worked out once every option is popped
+    if len(args) > 3 or any(arg.startswith('--') for arg in args[1:]):
+        print('Usage: ' + args[0] + ' [data directory] [lancs] [--devices N] [--days N] [--apps N] [--app-data-rate N] [--sms-rate N] [--phone-rate N] [--seed N] [--scripts name,name,...] [--workers N] [--results file]')
+        sys.exit(1)
+
+    config = DatasetConfig(Devices=devices, Days=days, Apps=apps, AppDataRate=app_data_rate,
+                           SmsRate=sms_rate, PhoneRate=phone_rate, Lancs=bool(len(args) > 2), Seed=seed)
+    path = os.path.abspath(args[1] if len(args) > 1 else 'bench_scripts_data')
+
+    scripts = SCRIPTS
+    if script_names != None:
+        scripts = [script for script in SCRIPTS if script.Name in script_names.split(',')]
+
+    dataset = open_dataset(path, config)
+    print('Data set: {0} devices, {1} rows, {2} bytes of device files'.format(config.Devices, dataset['Rows'], dataset['Bytes']))
+
+    runs = []
+    if os.path.exists(results_path):
+        with open(results_path, 'r') as f:
+            runs = json.load(f)
+    previous = previous_run(runs, dataset, workers)
+
+    run = {'Started': datetime.now().isoformat(), 'Python': platform.python_version(), 'Workers': workers, 'Dataset': dataset, 'Scripts': {}}
+    for script in scripts:
+        # Each script runs in a new interpreter, so its globals and peak RSS are its own
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            timings = pool.apply(bench_script, (script, path, config, workers))
+        timings['RowsPerSecond'] = dataset['Rows'] / timings['Seconds']
+        run['Scripts'][script.Name] = timings
+
+        phases = timings['Phases']
+        line = '{0}: {1:.2f}s, {2:.0f} rows/s, peak RSS {3:.1f} MB (read {4:.2f}s, parse {5:.2f}s, summarise {6:.2f}s, write {7:.2f}s)'.format(
+            script.Name, timings['Seconds'], timings['RowsPerSecond'], timings['PeakRSS'] / 1048576.0,
+            phases['Read'], phases['Parse'], phases['Summarise'], phases['Write'])
+        if previous != None and script.Name in previous['Scripts']:
+            line += ', {0:+.1f}% vs {1}'.format(100.0 * (timings['Seconds'] / previous['Scripts'][script.Name]['Seconds'] - 1), previous['Started'])
+        print(line)
+
+    runs.append(run)
+    tmp_path = results_path + '.tmp{0}'.format(os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(runs, f, indent=1)
+    os.replace(tmp_path, results_path)
+    print('Results appended to {0}'.format(results_path))
@@ -0,0 +1,1316 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Readers and helpers shared by the analysis scripts and report_engine.py.
+
+import gzip
+import zlib
+import sys
+import os
+import csv
+import io
+import re
+import json
+import pickle
+import shutil
+import hashlib
+import time
+import itertools
+import atexit
+import heapq
+import glob
+import multiprocessing
+import dateutil.parser
+import numpy as np
+from array import array
+from collections import namedtuple, OrderedDict, deque
+from datetime import datetime, timedelta
+
+fields_da = ('Entry','Num','Date','EntryType','Value')
+
+class DARecord(namedtuple('DARecord', fields_da)):
+    """
+    A row of a device file. Hour, Number and Time decode the Date and Value fields as
+    the device parsers use them, from the text when they are asked for; rows read from
+    the event cache (see event_cache.CachedRecord) have them decoded already.
+    """
+    __slots__ = ()
+
+    @property
+    def Hour(self):
+        # Local hour of Date (after the 'T' of the date and time)
+        return int(self.Date.rsplit('T')[1].split(':')[0])
+
+    @property
+    def Number(self):
+        # Value as an integer, e.g. the byte counts of net|app rows
+        return int(self.Value)
+
+    @property
+    def Time(self):
+        # The DATime of Date (see decode_time)
+        return decode_time(self.Date)
+
+    @property
+    def Id(self):
+        # First numeric item of EntryType (the pid of app logs, the uid of net|app logs), or -1
+        return entry_type_id(self.EntryType)
+
+def entry_type_id(entry_type):
+    for item in entry_type.split('|'):
+        if item.isdecimal():
+            return int(item)
+    return -1
+INSTALLED_TYPE = 'app|installed'
+
+class RowFilter(object):
+    """
+    Rows of a device file to decode: those whose EntryType is one of entry_types or
+    starts with one of them and '|', so 'net' keeps every net log and 'net|app' only
+    the app data rows. If packages is given, app|installed rows are only kept if they
+    name one of the packages.
+
+    line_pattern matches the lines of the kept rows, so gzipped device files are read
+    a block at a time and the lines of the other rows are skipped without being split
+    (see filtered_blocks).
+    """
+    def __init__(self, entry_types, packages=None):
+        self.entry_types = tuple(entry_types)
+        self.packages = None if packages == None else tuple(packages)
+        self.kept_types = {}
+        kept = '(?:{0})[|;]'.format('|'.join(re.escape(entry_type) for entry_type in self.entry_types))
+        if self.packages != None:
+            installed = re.escape(INSTALLED_TYPE) + '[|;]'
+            kept = '(?!{0}){1}'.format(installed, kept)
+            if self.keep_type(INSTALLED_TYPE):
+                kept = '{0}|{1}.*(?:{2})'.format(kept, installed, '|'.join(re.escape(package) for package in self.packages))
+        self.line_pattern = re.compile('[^;]*;[^;]*;[^;]*;(?:{0})'.format(kept))
+
+    def keep_type(self, entry_type):
+        kept = self.kept_types.get(entry_type)
+        if kept == None:
+            kept = any(entry_type == kept_type or entry_type.startswith(kept_type + '|') for kept_type in self.entry_types)
+            self.kept_types[entry_type] = kept
+        return kept
+
+    def keep(self, entry_type, value):
+        if not self.keep_type(entry_type):
+            return False
+        if self.packages != None and (entry_type == INSTALLED_TYPE or entry_type.startswith(INSTALLED_TYPE + '|')):
+            return any(package in value for package in self.packages)
+        return True
+
+    def keep_line(self, line):
+        # Lines of under five fields are kept so that they fail to decode
+        e = line.split(';', 4)
+        return len(e) < 5 or self.keep(e[3], e[4])
+
+def log_filter(logs_to_parse, packages=None):
+    # The RowFilter of logs_to_parse (log names or entry types), or None to keep every row
+    if logs_to_parse == None or isinstance(logs_to_parse, RowFilter):
+        return logs_to_parse
+    return RowFilter(logs_to_parse, packages)
+
+class RowRoutes(object):
+    """
+    Routes the rows of a device file to the device parsers which read them, given as
+    (logs_to_parse, send) pairs, logs_to_parse being None for a parser of every row. A
+    row is sent only to the parsers whose logs_to_parse keep its entry type, as if each
+    had read the file alone; the sends of each entry type are worked out once.
+    """
+    def __init__(self, parsers):
+        self.parsers = [(log_filter(logs_to_parse), send) for logs_to_parse, send in parsers]
+        self.routes = {}
+
+    def sends(self, entry_type):
+        sends = self.routes.get(entry_type)
+        if sends == None:
+            sends = tuple(send for keep, send in self.parsers if keep == None or keep.keep_type(entry_type))
+            self.routes[entry_type] = sends
+        return sends
+
+    def send(self, row):
+        for send in self.sends(row.EntryType):
+            send(row)
+
+# Device files are searched for the lines to keep in blocks of this many characters
+FILTER_BLOCK = 1 << 20
+
+def filtered_blocks(data, row_filter, reopen):
+    """
+    Yield iterables of the lines of the text stream data which row_filter keeps, reading
+    a block of the text at a time and matching its lines with line_pattern. Blocks with a
+    line of under five fields are checked line by line with keep_line instead. If the text
+    fails to decode, or a truncated or corrupt gzip stream fails to decompress part way
+    through a block, reopen() is called for a new stream of it, which is also checked line
+    by line from the first line not yet read, so that the lines before the failure are
+    kept and reading fails where it does when the lines are read one at a time.
+    """
+    match = row_filter.line_pattern.match
+    newlines = itertools.repeat('\n')
+    separators = itertools.repeat(';')
+    read_lines = 0
+    rest = ''
+    try:
+        block = data.read(FILTER_BLOCK)
+        while block:
+            text = rest + block
+            end = text.rfind('\n')
+            rest = text[end + 1:]
+            if end >= 0:
+                lines = text[:end].split('\n')
+                if min(map(str.count, lines, separators)) >= 4:
+                    yield map(str.__add__, filter(match, lines), newlines)
+                else:
+                    yield filter(row_filter.keep_line, map(str.__add__, lines, newlines))
+                read_lines += len(lines)
+            block = data.read(FILTER_BLOCK)
+    except (UnicodeDecodeError, EOFError, zlib.error, OSError):
+        with reopen() as data:
+            yield filter(row_filter.keep_line, itertools.islice(data, read_lines, None))
+        return
+    # The last line of the file may have no '\n'
+    if rest:
+        yield filter(row_filter.keep_line, [rest])
+
+def decode_lines(data, logs_to_parse=None, packages=None, reopen=None):
+    """
+    Yield the rows of the lines of a device file. Each line is split at its first four
+    ';' only. If logs_to_parse (and packages) are given, only the rows kept by their
+    RowFilter are yielded; given reopen, a function returning a new stream of the same
+    lines, the other lines are skipped before being split (see filtered_blocks).
+    """
+    row_filter = log_filter(logs_to_parse, packages)
+    if row_filter != None and reopen != None:
+        data = itertools.chain.from_iterable(filtered_blocks(data, row_filter, reopen))
+    elif row_filter != None:
+        data = filter(row_filter.keep_line, data)
+    make_record = tuple.__new__
+    for line in data:
+        e = line.split(';', 4)
+        if len(e) < 5:
+            raise ValueError('Expected 5 items, got {0}: {1}'.format(len(e), line[:20]))
+        #Repack variable number of items per line into five expected items
+        #(Problem is internal DA format uses ';' to separate csv items as well
+        # as to separate app names inside the 'Value' field.)
+        value = e[4]
+        if ';' in value:
+            e[4] = value.replace(';', ',')
+        yield make_record(DARecord, e)
+
+# The Profiler of the run (see profiling.py), or None if the run is not profiled
+profiler = None
+
+def profile_rows(rows):
+    # rows, timed and counted by the profiler while a device is parsed
+    return rows if profiler == None else profiler.rows(rows)
+
+def profile_stream(data):
+    # The file object data, timed by the profiler while a device is parsed
+    return data if profiler == None else profiler.stream(data)
+
+class ReadCounts(object):
+    # Bytes (decompressed) and rows of the device files read while parsing a device
+    def __init__(self):
+        self.bytes = 0
+        self.rows = 0
+
+# The ReadCounts of the device being parsed, or None if the progress is not reported
+read_counts = None
+
+class CountedStream(io.RawIOBase):
+    # Adds the bytes and lines read from the file object data to counts
+    def __init__(self, data, counts):
+        self.data = data
+        self.counts = counts
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.data.readinto(b)
+        if n:
+            self.counts.bytes += n
+            self.counts.rows += bytes(b[:n]).count(b'\n')
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.data.close()
+        io.RawIOBase.close(self)
+
+def device_stream(data):
+    # The (decompressed) file object data of a device file, counted and profiled if needed
+    if read_counts != None:
+        data = CountedStream(data, read_counts)
+    return profile_stream(data)
+
+def open_device_text(path):
+    # Open a plain text device file, as open(path, 'r') but counted and profiled if needed
+    if read_counts == None and profiler == None:
+        return open(path, 'r')
+    return io.TextIOWrapper(io.BufferedReader(device_stream(io.FileIO(path, 'r'))))
+
+def decode_file(path, logs_to_parse=None, packages=None):
+    # Yield the rows of a gzipped device file (see decode_lines)
+    def reopen():
+        return io.TextIOWrapper(io.BufferedReader(device_stream(gzip.open(path))))
+    with reopen() as data:
+        for row in decode_lines(data, logs_to_parse, packages, reopen):
+            yield row
+
+def read_file(path, logs_to_parse=None, packages=None):
+    try:
+        for row in decode_file(path, logs_to_parse, packages):
+            yield row
+    except Exception as ex:
+        print(ex)
+        print('Failed to read file: ' + path)
+
+fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
+FileNameRecord = namedtuple('FileNameRecord', fields_filename)
+def read_file_names(path):
+    with open(path, 'r') as data:
+        csv.field_size_limit(sys.maxsize)
+        reader = csv.reader(data, delimiter=' ')
+        for row in map(FileNameRecord._make, reader):
+            yield row
+
+fields_lancs = ('Entry','Num','Date','EntryType','Value')
+DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
+def decode_file_lancs(path, logs_to_parse=None, packages=None):
+    row_filter = log_filter(logs_to_parse, packages)
+    with open_device_text(path) as data:
+        csv.field_size_limit(sys.maxsize)
+        reader = csv.reader(data, delimiter=';')
+        for row in map(DARecord._make, reader):
+            if row_filter != None and not row_filter.keep(row.EntryType, row.Value):
+                continue
+            yield row
+
+def read_file_lancs(path, logs_to_parse=None, packages=None):
+    try:
+        for row in decode_file_lancs(path, logs_to_parse, packages):
+            yield row
+    except Exception as ex:
+        print(ex)
+        print('Failed to read file: ' + path)
+
+FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
+def read_file_names_lancs(path):
+    with open(path, 'r') as data:
+        csv.field_size_limit(sys.maxsize)
+        reader = csv.reader(data, delimiter='\n')
+        for row in map(FileNameRecordLancs._make, reader):
+            yield row
+
+AppRecord = namedtuple('AppRecord', ('FullName', 'Name', 'Practice'))
+def read_app_mapping(path):
+    with open(path, 'r') as data:
+        csv.field_size_limit(sys.maxsize)
+        reader = csv.reader(data, delimiter=';')
+        for row in map(AppRecord._make, reader):
+            yield row
+
+class PracticeTable(object):
+    """
+    A mapping file compiled to integer codes, read once by init_report. Each app has an
+    app code (in order of first appearance in the file, as names) and each practice a
+    practice code (likewise, as practices), and app_practice[app code] is the practice
+    code of the app; as with a dict of the file, the last record of an app wins.
+    """
+    def __init__(self, records):
+        self.app_codes = {}
+        self.names = []
+        self.practices = []
+        self.practice_codes = {}
+        app_practice = []
+        for record in records:
+            practice = self.practice_codes.get(record.Practice)
+            if practice == None:
+                practice = len(self.practices)
+                self.practice_codes[record.Practice] = practice
+                self.practices.append(record.Practice)
+            app = self.app_codes.get(record.FullName)
+            if app == None:
+                self.app_codes[record.FullName] = len(self.names)
+                self.names.append(record.FullName)
+                app_practice.append(practice)
+            else:
+                app_practice[app] = practice
+        self.app_practice = np.array(app_practice, dtype=np.int64)
+
+    def __contains__(self, app):
+        return app in self.app_codes
+
+    def practice_code(self, app):
+        # Practice code of an app, or -1 if it is not in the mapping
+        app = self.app_codes.get(app)
+        return -1 if app == None else int(self.app_practice[app])
+
+    def practice_name(self, app):
+        app = self.app_codes.get(app)
+        return None if app == None else self.practices[self.app_practice[app]]
+
+    def practice_codes_of(self, apps):
+        # Practice codes of apps as an array, -1 for those not in the mapping
+        codes = np.array([self.app_codes.get(app, -1) for app in apps], dtype=np.int64)
+        if not self.names:
+            return codes
+        return np.where(codes < 0, -1, self.app_practice[codes])
+
+def read_practice_table(path):
+    return PracticeTable(read_app_mapping(path))
+
+def practice_rollup(codes, values):
+    """
+    Sum the rows of values (one per app, of shape (apps, ...)) by the practice codes in
+    codes, in one np.add.at with the rows added in order. Returns the codes present, in
+    order of first appearance in codes, and their sums; rows of code -1 are left out.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    kept = codes >= 0
+    codes = codes[kept]
+    values = values[kept]
+    sums = np.zeros((int(codes.max()) + 1 if len(codes) else 0,) + values.shape[1:])
+    np.add.at(sums, codes, values)
+    present, first = np.unique(codes, return_index=True)
+    present = present[np.argsort(first)]
+    return present, sums[present]
+
+def decode_device_file(path, lancs, logs_to_parse=None, packages=None):
+    return decode_file_lancs(path, logs_to_parse, packages) if lancs else decode_file(path, logs_to_parse, packages)
+
+def read_device_file(path, lancs, cache=None, logs_to_parse=None, packages=None):
+    if cache != None:
+        # Imported here as event_cache builds on the decoders above
+        from event_cache import read_cached_file
+        return profile_rows(read_cached_file(path, lancs, cache, logs_to_parse, packages))
+    return profile_rows(read_file_lancs(path, logs_to_parse, packages) if lancs else read_file(path, logs_to_parse, packages))
+
+def read_device_names(path, lancs):
+    return read_file_names_lancs(path) if lancs else read_file_names(path)
+
+def device_file_path(pathOfFiles, fname, lancs):
+    fullfpath = pathOfFiles + fname + '.csv'
+    if not lancs:
+        fullfpath = fullfpath + '.gz'
+    return fullfpath
+
+# Cache: directory of the columnar event cache to read the device file through (None to read it directly)
+# Index: directory of the device index sidecars (None if the device files are not indexed)
+Device = namedtuple('Device', ('Path', 'Lancs', 'FileName', 'Cache', 'Index'), defaults=(None, None))
+def list_devices(pathOfIdsFile, pathOfFiles, lancs, cache=None, index=None):
+    return [Device(device_file_path(pathOfFiles, file.FileName, lancs), lancs, file.FileName, cache, index) for file in read_device_names(pathOfIdsFile, lancs)]
+
+class AppIdIndex(object):
+    """
+    Index of the app names and ids of a device, from its app|installed logs.
+
+    install(name, id) records the current id of an app. With clear_stale, when an id
+    is installed for a different app than the one it was last installed for, the apps
+    still holding the id lose it (their id becomes ''), as an id is reused for a new app.
+    name(id) returns the app currently holding an id, or None. If several apps hold the
+    same id (possible without clear_stale), it returns the one first installed last, as
+    a scan of a name->id dict in insertion order keeping the last match would.
+    rows[name] is the install order of an app, for indexing per-app arrays.
+    """
+    def __init__(self, clear_stale=True):
+        self.clear_stale = clear_stale
+        self.ids = {}            # app name -> current id
+        self.names = {}          # id -> {app name: install order} of the apps holding it
+        self.last_installed = {} # id -> app name it was last installed for
+        self.rows = {}           # app name -> install order
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def items(self):
+        return self.ids.items()
+
+    def name(self, app_id):
+        holders = self.names.get(app_id)
+        if not holders:
+            return None
+        if len(holders) == 1:
+            for name in holders:
+                return name
+        return max(holders, key=holders.get)
+
+    def set_id(self, name, app_id):
+        old_id = self.ids.get(name)
+        if old_id == app_id:
+            return
+        order = len(self.ids)
+        if old_id != None:
+            order = self.names[old_id].pop(name)
+        else:
+            self.rows[name] = order
+        self.ids[name] = app_id
+        self.names.setdefault(app_id, {})[name] = order
+
+    def install(self, name, app_id):
+        if self.clear_stale:
+            # Remove old mapping if it exists
+            if app_id not in self.last_installed:
+                self.last_installed[app_id] = name
+            elif self.last_installed[app_id] != name:
+                for key in [key for key in self.names.get(app_id, ()) if key != name]:
+                    self.set_id(key, '')
+                self.last_installed[app_id] = name
+        self.set_id(name, app_id)
+
+class AppHourlyCounts(object):
+    """
+    Counts of a device (e.g. rx and tx bytes) by app, day, hour and field, summed into
+    an (apps, days, 24, fields) int64 array. Apps are indexed by their AppIdIndex row.
+    add() only buffers the increment; totals(no_of_apps) sums them all with np.add.at.
+    """
+    def __init__(self, days=7, fields=2):
+        self.days = days
+        self.fields = fields
+        self.indices = array('q')
+        self.counts = array('q')
+
+    def add(self, row, day, hour, field, count):
+        self.indices.append(((row * self.days + day) * 24 + hour) * self.fields + field)
+        self.counts.append(count)
+
+    def totals(self, no_of_apps):
+        totals = np.zeros((no_of_apps, self.days, 24, self.fields), dtype=np.int64)
+        np.add.at(totals.reshape(-1), np.frombuffer(self.indices, dtype=np.int64), np.frombuffer(self.counts, dtype=np.int64))
+        return totals
+
+class AppHourlySums(object):
+    """
+    Hourly values of devices (e.g. app means) summed by app across devices, in an (apps, 24)
+    float64 array with the apps in the order first added (names). add(app, values) adds
+    the 24 values of one device, so each sum is added up a device at a time in the same
+    order as sum() of a list of the device values.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.names = []
+        self.sums = np.zeros((64, 24))
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, app, values):
+        row = self.rows.get(app)
+        if row == None:
+            row = len(self.names)
+            if row == len(self.sums):
+                self.sums = np.concatenate((self.sums, np.zeros_like(self.sums)))
+            self.rows[app] = row
+            self.names.append(app)
+        self.sums[row] += values
+
+    def totals(self):
+        return self.sums[:len(self.names)]
+
+def hourly_totals(sums):
+    # Totals by hour of the rows of an (apps, 24) array, as floats (int zeros without apps)
+    if not len(sums):
+        return [0 for hour in range(0,24)]
+    return sums.sum(axis=0).tolist()
+
+def make_sure_path_exists(path):
+    try:
+        os.makedirs(path)
+    except OSError as exception:
+        print('Output path exists')
+
+# Temp files of the output files not yet closed, removed if the script exits before
+# closing them (e.g. when it stops on a bad option), so none are left next to outputs
+open_tmp_paths = set()
+
+def remove_open_tmp_files():
+    for tmp_path in list(open_tmp_paths):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+atexit.register(remove_open_tmp_files)
+
+def remove_stale_tmp_files(path):
+    """
+    Remove the temp files of path (path.tmp<pid>) left by runs which were killed before
+    they could remove them (e.g. by SIGKILL), those of live processes being kept.
+    """
+    for tmp_path in glob.glob(glob.escape(path) + '.tmp*'):
+        pid = tmp_path[len(path) + 4:]
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except OSError:
+            continue
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+class OutputFile(object):
+    """
+    An output file written through a temp file, which replaces the file when it is
+    closed. Counts the bytes and rows (lines) written since it was last truncated,
+    and the seconds spent writing it. Temp files of the file left by killed runs are
+    removed when it is opened, so a --resume after a SIGKILL leaves none behind.
+    """
+    def __init__(self, path, mode):
+        start = time.perf_counter()
+        self.path = path
+        self.tmp_path = path + '.tmp{0}'.format(os.getpid())
+        remove_stale_tmp_files(path)
+        self.file = open(self.tmp_path, 'wb', buffering=1048576)
+        open_tmp_paths.add(self.tmp_path)
+        self.bytes = 0
+        self.rows = 0
+        # Appending keeps the content of an existing file, as open(path, 'a') would
+        if mode == 'a' and os.path.exists(path):
+            with open(path, 'rb') as old:
+                shutil.copyfileobj(old, self.file)
+        self.seconds = time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # The file stays open for later writes until the sink is closed
+        return False
+
+    def write(self, text):
+        start = time.perf_counter()
+        data = text.encode('utf-8')
+        self.file.write(data)
+        self.bytes += len(data)
+        self.rows += text.count('\n')
+        self.seconds += time.perf_counter() - start
+
+    def truncate(self):
+        self.file.seek(0)
+        self.file.truncate()
+        self.bytes = 0
+        self.rows = 0
+
+    def snapshot(self):
+        # (content, rows, bytes) written so far, for checkpoints
+        self.file.flush()
+        with open(self.tmp_path, 'rb') as f:
+            return f.read(), self.rows, self.bytes
+
+    def restore(self, snapshot):
+        content, rows, written = snapshot
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(content)
+        self.rows = rows
+        self.bytes = written
+
+    def close(self):
+        start = time.perf_counter()
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        open_tmp_paths.discard(self.tmp_path)
+        self.seconds += time.perf_counter() - start
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+        open_tmp_paths.discard(self.tmp_path)
+
+class OutputSink(object):
+    """
+    The output files of a report. open(path, mode) replaces open() for writing:
+    each file is opened once however many times it is opened here, 'w' truncates
+    it and 'a' appends to it. Nothing is visible at path until close() moves the
+    completed files into place.
+    """
+    def __init__(self):
+        self.files = OrderedDict()
+
+    def open(self, path, mode='a'):
+        output_file = self.files.get(path)
+        if output_file == None:
+            output_file = OutputFile(path, mode)
+            self.files[path] = output_file
+        elif mode == 'w':
+            output_file.truncate()
+        return output_file
+
+    def counters(self):
+        # (path, rows, bytes) of each output file
+        return [(path, f.rows, f.bytes) for path, f in self.files.items()]
+
+    def seconds(self):
+        # Seconds spent writing the output files
+        return sum(f.seconds for f in self.files.values())
+
+    def snapshot(self):
+        # The files written so far, for checkpoints
+        return [(path, f.snapshot()) for path, f in self.files.items()]
+
+    def restore(self, snapshot):
+        # Write the files back as they were at snapshot()
+        for path, file_snapshot in snapshot:
+            self.open(path, 'w').restore(file_snapshot)
+
+    def close(self):
+        for output_file in self.files.values():
+            output_file.close()
+
+    def discard(self):
+        # Remove the files written so far, leaving the output files as they were
+        for output_file in self.files.values():
+            output_file.discard()
+
+def window_start(date):
+    # Start of the 04:00 to 04:00 window of a device whose first valid date is date
+    # If before 4am, then the date is fine - else add a day
+    start_date_time = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+    if start_date_time.time().hour >= 4:
+        start_date_time = start_date_time + timedelta(days=1)
+    return start_date_time.strftime('%Y-%m-%d') + 'T04:00:00'
+
+def window_end(date):
+    # End of the 04:00 to 04:00 window of a device whose last valid date is date
+    # If after or equal to 4am, then the date is fine - else remove a day
+    end_date_time = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+    if end_date_time.time().hour < 4:
+        end_date_time = end_date_time - timedelta(days=1)
+    return end_date_time.strftime('%Y-%m-%d') + 'T04:00:00'
+
+def date_window(start, end):
+    # If cannot find valid dates, return None to ignore this device in the analysis
+    if start == None or end == None:
+        return None, None
+
+    start_date = window_start(start)
+    end_date = window_end(end)
+
+    # Check the start and end dates are at least 14 days apart - if not, return None to ignore this device in the analysis
+    difference = datetime.strptime(end_date[:10], '%Y-%m-%d') - datetime.strptime(start_date[:10], '%Y-%m-%d')
+    if difference.days < 14:
+        return None, None
+
+    return start_date, end_date
+
+# End date given to windowed device parsers whose rows WindowedRows has already
+# cut at the end of the window (it sorts after every date)
+WINDOW_OPEN = '~'
+
+class WindowedRows(object):
+    """
+    Finds the date window of a device file (see date_window) from the rows given to
+    add() in file order, and sends the rows of logs_to_parse that are inside
+    the window to windowed device parsers in the same pass. start_parsers(start_date)
+    is called at the first valid date and returns the RowRoutes of the parsers, created
+    with WINDOW_OPEN as their end date, so each row only goes to those which read it.
+
+    The window end is not known until the last row, so a row is only sent once it is
+    dated before the end the window would have if the last valid date so far were the
+    last one. Later rows are held back (in order) until a later date lets them through,
+    and finish() sends those before the actual end. When a row dated after the actual
+    end was already sent, because the dates were not in order, exact is False and the
+    device has to be parsed again with the window from finish().
+    """
+    def __init__(self, start_parsers, logs_to_parse=None):
+        self.start_parsers = start_parsers
+        self.keep = log_filter(logs_to_parse)
+        self.routes = None
+        self.first = None
+        self.last = None
+        self.end = None
+        self.end_hour = None
+        self.held = deque()
+        self.last_sent = None
+        self.exact = True
+
+    def send(self, date, row):
+        for send in self.routes.sends(row.EntryType):
+            send(row)
+        if self.last_sent == None or date > self.last_sent:
+            self.last_sent = date
+
+    def add(self, row):
+        row_date = row.Date
+        date = row_date[:-9]
+        if '(invalid date)' not in row_date:
+            if self.first == None:
+                self.first = date
+                self.routes = self.start_parsers(window_start(date))
+            self.last = date
+            if date[:13] != self.end_hour:
+                self.end_hour = date[:13]
+                self.end = window_end(date)
+
+        if self.keep != None and not self.keep.keep_type(row.EntryType):
+            return
+        held = self.held
+        if held or self.routes == None or date >= self.end:
+            held.append((date, row))
+            if self.routes == None:
+                return
+            while held and held[0][0] < self.end:
+                self.send(*held.popleft())
+        else:
+            self.send(date, row)
+
+    def finish(self):
+        """
+        Return the (start date, end date) window, or (None, None) if the device has none.
+        """
+        start_date, end_date = date_window(self.first, self.last)
+        if start_date == None:
+            return None, None
+        if self.last_sent != None and self.last_sent >= end_date:
+            self.exact = False
+            return start_date, end_date
+        for date, row in self.held:
+            if date < end_date:
+                self.send(date, row)
+        self.held.clear()
+        return start_date, end_date
+
+def parse_windowed_device(make_parser, device, logs_to_parse=None):
+    """
+    Return the result of the device parser make_parser(start_date, end_date) fed the
+    rows of a device file within its date window, or None if the device has no window.
+    The file is read once, finding the window while parsing (see WindowedRows). If the
+    device files are indexed, the window is taken from the index and only the rows of
+    the days inside it are read.
+    """
+    if device.Index != None:
+        # Imported here as device_index builds on the decoders above
+        from device_index import load_device_index, device_window, read_device_window
+        meta = load_device_index(device.Path, device.Lancs, device.Index)
+        if meta != None:
+            start_date, end_date = device_window(meta)
+            if start_date == None:
+                return None
+            return feed_parser(make_parser(start_date, end_date), read_device_window(device.Path, device.Lancs, device.Cache, meta, start_date, end_date, logs_to_parse))
+
+    parsers = []
+    def start_parsers(start_date):
+        parsers.append(start_parser(make_parser(start_date, WINDOW_OPEN)))
+        return RowRoutes([(None, parsers[0].send)])
+
+    window = WindowedRows(start_parsers, logs_to_parse)
+    for row in read_device_file(device.Path, device.Lancs, device.Cache):
+        window.add(row)
+    start_date, end_date = window.finish()
+    if start_date == None:
+        return None
+    if not window.exact:
+        return feed_parser(make_parser(start_date, end_date), read_device_file(device.Path, device.Lancs, device.Cache, logs_to_parse))
+    return close_parser(parsers[0])
+
+# Decoded DA timestamp (e.g. 2014-03-01T10:00:00.123+0100):
+# Seconds and Microsecond: time since the epoch (UTC when Offset is known)
+# Offset: UTC offset in seconds, or None if the timestamp has none
+# Day: days since 1970-01-01 of the local date, Weekday: 0 is Monday, Hour: local hour
+DATime = namedtuple('DATime', ('Seconds', 'Microsecond', 'Offset', 'Day', 'Weekday', 'Hour'))
+
+# Local date -> (Day, Weekday), so the weekday is computed once per date
+day_memo = {}
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+def date_day(date):
+    if date not in day_memo:
+        ordinal = datetime.strptime(date, '%Y-%m-%d').toordinal()
+        day_memo[date] = (ordinal - EPOCH_ORDINAL, (ordinal - 1) % 7)
+    return day_memo[date]
+
+def decode_time_parsed(date_time):
+    offset = None
+    if date_time.tzinfo != None:
+        offset = int(date_time.utcoffset().total_seconds())
+    ordinal = date_time.toordinal()
+    seconds = (ordinal - EPOCH_ORDINAL) * 86400 + date_time.hour * 3600 + date_time.minute * 60 + date_time.second - (offset or 0)
+    return DATime(seconds, date_time.microsecond, offset, ordinal - EPOCH_ORDINAL, date_time.weekday(), date_time.hour)
+
+def decode_time(date):
+    """
+    Decode a timestamp in the fixed DA format YYYY-MM-DDTHH:MM:SS[.fff][+HHMM] without
+    dateutil. Anything else is left to dateutil.parser, as before.
+    """
+    if len(date) < 19 or date[4] != '-' or date[7] != '-' or date[10] != 'T' or date[13] != ':' or date[16] != ':':
+        return decode_time_parsed(dateutil.parser.parse(date))
+    rest = date[19:]
+    microsecond = 0
+    if rest[:1] == '.':
+        end = 1
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        fraction = rest[1:end]
+        if not fraction:
+            return decode_time_parsed(dateutil.parser.parse(date))
+        microsecond = int(fraction[:6].ljust(6, '0'))
+        rest = rest[end:]
+    offset = None
+    if rest == 'Z':
+        offset = 0
+    elif rest != '':
+        zone = rest[1:].replace(':', '')
+        if rest[0] not in '+-' or len(zone) not in (2, 4) or not zone.isdigit():
+            return decode_time_parsed(dateutil.parser.parse(date))
+        offset = int(zone[:2]) * 3600 + int(zone[2:4] or 0) * 60
+        if rest[0] == '-':
+            offset = -offset
+    try:
+        day, weekday = date_day(date[:10])
+        hour = int(date[11:13])
+        seconds = day * 86400 + hour * 3600 + int(date[14:16]) * 60 + int(date[17:19]) - (offset or 0)
+    except ValueError:
+        return decode_time_parsed(dateutil.parser.parse(date))
+    return DATime(seconds, microsecond, offset, day, weekday, hour)
+
+def time_gap(start, end):
+    # Seconds from the DATime start to the DATime end (e.g. the Time of two rows)
+    if (start.Offset == None) != (end.Offset == None):
+        raise TypeError("can't subtract offset-naive and offset-aware datetimes")
+    return ((end.Seconds - start.Seconds) * 1000000 + end.Microsecond - start.Microsecond) / 1000000
+
+def pop_option(args, name, default=None):
+    """
+    Remove '<name> <value>' from the argument list args and return the value,
+    so the positional arguments (and the trailing 'lancs' flag) keep their meaning.
+    """
+    if name not in args:
+        return default
+    index = args.index(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+def pop_flag(args, name):
+    # Remove the flag name from the argument list args and return whether it was there
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
+
+# Device parsers are coroutines: prime them, send() every row of the device
+# file, then send None to let them summarise the device.
+def start_parser(parser):
+    next(parser)
+    return parser
+
+def close_parser(parser):
+    try:
+        parser.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+def feed_parser(parser, rows):
+    start_parser(parser)
+    for row in rows:
+        parser.send(row)
+    return close_parser(parser)
+
+class ResultStore(object):
+    """
+    Per-device results of a script, kept between runs so that a rerun only parses new
+    or changed device files. The result of each device file is pickled in
+    <path>/<name>/<device file name>.pickle with its key: the path, lancs flag, size
+    and mtime of the device file, and a hash of the mapping files and options the
+    results depend on. Results are only loaded back if the whole key matches.
+    """
+    def __init__(self, path, name, mapping_paths=(), options=()):
+        self.path = os.path.join(path, name)
+        digest = hashlib.sha1()
+        for mapping_path in mapping_paths:
+            with open(mapping_path, 'rb') as f:
+                digest.update(f.read())
+        for option in options:
+            digest.update(option.encode('utf-8') + b'\0')
+        self.mapping_hash = digest.hexdigest()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, exist_ok=True)
+
+    def entry_path(self, device):
+        return os.path.join(self.path, os.path.basename(device.Path) + '.pickle')
+
+    def key(self, device):
+        st = os.stat(device.Path)
+        return (device.Path, device.Lancs, st.st_size, st.st_mtime_ns, self.mapping_hash)
+
+    def load(self, device, key):
+        # Return (True, result) if a result is stored under key, else (False, None)
+        try:
+            with open(self.entry_path(device), 'rb') as f:
+                stored_key, result = pickle.load(f)
+        except Exception:
+            return False, None
+        if stored_key != key:
+            return False, None
+        return True, result
+
+    def save(self, device, key, result):
+        entry_path = self.entry_path(device)
+        tmp_path = entry_path + '.tmp{0}'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, result), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+
+def open_result_store(path, name, mapping_paths=(), options=()):
+    # The ResultStore of a script, or None if no store directory was given
+    if path == None:
+        return None
+    return ResultStore(path, name, mapping_paths, options)
+
+class StoredParser(object):
+    """
+    parse_device_file through a ResultStore: the stored result of a device is returned
+    if its key still matches, otherwise the device is parsed and its result stored.
+    """
+    def __init__(self, parse_device_file, store):
+        self.parse_device_file = parse_device_file
+        self.store = store
+
+    def __call__(self, device):
+        try:
+            key = self.store.key(device)
+        except OSError:
+            # Parse as usual, which reports the missing file
+            return self.parse_device_file(device)
+        found, result = self.store.load(device, key)
+        if not found:
+            result = self.parse_device_file(device)
+            self.store.save(device, key, result)
+        return result
+
+def run_key(name, mapping_paths, options, device_keys):
+    # Hash of a run of the script name: its mapping files, options and device files
+    digest = hashlib.sha1(name.encode('utf-8') + b'\0')
+    for mapping_path in mapping_paths:
+        with open(mapping_path, 'rb') as f:
+            digest.update(f.read())
+    for option in options:
+        digest.update(option.encode('utf-8') + b'\0')
+    for device_key in device_keys:
+        digest.update(device_key.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+class Checkpoint(object):
+    """
+    Checkpoints of the merged results of a run, so that a run which dies can be resumed
+    from its last checkpoint (--resume) with the same output files. Each namespace is
+    a dict of globals (e.g. globals() of a script) and the names of those which device
+    results are merged into. A checkpoint pickles their values and the no. of devices
+    merged to path, replacing the previous one, at most every interval seconds and
+    once all devices are merged; OutputSinks are saved as the files written so far.
+    Restoring removes the temp file of a checkpoint the run was killed while saving.
+    The checkpoint holds the key of its run, and is only restored by the same run.
+    """
+    def __init__(self, path, key, namespaces, interval):
+        self.path = path
+        self.key = key
+        self.namespaces = namespaces
+        self.interval = interval
+        self.done = 0
+        self.last_save = time.perf_counter()
+
+    def state(self):
+        state = []
+        for namespace, names in self.namespaces:
+            values = {}
+            for name in names:
+                value = namespace[name]
+                values[name] = (True, value.snapshot()) if isinstance(value, OutputSink) else (False, value)
+            state.append(values)
+        return state
+
+    def save(self):
+        tmp_path = self.path + '.tmp{0}'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'Key': self.key, 'Done': self.done, 'State': self.state()}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.last_save = time.perf_counter()
+
+    def restore(self):
+        with open(self.path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['Key'] != self.key:
+            return False
+        remove_stale_tmp_files(self.path)
+        for (namespace, names), values in zip(self.namespaces, checkpoint['State']):
+            for name in names:
+                is_sink, value = values[name]
+                if is_sink:
+                    namespace[name].restore(value)
+                else:
+                    namespace[name] = value
+        self.done = checkpoint['Done']
+        return True
+
+    def merged(self):
+        # Called once each device is merged
+        self.done += 1
+        if time.perf_counter() - self.last_save >= self.interval:
+            self.save()
+
+def open_checkpoint(path, name, devices, mapping_paths, options, namespaces, interval=300.0, resume=False):
+    """
+    Return the Checkpoint of the run of the script name over devices (None if there is
+    no checkpoint path), restored from path if resume is set. The key of the run is a
+    hash of the name, mapping files, options and the paths, sizes and mtimes of the
+    device files. Call after init_report, which sets up the globals to restore.
+    """
+    if path == None:
+        if resume:
+            print('--resume needs --checkpoint followed by the checkpoint file')
+            sys.exit(1)
+        return None
+    device_keys = []
+    for device in devices:
+        try:
+            st = os.stat(device.Path)
+            stat = '{0};{1}'.format(st.st_size, st.st_mtime_ns)
+        except OSError:
+            stat = ''
+        device_keys.append('{0};{1};{2}'.format(device.Path, device.Lancs, stat))
+    checkpoint = Checkpoint(path, run_key(name, mapping_paths, options, device_keys), namespaces, interval)
+    if resume:
+        if not os.path.exists(path):
+            print('No checkpoint at {0}, starting from the first device'.format(path))
+        elif checkpoint.restore():
+            print('Resuming from {0} after {1} devices'.format(path, checkpoint.done))
+        else:
+            print('Checkpoint {0} is of another run (different devices, mapping files or options)'.format(path))
+            sys.exit(1)
+    return checkpoint
+
+def parse_shard(spec):
+    # (i, N) of a --shard i/N option, shards being numbered from 1
+    try:
+        shard, shards = [int(part) for part in spec.split('/')]
+    except ValueError:
+        shard, shards = 0, 0
+    if not 1 <= shard <= shards:
+        print('--shard needs i/N with 1 <= i <= N, not ' + spec)
+        sys.exit(1)
+    return shard, shards
+
+def shard_devices(devices, spec):
+    # The devices parsed by shard i of N: every Nth device from the ith
+    shard, shards = parse_shard(spec)
+    return list(devices)[shard - 1::shards]
+
+def shard_key(name, devices, mapping_paths, options):
+    # Key of a sharded run, by device file names as the nodes may keep them at other paths
+    return run_key(name, mapping_paths, options, ['{0};{1}'.format(device.FileName, device.Lancs) for device in devices])
+
+def write_shard(spec, name, devices, mapping_paths, options, devices_results):
+    """
+    Write the partial file of shard i of N (spec 'i/N') of the run of the script name
+    over devices: a header, then the index in devices, the device and the result of
+    each (device, result) of devices_results, the shard_devices(devices, spec) parsed.
+    The results are those merge_device_result takes, so read_shards can merge them.
+    """
+    shard, shards = parse_shard(spec)
+    path = '{0}_shard_{1}_of_{2}.pickle'.format(name, shard, shards)
+    tmp_path = path + '.tmp{0}'.format(os.getpid())
+    written = 0
+    with open(tmp_path, 'wb') as f:
+        header = {'Script': name, 'Key': shard_key(name, devices, mapping_paths, options), 'Shard': shard, 'Shards': shards}
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        for index, (device, result) in zip(range(shard - 1, len(devices), shards), devices_results):
+            pickle.dump((index, device, result), f, pickle.HIGHEST_PROTOCOL)
+            written += 1
+    os.replace(tmp_path, path)
+    print('Wrote shard {0}/{1} ({2} devices) to {3}'.format(shard, shards, written, path))
+
+def shard_records(path):
+    # (index, device, result) of each device in the partial file at path
+    with open(path, 'rb') as f:
+        pickle.load(f)
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def read_shards(patterns, name, devices, mapping_paths, options):
+    """
+    Return (device, result) for each device in the partial files of a sharded run
+    matching patterns (comma separated file names or glob patterns), in the order of
+    devices, to merge as those of parse_devices(devices). The partial files must be the
+    N shards of a run of the script name over devices with the same mapping files and
+    options, otherwise the script stops.
+    """
+    paths = []
+    for pattern in patterns.split(','):
+        paths += sorted(glob.glob(pattern)) or [pattern]
+    key = shard_key(name, devices, mapping_paths, options)
+    shards = {}
+    count = None
+    for path in paths:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+        if header['Script'] != name or header['Key'] != key:
+            print('Shard {0} is of another run (different script, devices, mapping files or options)'.format(path))
+            sys.exit(1)
+        if header['Shard'] in shards or count not in (None, header['Shards']):
+            print('Shard {0} repeats shard {1} or is one of another no. of shards'.format(path, header['Shard']))
+            sys.exit(1)
+        shards[header['Shard']] = path
+        count = header['Shards']
+    missing = [str(shard) for shard in range(1, (count or 1) + 1) if shard not in shards]
+    if missing:
+        print('Missing shards: ' + ', '.join(missing))
+        sys.exit(1)
+    records = heapq.merge(*[shard_records(shards[shard]) for shard in sorted(shards)], key=lambda record: record[0])
+    return ((device, result) for index, device, result in records)
+
+class ProgressParser(object):
+    """
+    parse_device_file returning (result, ReadCounts) of each device, so that the counts
+    come back from worker processes with the results.
+    """
+    def __init__(self, parse_device_file):
+        self.parse_device_file = parse_device_file
+
+    def __call__(self, device):
+        global read_counts
+
+        read_counts = ReadCounts()
+        try:
+            result = self.parse_device_file(device)
+        finally:
+            counts = read_counts
+            read_counts = None
+        return result, counts
+
+class ProgressReporter(object):
+    """
+    Reports the progress of parsing the device files of the script name to stderr, at
+    most every interval seconds (and when all devices are done): devices done, MB of
+    the device files decompressed, rows per second and the time left, estimated from
+    the size of the device files done. With a status_path each report is also appended
+    to that file as a line of JSON.
+    """
+    def __init__(self, name, interval=10.0, status_path=None):
+        self.name = name
+        self.interval = interval
+        self.status_path = status_path
+
+    def start(self, devices):
+        self.total = len(devices)
+        self.sizes = {}
+        for device in devices:
+            try:
+                self.sizes[device.Path] = os.path.getsize(device.Path)
+            except OSError:
+                self.sizes[device.Path] = 0
+        self.total_size = sum(self.sizes.values())
+        self.done = 0
+        self.done_size = 0
+        self.bytes = 0
+        self.rows = 0
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+
+    def device_done(self, device, counts):
+        self.done += 1
+        self.done_size += self.sizes.get(device.Path, 0)
+        self.bytes += counts.bytes
+        self.rows += counts.rows
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            self.report(device, now)
+
+    def report(self, device, now):
+        elapsed = now - self.start_time
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.done == self.total:
+            eta = 0.0
+        elif self.total_size > 0 and self.done_size > 0:
+            eta = elapsed * (self.total_size - self.done_size) / self.done_size
+        sys.stderr.write('{0}: {1}/{2} devices, {3:.1f} MB decompressed, {4:.0f} rows/s, elapsed {5}, ETA {6}\n'.format(
+            self.name, self.done, self.total, self.bytes / 1048576.0, rate, timedelta(seconds=round(elapsed)),
+            'unknown' if eta == None else timedelta(seconds=round(eta))))
+        sys.stderr.flush()
+        if self.status_path != None:
+            status = OrderedDict([('Time', datetime.now().isoformat()), ('Script', self.name), ('Device', device.FileName),
+                                  ('Devices', self.done), ('TotalDevices', self.total), ('Bytes', self.bytes), ('Rows', self.rows),
+                                  ('RowsPerSecond', rate), ('Elapsed', elapsed), ('ETA', eta)])
+            with open(self.status_path, 'a') as f:
+                f.write(json.dumps(status) + '\n')
+
+    def parse_devices(self, devices, devices_results):
+        # Yield (device, result) from devices_results of a ProgressParser, reporting as they finish
+        self.start(devices)
+        for device, (result, counts) in devices_results:
+            self.device_done(device, counts)
+            yield device, result
+
+def parse_devices(parse_device_file, devices, workers=1, store=None, progress=None, checkpoint=None):
+    """
+    Yield (device, parse_device_file(device)) for each device, in the order of devices.
+    With workers > 1 the devices are parsed in a pool of forked worker processes, which
+    inherit the globals set up by init_report; results are merged by the caller in order,
+    so the output is the same as a serial run. With a ResultStore, stored results of
+    unchanged device files are used instead of parsing them again. With a
+    ProgressReporter the progress is reported as devices are parsed, and if the run is
+    profiled, each device is parsed through the profiler. With a Checkpoint the devices
+    it has merged are skipped, and it is saved as the caller merges the others.
+    """
+    if checkpoint != None:
+        for device, result in parse_devices(parse_device_file, list(devices)[checkpoint.done:], workers, store, progress):
+            yield device, result
+            checkpoint.merged()
+        checkpoint.save()
+        return
+    devices = list(devices)
+    if store != None:
+        parse_device_file = StoredParser(parse_device_file, store)
+    if progress != None:
+        parse_device_file = ProgressParser(parse_device_file)
+    if profiler != None:
+        parse_device_file = profiler.parser(parse_device_file)
+    results = parse_device_results(parse_device_file, devices, workers)
+    if profiler != None:
+        results = profiler.parse_devices(results)
+    if progress != None:
+        results = progress.parse_devices(devices, results)
+    for device, result in results:
+        yield device, result
+
+def parse_device_results(parse_device_file, devices, workers):
+    if workers <= 1:
+        for device in devices:
+            yield device, parse_device_file(device)
+        return
+
+    pool = multiprocessing.get_context('fork').Pool(workers)
+    try:
+        for device, result in zip(devices, pool.imap(parse_device_file, devices)):
+            yield device, result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -14,22 +14,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 import numpy as np
-import subprocess
-from collections import namedtuple, OrderedDict
-import dateutil.parser
-from datetime import datetime, timedelta
-from functools import reduce
+from collections import namedtuple
+from datetime import datetime
+from da_common import read_practice_table, make_sure_path_exists, parse_windowed_device, pop_option, list_devices, parse_devices, open_result_store, AppIdIndex, AppHourlyCounts, date_day, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
 
+global output
 global no_of_ignored_files
 
-global app_practice_mapping
+global practice_table
 
 global all_demand_rx_contribution
 global all_demand_tx_contribution
@@ -46,142 +41,30 @@ global overall_weekend_rx
 global overall_weekend_tx
 global overall_weekend
 
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.TextIOWrapper(io.BufferedReader(gzip.open(path))) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield DARecord._make(repacked)
-    except:
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except:
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-AppRecord = namedtuple('AppRecord', ('FullName', 'Name', 'Practice'))
-def read_app_mapping(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=';')
-        for row in map(AppRecord._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def get_t_gap(first, second):
-    return (dateutil.parser.parse(second) - dateutil.parser.parse(first)).total_seconds()
-
-def search_dates(file_path, lancs):
-    start_date = None
-    end_date = None
-
-    for row in (read_file_lancs(file_path) if lancs else read_file(file_path)):
-        date_time = row.Date
-        if '(invalid date)' in date_time:
-            continue
-
-        if start_date == None:
-            start_date = date_time
-
-        end_date = date_time
-
-    if start_date == None or end_date == None:
-        return None, None
+# Per-device hourly means, computed by device_parser (possibly in a worker process)
+# and added to the global accumulators by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('FileName', 'FilePath', 'NoOfDays', 'AppMeans'))
+AppMeans = namedtuple('AppMeans', ('Rx', 'Tx', 'WeekdayRx', 'WeekdayTx', 'Weekday', 'WeekendRx', 'WeekendTx', 'Weekend'))
 
-    return start_date[:-9], end_date[:-9]
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app', 'screen', 'hf', 'net']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['no_of_ignored_files', 'all_demand_rx_contribution', 'all_demand_tx_contribution',
+                  'all_demand_contribution', 'all_demand_days_contribution', 'data_rx_total',
+                  'data_tx_total', 'overall_weekday_rx', 'overall_weekday_tx', 'overall_weekday',
+                  'overall_weekend_rx', 'overall_weekend_tx', 'overall_weekend']
 
-def get_start_end_dates(file_path, lancs):
-    start = None
-    end = None
-    if lancs:
-        # start = str(subprocess.check_output(['head', '-1', file_path])).split(';')[2][:-9]
-        # end = str(subprocess.check_output(['tail', '-1', file_path])).split(';')[2][:-9]
-        # if '(invalid date)' in start or '(invalid date)' in end:
-        start, end = search_dates(file_path, lancs)
-    else:
-        start, end = search_dates(file_path, lancs)
-
-    # If cannot find valid dates, return None to ignore this device in the analysis
-    if start == None or end == None:
-        return None, None
+def parse_device_file(device):
+    # The date window is found while the device file is parsed, so it is only read once
+    return parse_windowed_device(lambda start_date, end_date: device_parser(device.Path, device.FileName, start_date, end_date), device, logs_to_parse)
 
-    start_date_time = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
-    end_date_time = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S')
-
-    start_date_to_return = None
-    end_date_to_return = None
-    # If before 4am, then the date is fine - else add a day
-    if start_date_time.time().hour < 4:
-        start_date_to_return = start_date_time
-    else:
-        start_date_to_return = (start_date_time + timedelta(days=1))
-    # If after or equal to 4am, then the date is fine - else remove a day
-    if end_date_time.time().hour >= 4:
-        end_date_to_return = end_date_time
-    else:
-        end_date_to_return = (end_date_time - timedelta(days=1))
-
-    # Check the start and end dates are at least 12 days apart - if not, return None to ignore this device in the analysis
-    difference = end_date_to_return.date() - start_date_to_return.date()
-    if difference.days < 14:
-        return None, None
-
-    return (start_date_to_return.strftime('%Y-%m-%d'))+'T04:00:00', (end_date_to_return.strftime('%Y-%m-%d'))+'T04:00:00'
-
-def parse_file(file_path, lancs, fname, start_date, end_date):
+def ignore_device(fname):
     global no_of_ignored_files
-    global all_demand_rx_contribution
-    global all_demand_tx_contribution
-    global all_demand_contribution
-    global all_demand_days_contribution
-    global data_rx_total
-    global data_tx_total
-    global overall_weekday_rx
-    global overall_weekday_tx
-    global overall_weekday
-    global overall_weekend_rx
-    global overall_weekend_tx
-    global overall_weekend
 
-    logs_to_parse = ['app', 'screen', 'hf', 'net']
+    print("No start or end dates, or under 14 days of logging, for file: " + fname)
+    no_of_ignored_files+=1
 
+def device_parser(file_path, fname, start_date, end_date):
     current_hour = None
     current_day = None
     current_weekday = None
@@ -199,11 +82,15 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
 
     no_of_days_week = [0 for day in range(0,7)]
 
-    ids_names = {}
-    current_app_name_id_mapping = {}
+    app_ids = AppIdIndex()
+    # Last rx and tx bytes of each app, and the rx/tx byte deltas by day of the week and hour
     app_data = {}
+    app_bytes = AppHourlyCounts()
 
-    for row in (read_file_lancs(file_path) if lancs else read_file(file_path)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -218,11 +105,11 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
 
         if current_day != date_time[0]:
             current_day = date_time[0]
-            current_weekday = datetime.strptime(date_time[0], '%Y-%m-%d').weekday()
+            current_weekday = date_day(date_time[0])[1]
             no_of_days_week[current_weekday]+=1
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # An app is in the foreground so log its process id
         if 'importance' in entry_val and 'foreground' in row_value:
@@ -258,31 +145,30 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
         # App data
         elif row_entry_type.startswith('net|app'):
             app_id = entry_val[2]
-            app_name = None
-            for key, val in current_app_name_id_mapping.items():
-                if val == app_id:
-                    app_name = key
+            app_name = app_ids.name(app_id)
             if app_name == None:
                 continue
 
             if entry_val[3] == 'rx_bytes':
+                row_number = row.Number
                 app_last_rx = app_data[app_name][0]
                 if app_last_rx == None:
                     pass
-                elif int(row_value) > app_last_rx:
-                    app_data[app_name][1][current_weekday][current_hour].append(int(row_value) - app_last_rx)
-                elif int(row_value) < app_last_rx:
-                    app_data[app_name][1][current_weekday][current_hour].append(int(row_value))
-                app_data[app_name][0] = int(row_value)
+                elif row_number > app_last_rx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 0, row_number - app_last_rx)
+                elif row_number < app_last_rx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 0, row_number)
+                app_data[app_name][0] = row_number
             elif entry_val[3] == 'tx_bytes':
-                app_last_tx = app_data[app_name][2]
+                row_number = row.Number
+                app_last_tx = app_data[app_name][1]
                 if app_last_tx == None:
                     pass
-                elif int(row_value) > app_last_tx:
-                    app_data[app_name][3][current_weekday][current_hour].append(int(row_value) - app_last_tx)
-                elif int(row_value) < app_last_tx:
-                    app_data[app_name][3][current_weekday][current_hour].append(int(row_value))
-                app_data[app_name][2] = int(row_value)
+                elif row_number > app_last_tx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 1, row_number - app_last_tx)
+                elif row_number < app_last_tx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 1, row_number)
+                app_data[app_name][1] = row_number
         # App installed logs
         elif row_entry_type.startswith('app|installed'):
             for app_entry in row_value.split(','):
@@ -291,109 +177,117 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
                     temp_name = installed_details[0]
                     app_info = installed_details[1].split(':')
                     temp_app_id = app_info[len(app_info) - 2]
-                    if temp_name not in current_app_name_id_mapping:
-                        app_data[temp_name] = [None, [[[] for x in range(0,24)] for y in range(0,7)], None, [[[] for x in range(0,24)] for y in range(0,7)]]
+                    if temp_name not in app_ids:
+                        app_data[temp_name] = [None, None]
 
                     # Remove old mapping if it exists
-                    if temp_app_id not in ids_names:
-                        ids_names[temp_app_id] = temp_name
-                    elif ids_names[temp_app_id] != temp_name:
-                        for key, val in current_app_name_id_mapping.items():
-                            if val == temp_app_id and key != temp_name:
-                                current_app_name_id_mapping[key] = ''
-                        ids_names[temp_app_id] = temp_name
-
-                    current_app_name_id_mapping[temp_name] = temp_app_id
-
-    if no_of_days >= 14:
-        for app, data in app_data.items():
-
-            mean_rx = [[0 for i in range(0,24)] for i in range(0,7)]
-            mean_tx = [[0 for i in range(0,24)] for i in range(0,7)]
-
-            weekday_total_rx = [0 for i in range(0,24)]
-            weekday_total_tx = [0 for i in range(0,24)]
-            weekday_total = [0 for i in range(0,24)]
-
-            weekday_mean_rx = [0 for i in range(0,24)]
-            weekday_mean_tx = [0 for i in range(0,24)]
-            weekday_mean = [0 for i in range(0,24)]
-
-            weekend_total_rx = [0 for i in range(0,24)]
-            weekend_total_tx = [0 for i in range(0,24)]
-            weekend_total = [0 for i in range(0,24)]
-
-            weekend_mean_rx = [0 for i in range(0,24)]
-            weekend_mean_tx = [0 for i in range(0,24)]
-            weekend_mean = [0 for i in range(0,24)]
-
-            for index, no_of_days_of_day in enumerate(no_of_days_week):
-                if no_of_days_of_day != 0:
-                    mean_rx[index] = [(sum(ihour)/no_of_days_of_day) for ihour in data[1][index]]
-                    mean_tx[index] = [(sum(ihour)/no_of_days_of_day) for ihour in data[3][index]]
-
-                    day_total_rx = [sum(ihour) for ihour in data[1][index]]
-                    day_total_tx = [sum(ihour) for ihour in data[3][index]]
-                    if index < 5:
-                        for hour in range(0,24):
-                            weekday_total_rx[hour] = weekday_total_rx[hour] + day_total_rx[hour]
-                            weekday_total_tx[hour] = weekday_total_tx[hour] + day_total_tx[hour]
-                            weekday_total[hour] = weekday_total[hour] + day_total_rx[hour] + day_total_tx[hour]
-                    else:
-                        for hour in range(0,24):
-                            weekend_total_rx[hour] = weekend_total_rx[hour] + day_total_rx[hour]
-                            weekend_total_tx[hour] = weekend_total_tx[hour] + day_total_tx[hour]
-                            weekend_total[hour] = weekend_total[hour] + day_total_rx[hour] + day_total_tx[hour]
-
-            no_of_weekday_days = sum(no_of_days_week[:5])
-            if no_of_weekday_days != 0:
-                weekday_mean_rx = [ihour/no_of_weekday_days for ihour in weekday_total_rx]
-                weekday_mean_tx = [ihour/no_of_weekday_days for ihour in weekday_total_tx]
-                weekday_mean = [ihour/no_of_weekday_days for ihour in weekday_total]
-
-            no_of_weekend_days = sum(no_of_days_week[5:7])
-            if no_of_weekend_days != 0:
-                weekend_mean_rx = [ihour/no_of_weekend_days for ihour in weekend_total_rx]
-                weekend_mean_tx =[ihour/no_of_weekend_days for ihour in weekend_total_tx]
-                weekend_mean = [ihour/no_of_weekend_days for ihour in weekend_total]
-
-            add_to_overall_total = False
-
-            if not all(hour == 0 for day in mean_rx for hour in day):
-                add_to_overall_total = True
-                for day in range(0,7):
-                    if not all(hour == 0 for hour in mean_rx[day]):
-                        all_demand_days_contribution[day].add(fname)
-                    for hour in range(0,24):
-                        data_rx_total[day][hour] = data_rx_total[day][hour] + mean_rx[day][hour]
-                all_demand_rx_contribution.add(fname)
-                all_demand_contribution.add(fname)
-                # Weekday and weekend rx
-                for i in range(0,24):
-                    overall_weekday_rx[i] = overall_weekday_rx[i] + weekday_mean_rx[i]
-                    overall_weekend_rx[i] = overall_weekend_rx[i] + weekend_mean_rx[i]
-
-            if not all(hour == 0 for day in mean_tx for hour in day):
-                add_to_overall_total = True
-                for day in range(0,7):
-                    if not all(hour == 0 for hour in mean_tx[day]):
-                        all_demand_days_contribution[day].add(fname)
-                    for hour in range(0,24):
-                        data_tx_total[day][hour] = data_tx_total[day][hour] + mean_tx[day][hour]
-                all_demand_tx_contribution.add(fname)
-                all_demand_contribution.add(fname)
-                # Weekday and weekend tx
-                for i in range(0,24):
-                    overall_weekday_tx[i] = overall_weekday_tx[i] + weekday_mean_tx[i]
-                    overall_weekend_tx[i] = overall_weekend_tx[i] + weekend_mean_tx[i]
-
-            if add_to_overall_total is True:
-                for i in range(0,24):
-                    overall_weekday[i] = overall_weekday[i] + weekday_mean[i]
-                    overall_weekend[i] = overall_weekend[i] + weekend_mean[i]
-    else:
+                    app_ids.install(temp_name, temp_app_id)
+
+    if no_of_days < 14:
+        return DeviceResult(fname, file_path, no_of_days, [])
+
+    # Rx/tx byte totals of each app by day of the week and hour, and their means over the days
+    # logged of each day of the week (days of the week with no days logged have zero totals)
+    totals = app_bytes.totals(len(app_ids))
+    means = totals / np.maximum(no_of_days_week, 1)[:, np.newaxis, np.newaxis]
+
+    # Weekday and weekend rx/tx totals of each app by hour, and their means
+    no_of_weekday_days = sum(no_of_days_week[:5])
+    no_of_weekend_days = sum(no_of_days_week[5:7])
+    weekday_totals = totals[:, :5].sum(axis=1)
+    weekend_totals = totals[:, 5:].sum(axis=1)
+    if no_of_weekday_days != 0:
+        weekday_means = weekday_totals / no_of_weekday_days
+        weekday_all_means = weekday_totals.sum(axis=2) / no_of_weekday_days
+    if no_of_weekend_days != 0:
+        weekend_means = weekend_totals / no_of_weekend_days
+        weekend_all_means = weekend_totals.sum(axis=2) / no_of_weekend_days
+
+    app_means = []
+    for row in range(0, len(app_ids)):
+        # Only apps with some rx or tx bytes
+        if not totals[row].any():
+            continue
+
+        mean_rx = [means[row, day, :, 0].tolist() if no_of_days_week[day] != 0 else [0 for i in range(0,24)] for day in range(0,7)]
+        mean_tx = [means[row, day, :, 1].tolist() if no_of_days_week[day] != 0 else [0 for i in range(0,24)] for day in range(0,7)]
+
+        weekday_mean_rx = [0 for i in range(0,24)]
+        weekday_mean_tx = [0 for i in range(0,24)]
+        weekday_mean = [0 for i in range(0,24)]
+        if no_of_weekday_days != 0:
+            weekday_mean_rx = weekday_means[row, :, 0].tolist()
+            weekday_mean_tx = weekday_means[row, :, 1].tolist()
+            weekday_mean = weekday_all_means[row].tolist()
+
+        weekend_mean_rx = [0 for i in range(0,24)]
+        weekend_mean_tx = [0 for i in range(0,24)]
+        weekend_mean = [0 for i in range(0,24)]
+        if no_of_weekend_days != 0:
+            weekend_mean_rx = weekend_means[row, :, 0].tolist()
+            weekend_mean_tx = weekend_means[row, :, 1].tolist()
+            weekend_mean = weekend_all_means[row].tolist()
+
+        app_means.append(AppMeans(mean_rx, mean_tx, weekday_mean_rx, weekday_mean_tx, weekday_mean, weekend_mean_rx, weekend_mean_tx, weekend_mean))
+
+    return DeviceResult(fname, file_path, no_of_days, app_means)
+
+def merge_device_result(result):
+    global no_of_ignored_files
+    global all_demand_rx_contribution
+    global all_demand_tx_contribution
+    global all_demand_contribution
+    global all_demand_days_contribution
+    global data_rx_total
+    global data_tx_total
+    global overall_weekday_rx
+    global overall_weekday_tx
+    global overall_weekday
+    global overall_weekend_rx
+    global overall_weekend_tx
+    global overall_weekend
+
+    if result.NoOfDays < 14:
         no_of_ignored_files+=1
-        print('Not adding {0} to summary, as no. of actual data days: {1}'.format(file_path, no_of_days))
+        print('Not adding {0} to summary, as no. of actual data days: {1}'.format(result.FilePath, result.NoOfDays))
+        return
+
+    fname = result.FileName
+    for app_means in result.AppMeans:
+        add_to_overall_total = False
+
+        if not all(hour == 0 for day in app_means.Rx for hour in day):
+            add_to_overall_total = True
+            for day in range(0,7):
+                if not all(hour == 0 for hour in app_means.Rx[day]):
+                    all_demand_days_contribution[day].add(fname)
+                for hour in range(0,24):
+                    data_rx_total[day][hour] = data_rx_total[day][hour] + app_means.Rx[day][hour]
+            all_demand_rx_contribution.add(fname)
+            all_demand_contribution.add(fname)
+            # Weekday and weekend rx
+            for i in range(0,24):
+                overall_weekday_rx[i] = overall_weekday_rx[i] + app_means.WeekdayRx[i]
+                overall_weekend_rx[i] = overall_weekend_rx[i] + app_means.WeekendRx[i]
+
+        if not all(hour == 0 for day in app_means.Tx for hour in day):
+            add_to_overall_total = True
+            for day in range(0,7):
+                if not all(hour == 0 for hour in app_means.Tx[day]):
+                    all_demand_days_contribution[day].add(fname)
+                for hour in range(0,24):
+                    data_tx_total[day][hour] = data_tx_total[day][hour] + app_means.Tx[day][hour]
+            all_demand_tx_contribution.add(fname)
+            all_demand_contribution.add(fname)
+            # Weekday and weekend tx
+            for i in range(0,24):
+                overall_weekday_tx[i] = overall_weekday_tx[i] + app_means.WeekdayTx[i]
+                overall_weekend_tx[i] = overall_weekend_tx[i] + app_means.WeekendTx[i]
+
+        if add_to_overall_total is True:
+            for i in range(0,24):
+                overall_weekday[i] = overall_weekday[i] + app_means.Weekday[i]
+                overall_weekend[i] = overall_weekend[i] + app_means.Weekend[i]
 
 def calculate_print_summaries():
     global data_rx_total
@@ -408,10 +302,11 @@ def calculate_print_summaries():
     global overall_weekend_rx
     global overall_weekend_tx
     global overall_weekend
+    global output
 
     days_of_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
-    with open('day_totals_output/contribution.csv', 'w') as f:
+    with output.open('day_totals_output/contribution.csv', 'w') as f:
         f.write('demand rx,{0}\n'.format(len(all_demand_rx_contribution)))
         f.write('demand tx,{0}\n'.format(len(all_demand_tx_contribution)))
         f.write('demand rx and tx,{0}\n'.format(len(all_demand_contribution)))
@@ -423,19 +318,19 @@ def calculate_print_summaries():
         for hour in range(0,24):
             data_total[day][hour] = data_rx_total[day][hour] + data_tx_total[day][hour]
     
-    with open('day_totals_output/days_of_week_demand_rx.csv', 'w') as f:
+    with output.open('day_totals_output/days_of_week_demand_rx.csv', 'w') as f:
         for index, day in enumerate(days_of_week):
             f.write('{0};{1}\n'.format(day, data_rx_total[index]))
 
-    with open('day_totals_output/days_of_week_demand_tx.csv', 'w') as f:
+    with output.open('day_totals_output/days_of_week_demand_tx.csv', 'w') as f:
         for index, day in enumerate(days_of_week):
             f.write('{0};{1}\n'.format(day, data_tx_total[index]))
 
-    with open('day_totals_output/days_of_week_demand_all.csv', 'w') as f:
+    with output.open('day_totals_output/days_of_week_demand_all.csv', 'w') as f:
         for index, day in enumerate(days_of_week):
             f.write('{0};{1}\n'.format(day, data_total[index]))
 
-    with open('day_totals_output/weekday_weekend_demand.csv', 'w') as f:
+    with output.open('day_totals_output/weekday_weekend_demand.csv', 'w') as f:
         f.write('weekday rx;{0}\n'.format(overall_weekday_rx))
         f.write('weekday tx;{0}\n'.format(overall_weekday_tx))
         f.write('weekday;{0}\n'.format(overall_weekday))
@@ -443,9 +338,13 @@ def calculate_print_summaries():
         f.write('weekend tx;{0}\n'.format(overall_weekend_tx))
         f.write('weekend;{0}\n'.format(overall_weekend))
 
-if __name__ == '__main__':
+def init_report(pathOfAppPracticeMapping):
     global no_of_ignored_files
-    global app_practice_mapping
+    global practice_table
+    global output
+
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
     global all_demand_rx_contribution
     global all_demand_tx_contribution
@@ -462,15 +361,8 @@ if __name__ == '__main__':
     global overall_weekend_tx
     global overall_weekend
 
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    pathOfAppPracticeMapping = sys.argv[3]
-    lancs = bool(len(sys.argv) > 4)
-
     no_of_ignored_files = 0
 
-    startTime = datetime.now()
-
     data_rx_total = [[0 for i in range(0,24)] for day in range(0,7)]
     data_tx_total = [[0 for i in range(0,24)] for day in range(0,7)]
 
@@ -486,27 +378,64 @@ if __name__ == '__main__':
     all_demand_contribution = set()
     all_demand_days_contribution = [set() for i in range(0,7)]
 
-    app_practice_mapping = {}
-    for app in read_app_mapping(pathOfAppPracticeMapping):
-        app_practice_mapping[app.FullName] = app.Practice
+    practice_table = read_practice_table(pathOfAppPracticeMapping)
 
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('day_totals_output/')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        start_date, end_date = get_start_end_dates(fullfpath, lancs)
-        if start_date == None or end_date == None:
-            print("No start or end dates, or under 14 days of logging, for file: " + fname)
-            no_of_ignored_files+=1
-        else:
-            parse_file(fullfpath, lancs, fname, start_date, end_date)
+def finish_report():
+    global output
 
     calculate_print_summaries()
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('day_of_week_totals', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    index = pop_option(args, '--index')
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    pathOfAppPracticeMapping = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'day_of_week_totals')
+
+    init_report(pathOfAppPracticeMapping)
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache, index)
+    options = [str(lancs)]
+    checkpoint = open_checkpoint(checkpoint_path, 'day_of_week_totals', devices, [pathOfAppPracticeMapping], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'day_of_week_totals', devices, [pathOfAppPracticeMapping], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'day_of_week_totals', [pathOfAppPracticeMapping]), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'day_of_week_totals', devices, [pathOfAppPracticeMapping], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'day_of_week_totals', [pathOfAppPracticeMapping]), progress, checkpoint)
+    for device, result in devices_results:
+        if result == None:
+            ignore_device(device.FileName)
+        else:
+            merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
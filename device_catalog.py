@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Catalog of the devices in an SQLite file, with the facts used to decide which
+# devices to analyse: the dates of each device file (from its device index
+# sidecar) and of its location file (as location-selection.py summarises it).
+# A row is only rebuilt when the size or mtime of its file changes, and devices
+# are selected by a filter expression (an SQL WHERE clause) over the columns of
+# the catalog view, printed as a device ids file.
+#
+# Columns of the devices table (one row per device file):
+#   FileName: name of the device, as in device ids files
+#   Lancs, Path, Size, Mtime, Clean: as in the device index sidecar
+#   First, Last: first and last valid dates, Days: no. of distinct valid dates
+#   PropDays: (Days - 1) / days from the first to the last date
+#   WindowStart, WindowEnd, WindowDays: the 04:00 to 04:00 date window of the device
+#     and the days between them (date_window needs at least 14)
+#   Rows: no. of rows, AppDays ... PhoneDays: no. of distinct valid dates of each log
+# Columns of the locations table (one row per location file):
+#   FileName, LocationPath, LocationSize, LocationMtime: the location file
+#   LocationStart, LocationEnd, LocationDays: first and last dates, no. of dates seen
+#   PropData: (LocationDays - 1) / days from the first to the last date
+#   InUK, OutUK, PropUK: no. of sightings inside and outside the UK, and the proportion inside
+# The catalog view joins the two on FileName, with every device of either table.
+
+import sys
+import os
+import sqlite3
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+import numpy as np
+from da_common import window_start, window_end, device_file_path, pop_option, Device, list_devices, parse_devices, parse_device_results, ProgressReporter
+from device_index import update_device_index
+
+uk_lon_max = 1.5
+uk_lon_min = -11
+uk_lat_max = 60.5
+uk_lat_min = 50
+
+# Bytes of lines read from a location file at a time
+LINES_CHUNK = 1 << 20
+
+# Column of the no. of days of each log (and of 'net|app' rows)
+LOG_DAYS_COLUMNS = OrderedDict([('app', 'AppDays'), ('net', 'NetDays'), ('net|app', 'NetAppDays'), ('screen', 'ScreenDays'),
+                                ('hf', 'HfDays'), ('sms', 'SmsDays'), ('phone', 'PhoneDays')])
+
+DEVICE_COLUMNS = ['FileName', 'Lancs', 'Path', 'Size', 'Mtime', 'Clean', 'First', 'Last', 'Days', 'PropDays',
+                  'WindowStart', 'WindowEnd', 'WindowDays', 'Rows'] + list(LOG_DAYS_COLUMNS.values())
+LOCATION_COLUMNS = ['FileName', 'LocationPath', 'LocationSize', 'LocationMtime', 'LocationStart', 'LocationEnd',
+                    'LocationDays', 'PropData', 'InUK', 'OutUK', 'PropUK']
+
+LocationSummary = namedtuple('LocationSummary', ('Start', 'End', 'Days', 'InUK', 'OutUK'))
+
+def summarise_location_file(path):
+    """
+    Return the LocationSummary of the location file at path: its first and last
+    dates, the no. of dates with sightings, and the no. of sightings inside and
+    outside the UK. Lines without three fields are skipped. The file is read a
+    chunk of lines at a time, parsing the dates and coordinates of a chunk and
+    testing them against the UK range as NumPy arrays.
+    """
+    days = np.zeros(0, dtype='datetime64[D]')
+    inside_uk = 0
+    outside_uk = 0
+    with open(path, 'rb') as fp:
+        while True:
+            lines = fp.readlines(LINES_CHUNK)
+            if not lines:
+                break
+            sightings = [elements for elements in (line.split(b'|') for line in lines) if len(elements) == 3]
+            if not sightings:
+                continue
+            timestamps, lats, lons = zip(*sightings)
+            # The date is the first 10 characters (YYYY-MM-DD) of the timestamp
+            days = np.union1d(days, np.array(timestamps).astype('S10').astype('datetime64[D]'))
+            lats = np.array(lats).astype(np.float64)
+            lons = np.array(lons).astype(np.float64)
+            inside = int(np.count_nonzero((lons < uk_lon_max) & (lons > uk_lon_min) & (lats < uk_lat_max) & (lats > uk_lat_min)))
+            inside_uk += inside
+            outside_uk += len(sightings) - inside
+    if len(days) == 0:
+        return LocationSummary(None, None, 0, inside_uk, outside_uk)
+    return LocationSummary(days[0], days[-1], len(days), inside_uk, outside_uk)
+
+def float_str(value):
+    # A float as Python 2 printed it (12 significant digits), as in earlier device ids files
+    text = '{0:.12g}'.format(value)
+    if all(c in '-0123456789' for c in text):
+        text += '.0'
+    return text
+
+def prop_days(days, first, last):
+    # Proportion of the days from first to last date (YYYY-MM-DD) seen, or None
+    if first == None or first == last:
+        return None
+    return float(days - 1) / (datetime.strptime(last, '%Y-%m-%d') - datetime.strptime(first, '%Y-%m-%d')).days
+
+def open_catalog(path):
+    """
+    Open the catalog at path, creating its tables and view if it is new.
+    """
+    catalog = sqlite3.connect(path)
+    catalog.execute('CREATE TABLE IF NOT EXISTS devices ({0}, PRIMARY KEY (FileName))'.format(', '.join(DEVICE_COLUMNS)))
+    catalog.execute('CREATE TABLE IF NOT EXISTS locations ({0}, PRIMARY KEY (FileName))'.format(', '.join(LOCATION_COLUMNS)))
+    location_columns = ', '.join('locations.' + column for column in LOCATION_COLUMNS[1:])
+    catalog.execute('CREATE VIEW IF NOT EXISTS catalog AS '
+                    'SELECT devices.*, {0} FROM devices LEFT JOIN locations ON devices.FileName = locations.FileName '
+                    'UNION ALL SELECT locations.FileName, {1}, {0} FROM locations WHERE locations.FileName NOT IN (SELECT FileName FROM devices)'.format(
+                        location_columns, ', '.join('NULL' for column in DEVICE_COLUMNS[1:])))
+    return catalog
+
+def source_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def stale_files(catalog, table, path_column, size_column, mtime_column, paths):
+    # Names of the paths (name -> path) whose catalog rows are missing or out of date
+    rows = dict((name, (path, size, mtime)) for name, path, size, mtime in catalog.execute(
+        'SELECT FileName, {0}, {1}, {2} FROM {3}'.format(path_column, size_column, mtime_column, table)))
+    stale = []
+    for name, path in paths.items():
+        try:
+            stat = source_stat(path)
+        except OSError:
+            print('Missing file: ' + path)
+            continue
+        row = rows.get(name)
+        if row == None or row != (path,) + stat:
+            stale.append(name)
+    return stale
+
+def device_row(device, meta):
+    # Row of the devices table of an indexed device file
+    first = meta['First']
+    last = meta['Last']
+    start_date = None
+    end_date = None
+    window_days = None
+    if first != None and last != None:
+        start_date = window_start(first)
+        end_date = window_end(last)
+        window_days = (datetime.strptime(end_date[:10], '%Y-%m-%d') - datetime.strptime(start_date[:10], '%Y-%m-%d')).days
+    first_day = None if first == None else first[:10]
+    last_day = None if last == None else last[:10]
+    rows = sum(count for log, count in meta['Logs'].items() if log != 'net|app')
+    return [device.FileName, device.Lancs, device.Path, meta['Size'], meta['Mtime'], meta['Clean'], first, last, meta['Days'],
+            prop_days(meta['Days'], first_day, last_day), start_date, end_date, window_days, rows] + \
+           [meta['LogDays'].get(log, 0) for log in LOG_DAYS_COLUMNS]
+
+def index_device_file(device):
+    return update_device_index(device.Path, device.Lancs, device.Index)
+
+def directory_devices(pathOfFiles, lancs, index):
+    # Devices of all the device files in pathOfFiles
+    suffix = os.path.basename(device_file_path('', '', lancs))
+    names = sorted(name[:-len(suffix)] for name in os.listdir(pathOfFiles) if name.endswith(suffix))
+    return [Device(device_file_path(pathOfFiles, name, lancs), lancs, name, None, index) for name in names]
+
+def update_devices(catalog, devices, workers=1, progress=None, prune=False):
+    """
+    Add the devices to the catalog, indexing those whose rows are missing or out of
+    date (see device_index.py). With prune, devices not in devices are removed.
+    """
+    paths = OrderedDict((device.FileName, device.Path) for device in devices)
+    stale = set(stale_files(catalog, 'devices', 'Path', 'Size', 'Mtime', paths))
+    stale_devices = [device for device in devices if device.FileName in stale]
+    with catalog:
+        for device, meta in parse_devices(index_device_file, stale_devices, workers, None, progress):
+            catalog.execute('INSERT OR REPLACE INTO devices VALUES ({0})'.format(', '.join('?' for column in DEVICE_COLUMNS)), device_row(device, meta))
+        if prune:
+            gone = [(name,) for name, in catalog.execute('SELECT FileName FROM devices') if name not in paths]
+            catalog.executemany('DELETE FROM devices WHERE FileName = ?', gone)
+    return len(stale_devices)
+
+def update_locations(catalog, directory, workers=1):
+    """
+    Add the location files in directory to the catalog, summarising those whose rows
+    are missing or out of date, and remove those no longer in it. Return the
+    (file name, LocationSummary) of each file, in the order listed by the directory.
+    """
+    filenames = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
+    paths = OrderedDict((filename, os.path.join(directory, filename)) for filename in filenames)
+    stale = stale_files(catalog, 'locations', 'LocationPath', 'LocationSize', 'LocationMtime', paths)
+    with catalog:
+        for path, summary in parse_device_results(summarise_location_file, [paths[name] for name in stale], workers):
+            name = os.path.basename(path)
+            start = None if summary.Start == None else str(summary.Start)
+            end = None if summary.End == None else str(summary.End)
+            total = summary.InUK + summary.OutUK
+            catalog.execute('INSERT OR REPLACE INTO locations VALUES ({0})'.format(', '.join('?' for column in LOCATION_COLUMNS)),
+                            [name, path] + list(source_stat(path)) + [start, end, summary.Days, prop_days(summary.Days, start, end),
+                             summary.InUK, summary.OutUK, None if total == 0 else summary.InUK / float(total)])
+        gone = [(name,) for name, in catalog.execute('SELECT FileName FROM locations') if name not in paths]
+        catalog.executemany('DELETE FROM locations WHERE FileName = ?', gone)
+
+    rows = dict((row[0], row[1:]) for row in catalog.execute('SELECT FileName, LocationStart, LocationEnd, LocationDays, InUK, OutUK FROM locations'))
+    summaries = []
+    for filename in filenames:
+        start, end, days, inside_uk, outside_uk = rows[filename]
+        summaries.append((filename, LocationSummary(None if start == None else np.datetime64(start), None if end == None else np.datetime64(end),
+                                                    days, inside_uk, outside_uk)))
+    return summaries
+
+def select_devices(catalog, where=None):
+    """
+    Return the catalog rows (as dicts) of the devices matching the filter expression
+    where (an SQL WHERE clause over the columns of the catalog view), by FileName.
+    """
+    query = 'SELECT * FROM catalog'
+    if where != None:
+        query += ' WHERE ' + where
+    cursor = catalog.execute(query + ' ORDER BY FileName')
+    columns = [description[0] for description in cursor.description]
+    return [OrderedDict(zip(columns, row)) for row in cursor]
+
+def device_ids_line(i, row):
+    """
+    Line of a device ids file (as read by read_file_names) for a catalog row: the dates,
+    days and UK counts of its location file, or the dates and days of its device file
+    with no sightings if it has no location file.
+    """
+    if row['LocationDays'] != None:
+        start, end, days, prop, inside_uk, outside_uk, prop_uk = (row['LocationStart'], row['LocationEnd'], row['LocationDays'],
+                                                                  row['PropData'], row['InUK'], row['OutUK'], row['PropUK'])
+    else:
+        start, end, days, prop, inside_uk, outside_uk, prop_uk = (None if row['First'] == None else row['First'][:10],
+                                                                  None if row['Last'] == None else row['Last'][:10],
+                                                                  row['Days'], row['PropDays'], 0, 0, None)
+    return ' '.join([str(i), row['FileName'], str(start), str(end), str(days), float_str(prop or 0.0), str(inside_uk),
+                     str(outside_uk), float_str(prop_uk or 0.0)])
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    progress = ProgressReporter('device_catalog', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    locations = pop_option(args, '--locations')
+    pathOfIdsFile = pop_option(args, '--ids')
+    where = pop_option(args, '--select')
+
+    if where == None and len(args) < 4 or where != None and len(args) < 2:
+        print('Usage: ' + args[0] + ' <catalog file> <path of device files> <index dir> [lancs] [--ids device ids file] [--locations dir of location files] [--workers N] [--progress seconds] [--status file]')
+        print('       ' + args[0] + ' <catalog file> --select "<filter expression>" [lancs]')
+        sys.exit(1)
+
+    catalog = open_catalog(args[1])
+
+    if where != None:
+        # Print the device ids file of the devices matching the filter expression
+        lancs = bool(len(args) > 2)
+        for i, row in enumerate(select_devices(catalog, where), 1):
+            print(row['FileName'] if lancs else device_ids_line(i, row))
+        sys.exit(0)
+
+    pathOfFiles = args[2]
+    index = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+
+    if pathOfIdsFile != None:
+        devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, None, index)
+    else:
+        devices = directory_devices(pathOfFiles, lancs, index)
+    updated = update_devices(catalog, devices, workers, progress, prune=pathOfIdsFile == None)
+    print('{0} of {1} devices updated'.format(updated, len(devices)))
+    if locations != None:
+        update_locations(catalog, locations, workers)
+
+    # **** For checking timings *****
+    endFilesTime = datetime.now()
+    print("All files catalogued in {0}".format(str((endFilesTime - startTime))))
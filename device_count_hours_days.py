@@ -14,17 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 from collections import namedtuple
-import dateutil.parser
-from datetime import datetime, timedelta
+from datetime import datetime
 import numpy as np
+from da_common import read_device_file, feed_parser, pop_option, Device, list_devices, parse_devices, open_result_store, AppIdIndex, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
 
+global output
 global hdc_facebook_rx
 global hdc_facebook_tx
 global hlc_facebook_rx
@@ -45,90 +42,61 @@ global whdc_snapchat_tx
 global whlc_snapchat_rx
 global whlc_snapchat_tx
 
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.BufferedReader(gzip.open(path, 'rU')) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield apply(DARecord._make, (repacked,))
-    except:
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except:
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
+# Per-device counts for one app and direction, computed by device_parser (possibly
+# in a worker process) and added to the global counts by merge_device_result
+# Hours/DayHours: 1 if the device logged data in the (day and) hour, Logs/DayLogs: no. of logs
+LogCounts = namedtuple('LogCounts', ('Hours', 'Logs', 'DayHours', 'DayLogs'))
+DeviceResult = namedtuple('DeviceResult', ('FacebookRx', 'FacebookTx', 'SnapchatRx', 'SnapchatTx'))
+
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['net','app']
+# Only app data and app installed rows are used, and installed rows naming the apps
+entry_types_to_parse = ['net|app', 'app|installed']
+packages_to_parse = ['com.facebook.katana', 'com.snapchat.android']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['hdc_facebook_rx', 'hdc_facebook_tx', 'hlc_facebook_rx', 'hlc_facebook_tx',
+                  'hdc_snapchat_rx', 'hdc_snapchat_tx', 'hlc_snapchat_rx', 'hlc_snapchat_tx',
+                  'whdc_facebook_rx', 'whdc_facebook_tx', 'whlc_facebook_rx', 'whlc_facebook_tx',
+                  'whdc_snapchat_rx', 'whdc_snapchat_tx', 'whlc_snapchat_rx', 'whlc_snapchat_tx']
 
 def count_hourly_app_data_logs(file, lancs):
-    global hdc_facebook_rx
-    global hdc_facebook_tx
-    global hlc_facebook_rx
-    global hlc_facebook_tx
-
-    global hdc_snapchat_rx
-    global hdc_snapchat_tx
-    global hlc_snapchat_rx
-    global hlc_snapchat_tx
+    merge_device_result(parse_device_file(Device(file, lancs, None)))
 
-    global whdc_facebook_rx
-    global whdc_facebook_tx
-    global whlc_facebook_rx
-    global whlc_facebook_tx
-
-    global whdc_snapchat_rx
-    global whdc_snapchat_tx
-    global whlc_snapchat_rx
-    global whlc_snapchat_tx
+def parse_device_file(device):
+    return feed_parser(device_parser(device.Path, device.FileName), read_device_file(device.Path, device.Lancs, device.Cache, entry_types_to_parse, packages_to_parse))
 
+def device_parser(file, fname):
     hc_facebook_rx = np.zeros(24)
     hc_facebook_tx = np.zeros(24)
 
     hc_snapchat_rx = np.zeros(24)
     hc_snapchat_tx = np.zeros(24)
 
+    lc_facebook_rx = np.zeros(24)
+    lc_facebook_tx = np.zeros(24)
+
+    lc_snapchat_rx = np.zeros(24)
+    lc_snapchat_tx = np.zeros(24)
+
     whc_facebook_rx = np.zeros((7, 24))
     whc_facebook_tx = np.zeros((7, 24))
 
     whc_snapchat_rx = np.zeros((7, 24))
     whc_snapchat_tx = np.zeros((7, 24))
 
-    logs_to_parse = ['net','app']
-    apps_to_parse = ['com.facebook.katana', 'com.snapchat.android']
-    current_app_name_id_mapping = {}
+    wlc_facebook_rx = np.zeros((7, 24))
+    wlc_facebook_tx = np.zeros((7, 24))
+
+    wlc_snapchat_rx = np.zeros((7, 24))
+    wlc_snapchat_tx = np.zeros((7, 24))
+
+    app_ids = AppIdIndex(clear_stale=False)
     app_data = {}
 
-    for row in (read_file_lancs(file) if lancs else read_file(file)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -140,65 +108,120 @@ def count_hourly_app_data_logs(file, lancs):
 
         if row_entry_type.startswith('net|app'):
             app_id = entry_val[2]
-            app_name = None
-            for key, val in current_app_name_id_mapping.items():
-                if val == app_id:
-                    app_name = key
+            app_name = app_ids.name(app_id)
             if app_name == None:
                 continue
 
-            weekday = dateutil.parser.parse(row_date).weekday()
-            hour = dateutil.parser.parse(row_date).hour
+            row_time = row.Time
+            weekday = row_time.Weekday
+            hour = row_time.Hour
             if entry_val[3] == 'rx_bytes':
                 last_rx = app_data[app_name][0]
                 if last_rx != None and last_rx != row_value:
                     if 'facebook' in app_data[app_name][2]:
                         hc_facebook_rx[hour] = 1
-                        hlc_facebook_rx[hour] += 1
+                        lc_facebook_rx[hour] += 1
                         whc_facebook_rx[weekday][hour] = 1
-                        whlc_facebook_rx[weekday][hour] += 1
+                        wlc_facebook_rx[weekday][hour] += 1
                     else:
                         hc_snapchat_rx[hour] = 1
-                        hlc_snapchat_rx[hour] += 1
+                        lc_snapchat_rx[hour] += 1
                         whc_snapchat_rx[weekday][hour] = 1
-                        whlc_snapchat_rx[weekday][hour] += 1
+                        wlc_snapchat_rx[weekday][hour] += 1
                 app_data[app_name][0] = row_value
             else:
                 last_tx = app_data[app_name][1]
                 if last_tx != None and last_tx != row_value:
                     if 'facebook' in app_data[app_name][2]:
                         hc_facebook_tx[hour] = 1
-                        hlc_facebook_tx[hour] += 1
+                        lc_facebook_tx[hour] += 1
                         whc_facebook_tx[weekday][hour] = 1
-                        whlc_facebook_tx[weekday][hour] += 1
+                        wlc_facebook_tx[weekday][hour] += 1
                     else:
                         hc_snapchat_tx[hour] = 1
-                        hlc_snapchat_tx[hour] += 1
+                        lc_snapchat_tx[hour] += 1
                         whc_snapchat_tx[weekday][hour] = 1
-                        whlc_snapchat_tx[weekday][hour] += 1
+                        wlc_snapchat_tx[weekday][hour] += 1
                 app_data[app_name][1] = row_value
         elif row_entry_type.startswith('app|installed'):
             for app_entry in row.Value.split(','):
                 temp_name =  app_entry.split('@')[0]
-                if temp_name in apps_to_parse:
+                if temp_name in packages_to_parse:
                     app_info = app_entry.split('@')[1].split(':')
                     temp_app_id = app_info[len(app_info) - 2]
-                    if temp_name not in current_app_name_id_mapping:
+                    if temp_name not in app_ids:
                         app_data[temp_name] = [None, None, temp_name]
-                    current_app_name_id_mapping[temp_name] = temp_app_id
+                    app_ids.install(temp_name, temp_app_id)
 
 
-    hdc_facebook_rx = [x + y for x, y in zip(hdc_facebook_rx, hc_facebook_rx)]
-    hdc_facebook_tx = [x + y for x, y in zip(hdc_facebook_tx, hc_facebook_tx)]
-    hdc_snapchat_rx = [x + y for x, y in zip(hdc_snapchat_rx, hc_snapchat_rx)]
-    hdc_snapchat_tx = [x + y for x, y in zip(hdc_snapchat_tx, hc_snapchat_tx)]
+    return DeviceResult(LogCounts(hc_facebook_rx, lc_facebook_rx, whc_facebook_rx, wlc_facebook_rx),
+                        LogCounts(hc_facebook_tx, lc_facebook_tx, whc_facebook_tx, wlc_facebook_tx),
+                        LogCounts(hc_snapchat_rx, lc_snapchat_rx, whc_snapchat_rx, wlc_snapchat_rx),
+                        LogCounts(hc_snapchat_tx, lc_snapchat_tx, whc_snapchat_tx, wlc_snapchat_tx))
 
-    whdc_facebook_rx = [x + y for x, y in zip(whdc_facebook_rx, whc_facebook_rx)]
-    whdc_facebook_tx = [x + y for x, y in zip(whdc_facebook_tx, whc_facebook_tx)]
-    whdc_snapchat_rx = [x + y for x, y in zip(whdc_snapchat_rx, whc_snapchat_rx)]
-    whdc_snapchat_tx = [x + y for x, y in zip(whdc_snapchat_tx, whc_snapchat_tx)]
+def merge_device_result(result):
+    global hdc_facebook_rx
+    global hdc_facebook_tx
+    global hlc_facebook_rx
+    global hlc_facebook_tx
+
+    global hdc_snapchat_rx
+    global hdc_snapchat_tx
+    global hlc_snapchat_rx
+    global hlc_snapchat_tx
+
+    global whdc_facebook_rx
+    global whdc_facebook_tx
+    global whlc_facebook_rx
+    global whlc_facebook_tx
+
+    global whdc_snapchat_rx
+    global whdc_snapchat_tx
+    global whlc_snapchat_rx
+    global whlc_snapchat_tx
+
+    hdc_facebook_rx = [x + y for x, y in zip(hdc_facebook_rx, result.FacebookRx.Hours)]
+    hdc_facebook_tx = [x + y for x, y in zip(hdc_facebook_tx, result.FacebookTx.Hours)]
+    hdc_snapchat_rx = [x + y for x, y in zip(hdc_snapchat_rx, result.SnapchatRx.Hours)]
+    hdc_snapchat_tx = [x + y for x, y in zip(hdc_snapchat_tx, result.SnapchatTx.Hours)]
+
+    hlc_facebook_rx += result.FacebookRx.Logs
+    hlc_facebook_tx += result.FacebookTx.Logs
+    hlc_snapchat_rx += result.SnapchatRx.Logs
+    hlc_snapchat_tx += result.SnapchatTx.Logs
+
+    whdc_facebook_rx = [x + y for x, y in zip(whdc_facebook_rx, result.FacebookRx.DayHours)]
+    whdc_facebook_tx = [x + y for x, y in zip(whdc_facebook_tx, result.FacebookTx.DayHours)]
+    whdc_snapchat_rx = [x + y for x, y in zip(whdc_snapchat_rx, result.SnapchatRx.DayHours)]
+    whdc_snapchat_tx = [x + y for x, y in zip(whdc_snapchat_tx, result.SnapchatTx.DayHours)]
+
+    whlc_facebook_rx += result.FacebookRx.DayLogs
+    whlc_facebook_tx += result.FacebookTx.DayLogs
+    whlc_snapchat_rx += result.SnapchatRx.DayLogs
+    whlc_snapchat_tx += result.SnapchatTx.DayLogs
+
+def init_report():
+    global hdc_facebook_rx
+    global hdc_facebook_tx
+    global hlc_facebook_rx
+    global hlc_facebook_tx
+    global hdc_snapchat_rx
+    global hdc_snapchat_tx
+    global hlc_snapchat_rx
+    global hlc_snapchat_tx
+    global whdc_facebook_rx
+    global whdc_facebook_tx
+    global whlc_facebook_rx
+    global whlc_facebook_tx
+    global whdc_snapchat_rx
+    global whdc_snapchat_tx
+    global whlc_snapchat_rx
+    global whlc_snapchat_tx
+    global output
+
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
-if __name__ == '__main__':
     # Hourly device count for Facebook rx and tx logs
     hdc_facebook_rx = np.zeros(24)
     hdc_facebook_tx = np.zeros(24)
@@ -227,21 +250,10 @@ if __name__ == '__main__':
     whlc_snapchat_rx = np.zeros((7, 24))
     whlc_snapchat_tx = np.zeros((7, 24))
 
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    lancs = bool(len(sys.argv) > 3)
-
-    startTime = datetime.now()
-
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        count_hourly_app_data_logs(fullfpath, lancs)
+def finish_report():
+    global output
 
-    with open('out_device_count_hours_days.csv', 'w') as f:
+    with output.open('out_device_count_hours_days.csv', 'w') as f:
         hourly_fb_output = ('HOURLY DEVICE COUNT FOR FACEBOOK RX: \n{0}\n'.format(hdc_facebook_rx)
         + 'HOURLY DEVICE COUNT FOR FACEBOOK TX: \n{0}\n'.format(hdc_facebook_tx)
         + 'HOURLY TOTAL NO. LOGS FOR FACEBOOK RX: \n{0}\n'.format(hlc_facebook_rx)
@@ -277,6 +289,50 @@ if __name__ == '__main__':
         f.write('DAY HOURLY TOTAL NO. LOGS FOR SNAPCHAT TX (DAY: NO. OF LOGS): \n')
         for x in range(0,7):
             f.write('{0}: {1}\n'.format(x, whlc_snapchat_tx[x]))
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('device_count_hours_days', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    lancs = bool(len(args) > 3)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'device_count_hours_days')
+
+    init_report()
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache)
+    options = [str(lancs)]
+    checkpoint = open_checkpoint(checkpoint_path, 'device_count_hours_days', devices, [], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'device_count_hours_days', devices, [], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'device_count_hours_days', []), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'device_count_hours_days', devices, [], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'device_count_hours_days', []), progress, checkpoint)
+    for device, result in devices_results:
+        merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
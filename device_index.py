@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Index of the device files. Each device file gets a small JSON sidecar with
+# the facts scripts need before parsing it, so devices without a date window
+# or without the logs a script summarises are skipped without reading them,
+# and windowed scripts seek straight to the first day of the window.
+# A sidecar is rebuilt whenever the size or mtime of its device file changes.
+#
+# Fields of a sidecar:
+#   First, Last: first and last valid dates (of the rows whose date is valid), or null
+#   Days: no. of distinct dates of the rows with a valid date
+#   Logs: no. of rows of each log, and of 'net|app' rows
+#   LogDays: no. of distinct dates of the rows of each log (and 'net|app') with a valid date
+#   Ordered: whether the valid dates never go backwards in the file
+#   Offsets: [date, offset] of the first row of each date, as byte offsets into the
+#     decompressed device file (null for lancs files, which are read whole)
+#   Clean: whether the rows indexed are exactly those read_file yields. Sidecars of
+#     files which failed to decode are not used, and the files are read as before.
+#   Blocks, SeekPoints: path of the blocked copy of the device file, and the
+#     [decompressed offset, compressed offset] where each of its gzip members
+#     starts (null if the file was indexed without --blocks)
+#
+# A device file is a single gzip member, so reading from a day onwards means
+# decompressing everything before it. With --blocks N the indexer also writes a
+# copy of each ordered device file as a gzip file of several members, each
+# starting at the first row of a day at least N MB (decompressed) after the start
+# of the one before. The copy decompresses to the same bytes, and the window of a
+# device is read from the member it starts in.
+
+import sys
+import os
+import io
+import gzip
+import json
+import zlib
+from datetime import datetime
+from da_common import decode_lines, decode_file_lancs, read_device_file, date_window, pop_option, list_devices, parse_devices, profile_rows, device_stream, ProgressReporter
+
+INDEX_VERSION = 3
+
+global block_size
+
+def index_entry_path(path, index):
+    return os.path.join(index, os.path.basename(path) + '.json')
+
+def source_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def read_index_entry(path, index):
+    try:
+        with open(index_entry_path(path, index), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def index_is_fresh(meta, path, lancs, block_size=None):
+    # Any block size will do if block_size is None
+    if meta == None or meta['Version'] != INDEX_VERSION:
+        return False
+    if block_size != None and meta['BlockSize'] != block_size:
+        return False
+    if meta['Blocks'] != None and not os.path.exists(meta['Blocks']):
+        return False
+    size, mtime = source_stat(path)
+    return meta['Lancs'] == lancs and meta['Size'] == size and meta['Mtime'] == mtime
+
+def gzip_lines(path):
+    """
+    Yield (date, entry type, offset, line) of the lines of a gzipped device file, offset
+    being the byte offset of the line in the decompressed file. Raises ValueError where
+    decode_file would fail, or where it would split the lines differently.
+    """
+    offset = 0
+    with io.BufferedReader(device_stream(gzip.open(path))) as data:
+        for line in data:
+            # Text mode also ends lines at '\r'
+            if b'\r' in line:
+                raise ValueError('Carriage return in line at offset {0}'.format(offset))
+            e = line.decode('utf-8').split(';', 4)
+            if len(e) < 5:
+                raise ValueError('Expected 5 items, got {0}: {1}'.format(len(e), e[0][:20]))
+            yield e[2], e[3], offset, line
+            offset += len(line)
+
+def lancs_lines(path):
+    for row in decode_file_lancs(path):
+        yield row.Date, row.EntryType, None, None
+
+class GzipBlocks(object):
+    """
+    Writes the lines of a device file to a gzip file of several members. mark(offset) is
+    called at the first row of each day, and starts a new member if the current one
+    holds at least block_size bytes; points lists where each member starts.
+    """
+    def __init__(self, path, block_size):
+        self.file = open(path, 'wb')
+        self.block_size = block_size
+        self.compressor = None
+        self.member_size = 0
+        self.points = []
+
+    def start(self, offset):
+        if self.compressor != None:
+            self.file.write(self.compressor.flush())
+        self.points.append([offset, self.file.tell()])
+        # Compressed as gzip.open does, with a gzip header
+        self.compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        self.member_size = 0
+
+    def mark(self, offset):
+        if self.compressor == None or self.member_size >= self.block_size:
+            self.start(offset)
+
+    def write(self, line):
+        if self.compressor == None:
+            self.start(0)
+        self.file.write(self.compressor.compress(line))
+        self.member_size += len(line)
+
+    def close(self):
+        if self.compressor != None:
+            self.file.write(self.compressor.flush())
+        self.file.close()
+
+def build_device_index(path, lancs, index, block_size=None):
+    """
+    Index the device file at path into a new sidecar in the index directory, replacing
+    any old one, and return its fields. With a block_size (in bytes) a blocked copy of
+    the device file is also written to the index directory.
+    """
+    size, mtime = source_stat(path)
+    first = None
+    last = None
+    days = set()
+    logs = {}
+    log_days = {}
+    ordered = True
+    offsets = None if lancs else []
+    clean = True
+
+    if not os.path.isdir(index):
+        os.makedirs(index, exist_ok=True)
+    blocks_path = os.path.join(index, os.path.basename(path))
+    tmp_blocks_path = blocks_path + '.tmp{0}'.format(os.getpid())
+    blocks = None if lancs or block_size == None else GzipBlocks(tmp_blocks_path, block_size)
+
+    try:
+        for date, entry_type, offset, line in (lancs_lines(path) if lancs else gzip_lines(path)):
+            log = entry_type.partition('|')[0]
+            logs[log] = logs.get(log, 0) + 1
+            if entry_type.startswith('net|app'):
+                logs['net|app'] = logs.get('net|app', 0) + 1
+            valid = '(invalid date)' not in date
+            if valid:
+                log_days.setdefault(log, set()).add(date[:10])
+                if entry_type.startswith('net|app'):
+                    log_days.setdefault('net|app', set()).add(date[:10])
+            if valid and date[:10] not in days:
+                days.add(date[:10])
+                if offsets != None:
+                    offsets.append([date[:10], offset])
+                if blocks != None:
+                    blocks.mark(offset)
+            if blocks != None:
+                blocks.write(line)
+            if not valid:
+                # Device parsers only skip rows whose date is exactly this
+                ordered = ordered and date == '(invalid date)'
+                continue
+            if first == None:
+                first = date[:-9]
+            elif date[:-9] < last:
+                ordered = False
+            last = date[:-9]
+    except Exception:
+        clean = False
+
+    # The blocked copy is only read from the window of ordered device files
+    seek_points = None
+    if blocks != None:
+        blocks.close()
+        if clean and ordered:
+            os.replace(tmp_blocks_path, blocks_path)
+            seek_points = blocks.points
+        else:
+            os.remove(tmp_blocks_path)
+    if seek_points == None and os.path.exists(blocks_path):
+        os.remove(blocks_path)
+
+    meta = {'Version': INDEX_VERSION, 'Source': path, 'Lancs': lancs, 'Size': size, 'Mtime': mtime,
+            'Clean': clean, 'First': first, 'Last': last, 'Days': len(days), 'Logs': logs,
+            'LogDays': dict((log, len(dates)) for log, dates in log_days.items()),
+            'Ordered': ordered, 'Offsets': offsets, 'BlockSize': block_size,
+            'Blocks': None if seek_points == None else blocks_path, 'SeekPoints': seek_points}
+    entry_path = index_entry_path(path, index)
+    tmp_path = entry_path + '.tmp{0}'.format(os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, entry_path)
+    return meta
+
+def update_device_index(path, lancs, index, block_size=None):
+    meta = read_index_entry(path, index)
+    if not index_is_fresh(meta, path, lancs, block_size):
+        meta = build_device_index(path, lancs, index, block_size)
+    return meta
+
+def load_device_index(path, lancs, index):
+    """
+    Return the sidecar fields of the device file at path, indexing it first if needed,
+    or None if there is no index, the file is missing or it did not decode cleanly.
+    """
+    if index == None:
+        return None
+    try:
+        meta = update_device_index(path, lancs, index)
+    except OSError:
+        # Read as usual, which reports the missing file
+        return None
+    return meta if meta['Clean'] else None
+
+def device_window(meta):
+    # The 04:00 to 04:00 window of an indexed device (as date_window), or (None, None)
+    return date_window(meta['First'], meta['Last'])
+
+def device_has_logs(meta, logs):
+    # Whether an indexed device has any rows of logs (log names, or 'net|app')
+    return any(meta['Logs'].get(log, 0) > 0 for log in logs)
+
+def window_offsets(meta, start_date, end_date):
+    """
+    Return the (begin, end) byte offsets of the rows of an indexed device which can be
+    dated from start_date up to end_date: from the first row of the start date up to
+    the first row of a date after the end date (None for the end of the file).
+    Only valid if the dates are ordered.
+    """
+    begin = None
+    for date, offset in meta['Offsets']:
+        if date > end_date[:10]:
+            return offset if begin == None else begin, offset
+        if begin == None and date >= start_date[:10]:
+            begin = offset
+    return begin, None
+
+class WindowReader(io.RawIOBase):
+    """
+    Reads at most size bytes (all if size is None) of the decompressed file object data,
+    and closes data and the compressed file under it when closed.
+    """
+    def __init__(self, data, size, compressed):
+        self.data = data
+        self.remaining = size
+        self.compressed = compressed
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self.data.read(len(b) if self.remaining == None else min(len(b), self.remaining))
+        b[:len(chunk)] = chunk
+        if self.remaining != None:
+            self.remaining -= len(chunk)
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self.data.close()
+            self.compressed.close()
+        io.RawIOBase.close(self)
+
+def read_window_rows(path, meta, start_date, end_date, logs_to_parse=None, packages=None):
+    begin, end = window_offsets(meta, start_date, end_date)
+    if begin == None:
+        return
+    # Start at the member of the blocked copy the window begins in, if there is one
+    source = path if meta['Blocks'] == None else meta['Blocks']
+    seek_points = [[0, 0]] if meta['SeekPoints'] == None else meta['SeekPoints']
+    offset, compressed_offset = [point for point in seek_points if point[0] <= begin][-1]
+
+    def open_window():
+        compressed = open(source, 'rb')
+        compressed.seek(compressed_offset)
+        data = gzip.GzipFile(fileobj=compressed)
+        data.seek(begin - offset)
+        return io.TextIOWrapper(io.BufferedReader(WindowReader(device_stream(data), None if end == None else end - begin, compressed)))
+
+    try:
+        with open_window() as window:
+            for row in decode_lines(window, logs_to_parse, packages, open_window):
+                yield row
+    except Exception as ex:
+        print(ex)
+        print('Failed to read file: ' + path)
+
+def read_device_window(path, lancs, cache, meta, start_date, end_date, logs_to_parse=None, packages=None):
+    """
+    Yield the rows a device parser with the window start_date to end_date needs, from
+    the indexed device file at path: only the days inside the window if the file is
+    read directly and its dates are ordered, else every row as read_device_file does.
+    """
+    if cache != None or meta['Offsets'] == None or not meta['Ordered']:
+        return read_device_file(path, lancs, cache, logs_to_parse, packages)
+    return profile_rows(read_window_rows(path, meta, start_date, end_date, logs_to_parse, packages))
+
+def index_device_file(device):
+    global block_size
+
+    update_device_index(device.Path, device.Lancs, device.Index, block_size)
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    progress = ProgressReporter('device_index', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    blocks = pop_option(args, '--blocks')
+    block_size = None if blocks == None else int(float(blocks) * 1024 * 1024)
+
+    if len(args) < 4:
+        print('Usage: ' + args[0] + ' <device ids file> <path of device files> <index dir> [lancs] [--workers N] [--blocks MB] [--progress seconds] [--status file]')
+        sys.exit(1)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    index = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+
+    if not os.path.isdir(index):
+        os.makedirs(index)
+
+    for device, result in parse_devices(index_device_file, list_devices(pathOfIdsFile, pathOfFiles, lancs, None, index), workers, None, progress):
+        pass
+
+    # **** For checking timings *****
+    endFilesTime = datetime.now()
+    print("All files indexed in {0}".format(str((endFilesTime - startTime))))
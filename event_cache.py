@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Columnar cache of the device files. Each device file is decoded once into a
+# directory of .npy columns which can be memory mapped, and later runs read the
+# rows from the cache instead of decompressing and splitting the log again.
+# A cache entry is rebuilt whenever the size or mtime of its device file changes.
+#
+# Columns of a cache entry (one element per row of the device file):
+#   Entry, Num, Date, Value: the row fields, stored as utf-8 text with offsets
+#   Type: code of the EntryType field in the Types list of meta.json
+#   Time, Microsecond, Offset: seconds since the epoch (UTC when the zone is known),
+#     microsecond and UTC offset in seconds (or NO_OFFSET) of Date, or INVALID_TIME
+#   Hour: local hour of Date as the device parsers take it, or INVALID_HOUR
+#   Id: first numeric EntryType item (the pid of app logs, the uid of net|app logs), or -1
+#   Number: Value as an integer, or INVALID_NUMBER
+# Rows are selected by their Type code, and only the text of the rows kept is decoded.
+# The rows are CachedRecords, whose Hour, Number, Time and Id come from the typed
+# columns instead of being decoded from the text again by the device parsers.
+
+import sys
+import os
+import json
+import shutil
+import da_common
+from array import array
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from da_common import DARecord, DATime, fields_da, INSTALLED_TYPE, log_filter, decode_device_file, decode_time, entry_type_id, pop_option, list_devices, parse_devices, ProgressReporter
+
+CACHE_VERSION = 3
+TEXT_COLUMNS = ('Entry', 'Num', 'Date', 'Value')
+# Typed columns and their dtypes, the values which are not decoded being marked
+TYPED_COLUMNS = (('Time', np.int64), ('Microsecond', np.int32), ('Offset', np.int32),
+                 ('Hour', np.int32), ('Id', np.int64), ('Number', np.int64))
+INVALID_TIME = np.iinfo(np.int64).min
+NO_OFFSET = np.iinfo(np.int32).min
+INVALID_HOUR = np.iinfo(np.int32).min
+INVALID_NUMBER = np.iinfo(np.int64).min
+
+# Rows are rebuilt from the text columns in blocks of this many rows
+BLOCK_ROWS = 65536
+
+def cache_entry_path(path, cache):
+    return os.path.join(cache, os.path.basename(path))
+
+def source_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+def read_meta(entry_path):
+    try:
+        with open(os.path.join(entry_path, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def cache_is_fresh(path, lancs, cache):
+    meta = read_meta(cache_entry_path(path, cache))
+    if meta == None:
+        return False
+    size, mtime = source_stat(path)
+    return (meta['Version'] == CACHE_VERSION and meta['Lancs'] == lancs
+            and meta['Size'] == size and meta['Mtime'] == mtime)
+
+class CachedRecord(namedtuple('CachedRecord', fields_da + ('CachedTime', 'CachedMicrosecond', 'CachedOffset', 'CachedHour', 'Id', 'CachedNumber'))):
+    """
+    A row read from a cache entry: the DARecord fields and the typed columns of the
+    row. Hour, Number and Time are those of the DARecord, taken from the columns; a
+    value the cache could not decode is decoded from the text, as for a DARecord.
+    """
+    __slots__ = ()
+
+    @property
+    def Hour(self):
+        if self.CachedHour == INVALID_HOUR:
+            return DARecord.Hour.fget(self)
+        return self.CachedHour
+
+    @property
+    def Number(self):
+        if self.CachedNumber == INVALID_NUMBER:
+            return DARecord.Number.fget(self)
+        return self.CachedNumber
+
+    @property
+    def Time(self):
+        seconds = self.CachedTime
+        if seconds == INVALID_TIME:
+            return decode_time(self.Date)
+        offset = None if self.CachedOffset == NO_OFFSET else self.CachedOffset
+        return cached_time(seconds, self.CachedMicrosecond, offset)
+
+def cached_time(seconds, microsecond, offset):
+    # The DATime of a timestamp from its seconds, microsecond and UTC offset
+    local = seconds + (offset or 0)
+    day = local // 86400
+    # 1970-01-01 was a Thursday
+    return DATime(seconds, microsecond, offset, day, (day + 3) % 7, local % 86400 // 3600)
+
+def typed_values(row):
+    """
+    Return the values of the typed columns of row, each marked as not decoded unless
+    decoding it from the cache gives exactly what decoding the text of row gives.
+    """
+    seconds, microsecond, offset = INVALID_TIME, 0, NO_OFFSET
+    if row.Date != '(invalid date)':
+        try:
+            time = decode_time(row.Date)
+            if time == cached_time(time.Seconds, time.Microsecond, time.Offset) and -2**62 < time.Seconds < 2**62:
+                seconds, microsecond = time.Seconds, time.Microsecond
+                offset = NO_OFFSET if time.Offset == None else time.Offset
+        except (ValueError, OverflowError, TypeError):
+            pass
+    try:
+        hour = DARecord.Hour.fget(row)
+        if not INVALID_HOUR < hour < 2**31:
+            hour = INVALID_HOUR
+    except (ValueError, IndexError):
+        hour = INVALID_HOUR
+    try:
+        number = int(row.Value)
+        if not INVALID_NUMBER < number < 2**63:
+            number = INVALID_NUMBER
+    except ValueError:
+        number = INVALID_NUMBER
+    return seconds, microsecond, offset, hour, entry_type_id(row.EntryType), number
+
+def build_cache_entry(path, lancs, cache):
+    """
+    Decode the device file at path into a new cache entry, replacing any old one.
+    A decoding error ends the rows as it does in read_file, and is kept in meta.json
+    so that reading the entry reports it again.
+    """
+    entry_path = cache_entry_path(path, cache)
+    tmp_path = entry_path + '.tmp{0}'.format(os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    size, mtime = source_stat(path)
+
+    texts = dict((name, open(os.path.join(tmp_path, name + '.txt'), 'wb')) for name in TEXT_COLUMNS)
+    offsets = dict((name, array('q', [0])) for name in TEXT_COLUMNS)
+    types = {}
+    type_codes = array('i')
+    typed = [array('q') for name, dtype in TYPED_COLUMNS]
+    error = None
+
+    try:
+        for row in decode_device_file(path, lancs):
+            for name, text in zip(TEXT_COLUMNS, (row.Entry, row.Num, row.Date, row.Value)):
+                data = text.encode('utf-8')
+                texts[name].write(data)
+                offsets[name].append(offsets[name][-1] + len(data))
+            if row.EntryType not in types:
+                types[row.EntryType] = len(types)
+            type_codes.append(types[row.EntryType])
+            for column, value in zip(typed, typed_values(row)):
+                column.append(value)
+    except Exception as ex:
+        error = str(ex)
+    finally:
+        for text in texts.values():
+            text.close()
+
+    for name in TEXT_COLUMNS:
+        # Offsets are kept as int32 unless the text is too long for them
+        column = np.frombuffer(offsets[name], dtype=np.int64)
+        np.save(os.path.join(tmp_path, name + '.npy'), column.astype(np.int32) if column[-1] < 2**31 else column)
+    np.save(os.path.join(tmp_path, 'Type.npy'), np.frombuffer(type_codes, dtype=np.int32))
+    for (name, dtype), column in zip(TYPED_COLUMNS, typed):
+        np.save(os.path.join(tmp_path, name + '.npy'), np.frombuffer(column, dtype=np.int64).astype(dtype))
+
+    meta = {'Version': CACHE_VERSION, 'Source': path, 'Lancs': lancs, 'Size': size, 'Mtime': mtime,
+            'Rows': len(type_codes), 'Types': sorted(types, key=types.get), 'Error': error}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(entry_path):
+        shutil.rmtree(entry_path)
+    os.rename(tmp_path, entry_path)
+
+def update_cache_entry(path, lancs, cache):
+    if not cache_is_fresh(path, lancs, cache):
+        build_cache_entry(path, lancs, cache)
+
+def load_cache_entry(path, lancs, cache):
+    """
+    Return (meta, columns) of the cache entry of the device file at path, building it
+    first if needed. The numeric columns and the text column offsets are memory mapped.
+    """
+    update_cache_entry(path, lancs, cache)
+    entry_path = cache_entry_path(path, cache)
+    columns = {}
+    for name in ('Type',) + TEXT_COLUMNS + tuple(name for name, dtype in TYPED_COLUMNS):
+        columns[name] = np.load(os.path.join(entry_path, name + '.npy'), mmap_mode='r')
+    return read_meta(entry_path), columns
+
+def split_text(data, stops):
+    # Decode the utf-8 bytes data and split it into strings ending at the byte offsets stops
+    decoded = data.decode('utf-8')
+    # Byte offsets are also character offsets when the text is all ascii
+    ascii = len(decoded) == len(data)
+    values = []
+    begin = 0
+    for stop in stops:
+        values.append(decoded[begin:stop] if ascii else data[begin:stop].decode('utf-8'))
+        begin = stop
+    return values
+
+def read_text_block(text, offsets, start, end):
+    # Slice the utf-8 text of rows start to end into strings
+    first = int(offsets[start])
+    last = int(offsets[end])
+    return split_text(bytes(text[first:last]), (offsets[start + 1:end + 1] - first).tolist())
+
+def read_text_rows(text, offsets, indices):
+    # Slice the utf-8 text of the rows indices (an array of row numbers) into strings,
+    # gathering the bytes of only those rows so that the other rows are not decoded
+    begins = offsets[indices].astype(np.int64)
+    lengths = offsets[indices + 1] - begins
+    stops = np.cumsum(lengths)
+    positions = np.arange(int(stops[-1])) + np.repeat(begins - (stops - lengths), lengths)
+    return split_text(text[positions].tobytes(), stops.tolist())
+
+def read_cached_file(path, lancs, cache, logs_to_parse=None, packages=None):
+    """
+    Yield the CachedRecord rows of the device file at path from its cache entry,
+    building the entry first if it is missing or out of date. If logs_to_parse
+    is given, only rows of those logs (or entry types) are rebuilt, selected by
+    their type code; app|installed rows are then checked for packages, if given.
+    """
+    try:
+        meta, columns = load_cache_entry(path, lancs, cache)
+    except OSError as ex:
+        print(ex)
+        print('Failed to read file: ' + path)
+        return
+
+    entry_path = cache_entry_path(path, cache)
+    texts = {}
+    for name in TEXT_COLUMNS:
+        if os.path.getsize(os.path.join(entry_path, name + '.txt')) > 0:
+            texts[name] = np.memmap(os.path.join(entry_path, name + '.txt'), dtype=np.uint8, mode='r')
+        else:
+            texts[name] = np.zeros(0, dtype=np.uint8)
+    types = meta['Types']
+    rows = meta['Rows']
+    if da_common.profiler != None:
+        da_common.profiler.cached_rows(dict(zip(types, np.bincount(columns['Type'], minlength=len(types)).tolist())))
+    keep = log_filter(logs_to_parse, packages)
+    if keep != None:
+        kept_codes = np.array([code for code, entry_type in enumerate(types) if keep.keep_type(entry_type)], dtype=np.int32)
+    # Only the app|installed rows kept have their packages checked
+    package_codes = set()
+    if keep != None and keep.packages != None:
+        package_codes = set(code for code, entry_type in enumerate(types)
+                            if entry_type == INSTALLED_TYPE or entry_type.startswith(INSTALLED_TYPE + '|'))
+
+    make_record = tuple.__new__
+    for start in range(0, rows, BLOCK_ROWS):
+        end = min(start + BLOCK_ROWS, rows)
+        if da_common.read_counts != None:
+            da_common.read_counts.rows += end - start
+        codes = columns['Type'][start:end]
+        if keep == None:
+            entries, nums, dates, values = [read_text_block(texts[name], columns[name], start, end) for name in TEXT_COLUMNS]
+            codes = codes.tolist()
+            typed = [columns[name][start:end].tolist() for name, dtype in TYPED_COLUMNS]
+        else:
+            # Only the text of the rows kept is sliced out and decoded
+            indices = np.flatnonzero(np.isin(codes, kept_codes))
+            if not len(indices):
+                continue
+            codes = codes[indices].tolist()
+            indices += start
+            entries, nums, dates, values = [read_text_rows(texts[name], columns[name], indices) for name in TEXT_COLUMNS]
+            typed = [columns[name][indices].tolist() for name, dtype in TYPED_COLUMNS]
+        times, microseconds, offsets, hours, ids, numbers = typed
+        for i in range(0, len(codes)):
+            if codes[i] in package_codes and not keep.keep(types[codes[i]], values[i]):
+                continue
+            yield make_record(CachedRecord, (entries[i], nums[i], dates[i], types[codes[i]], values[i],
+                                             times[i], microseconds[i], offsets[i], hours[i], ids[i], numbers[i]))
+
+    if meta['Error'] != None:
+        print(meta['Error'])
+        print('Failed to read file: ' + path)
+
+def cache_device_file(device):
+    update_cache_entry(device.Path, device.Lancs, device.Cache)
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    progress = ProgressReporter('event_cache', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+
+    if len(args) < 4:
+        print('Usage: ' + args[0] + ' <device ids file> <path of device files> <cache dir> [lancs] [--workers N] [--progress seconds] [--status file]')
+        sys.exit(1)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    cache = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+
+    if not os.path.isdir(cache):
+        os.makedirs(cache)
+
+    for device, result in parse_devices(cache_device_file, list_devices(pathOfIdsFile, pathOfFiles, lancs, cache), workers, None, progress):
+        pass
+
+    # **** For checking timings *****
+    endFilesTime = datetime.now()
+    print("All files cached in {0}".format(str((endFilesTime - startTime))))
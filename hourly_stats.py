@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Hourly statistics across devices (totals, means, no. of devices, mins, maxs
+# and medians), accumulated into NumPy arrays as each device is merged instead
+# of keeping a Python list of device values per hour.
+
+from collections import namedtuple, OrderedDict
+import numpy as np
+
+# Median modes: 'exact' keeps every device value (the summaries are then exactly
+# those of numpy on per-hour lists), 'tdigest' keeps a t-digest per key so memory
+# does not grow with the no. of devices (means are then total / no. of devices)
+MEDIAN_MODES = ('exact', 'tdigest')
+median_mode = 'exact'
+
+def set_median_mode(mode):
+    global median_mode
+    if mode not in MEDIAN_MODES:
+        raise ValueError('Unknown median mode: {0}'.format(mode))
+    median_mode = mode
+
+# Each field is a list of the 24 hourly values, or of 24 zeros if no device was added
+HourlySummary = namedtuple('HourlySummary', ('Total', 'Mean', 'Count', 'Min', 'Max', 'Median'))
+
+class TDigest(object):
+    """
+    Merging t-digest of the values of each of the 24 hours, for approximate medians
+    in bounded memory. Values are buffered and merged into at most about compression
+    centroids per hour, smaller towards the extremes.
+    """
+    def __init__(self, compression=100, buffer_size=256):
+        self.compression = compression
+        self.means = [np.zeros(0) for hour in range(0,24)]
+        self.weights = [np.zeros(0) for hour in range(0,24)]
+        self.buffer = np.zeros((24, buffer_size))
+        self.buffered = 0
+
+    def add(self, values):
+        self.buffer[:, self.buffered] = values
+        self.buffered += 1
+        if self.buffered == self.buffer.shape[1]:
+            self.compress()
+
+    def compress(self):
+        if self.buffered == 0:
+            return
+        for hour in range(0,24):
+            means = np.concatenate((self.means[hour], self.buffer[hour, :self.buffered]))
+            weights = np.concatenate((self.weights[hour], np.ones(self.buffered)))
+            order = np.argsort(means, kind='stable')
+            means = means[order]
+            weights = weights[order]
+            # Centroids whose quantiles fall in the same step of the k1 scale function are merged
+            cumulative = np.cumsum(weights)
+            quantiles = (cumulative - weights / 2) / cumulative[-1]
+            steps = np.floor(self.compression * (np.arcsin(2 * quantiles - 1) / np.pi + 0.5))
+            starts = np.flatnonzero(np.concatenate(([True], steps[1:] != steps[:-1])))
+            merged_weights = np.add.reduceat(weights, starts)
+            self.means[hour] = np.add.reduceat(means * weights, starts) / merged_weights
+            self.weights[hour] = merged_weights
+        self.buffered = 0
+
+    def medians(self):
+        self.compress()
+        medians = []
+        for hour in range(0,24):
+            cumulative = np.cumsum(self.weights[hour])
+            centres = cumulative - self.weights[hour] / 2
+            medians.append(np.interp(cumulative[-1] / 2, centres, self.means[hour]))
+        return medians
+
+class HourlyStats(object):
+    """
+    Hourly statistics of the devices added under each key (a metric, or a metric and
+    app), in the order keys were first added. add(key, values) adds the 24 hourly
+    values of one device; running totals, no. of devices, mins and maxs are kept in
+    arrays indexed by key and hour and summarised for all keys at once.
+    """
+    def __init__(self, median=None):
+        self.median = median_mode if median == None else median
+        self.rows = OrderedDict()
+        self.totals = np.zeros((8, 24))
+        self.mins = np.full((8, 24), np.inf)
+        self.maxs = np.full((8, 24), -np.inf)
+        self.counts = np.zeros(8, dtype=np.int64)
+        # Python sum() of numpy values gives numpy totals, so this is kept per key
+        self.numpy_values = []
+        # Per key, the device values (24 x capacity) or the t-digest
+        self.values = []
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def keys(self):
+        return self.rows.keys()
+
+    def row(self, key):
+        if key in self.rows:
+            return self.rows[key]
+        row = len(self.rows)
+        if row == len(self.counts):
+            self.totals = np.concatenate((self.totals, np.zeros_like(self.totals)))
+            self.mins = np.concatenate((self.mins, np.full_like(self.mins, np.inf)))
+            self.maxs = np.concatenate((self.maxs, np.full_like(self.maxs, -np.inf)))
+            self.counts = np.concatenate((self.counts, np.zeros_like(self.counts)))
+        self.rows[key] = row
+        self.numpy_values.append(False)
+        self.values.append(np.zeros((24, 16)) if self.median == 'exact' else TDigest())
+        return row
+
+    def add(self, key, values):
+        row = self.row(key)
+        self.numpy_values[row] = self.numpy_values[row] or isinstance(values[0], np.generic)
+        values = np.asarray(values, dtype=np.float64)
+        self.totals[row] += values
+        np.minimum(self.mins[row], values, out=self.mins[row])
+        np.maximum(self.maxs[row], values, out=self.maxs[row])
+        count = self.counts[row]
+        self.counts[row] += 1
+        if self.median == 'exact':
+            if count == self.values[row].shape[1]:
+                self.values[row] = np.concatenate((self.values[row], np.zeros_like(self.values[row])), axis=1)
+            self.values[row][:, count] = values
+        else:
+            self.values[row].add(values)
+
+    def summary(self, key):
+        return self.summaries([key])[0]
+
+    def summaries(self, keys=None):
+        """
+        Return the HourlySummary of each key (all keys if keys is None), in order.
+        Keys which no device was added under are summarised as zeros.
+        """
+        keys = list(self.rows.keys()) if keys == None else keys
+        rows = [self.rows.get(key, -1) for key in keys]
+        counts = np.where(np.array(rows) < 0, 0, self.counts[rows])
+        if self.median == 'exact':
+            # Keys with the same no. of devices are stacked and reduced together
+            means = np.zeros((len(rows), 24))
+            medians = np.zeros((len(rows), 24))
+            by_count = {}
+            for index, row in enumerate(rows):
+                if counts[index] > 0:
+                    by_count.setdefault(int(counts[index]), []).append(index)
+            for count, indices in by_count.items():
+                values = np.stack([self.values[rows[index]][:, :count] for index in indices])
+                means[indices] = np.mean(values, axis=2)
+                medians[indices] = np.median(values, axis=2)
+        else:
+            means = self.totals[rows] / np.maximum(counts, 1)[:, np.newaxis]
+
+        summaries = []
+        for index, row in enumerate(rows):
+            count = int(counts[index])
+            if count == 0:
+                zeros = [0 for hour in range(0,24)]
+                summaries.append(HourlySummary(zeros, zeros, zeros, zeros, zeros, zeros))
+                continue
+            if self.numpy_values[row]:
+                total = list(self.totals[row])
+            else:
+                total = self.totals[row].tolist()
+            mean = list(means[index])
+            if self.median == 'exact':
+                median = list(medians[index])
+            else:
+                median = self.values[row].medians()
+            summaries.append(HourlySummary(total, mean, [count for hour in range(0,24)], list(self.mins[row]), list(self.maxs[row]), median))
+        return summaries
@@ -17,7 +17,7 @@
 # Find all devices which have traces which last more than five weeks
 # and have a majority of samples inside the UK and Ireland
 #
-# Definition of UK and Ireland is a location in lat/lon range 
+# Definition of UK and Ireland is a location in lat/lon range
 #  * top-right (60.5,1.5)
 #  * bot-left  (50  ,-11)
 #
@@ -26,71 +26,47 @@
 # Input is the processed DA data in a CSV of this form:
 #
 # 2013-08-23T10:16:38.111-0600|46.112863|-47.162376
-	
+#
+# Each file is summarised by summarise_location_file in device_catalog.py, with
+# --workers N in N processes. With --catalog the summaries are kept in the device
+# catalog and only files changed since the last run are read again. The matching
+# files are printed as the device ids file read by read_file_names in da_common.py.
+
+import sys
+from os import listdir
+from os.path import isfile, join
+import numpy as np
+from da_common import pop_option, parse_device_results
+from device_catalog import summarise_location_file, float_str, open_catalog, update_locations
+
 if __name__=='__main__':
-	import sys
-	from time import mktime, strptime
-	from os import listdir
-	from os.path import isfile, join
-	from datetime import date
-	
-	if len(sys.argv) != 2:
-		print 'Usage: ', sys.argv[0], '<directory of files>'
-		print 'returns a list of files which match, one per line'
-		sys.exit(1)
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    catalog = pop_option(args, '--catalog')
 
-	uk_lon_max = 1.5
-	uk_lon_min = -11
-	uk_lat_max = 60.5
-	uk_lat_min = 50
+    if len(args) != 2:
+        print('Usage: ' + args[0] + ' <directory of files> [--workers N] [--catalog file]')
+        print('returns a list of files which match, one per line')
+        sys.exit(1)
 
-	filenames = [f for f in listdir(sys.argv[1]) if isfile(join(sys.argv[1], f))]
-	device_count = 0
-	
-	for filename in filenames:
-	
-		device_count += 1
-	
-		#Determine range of dates and counts of sightings in/out of the uk
-		dates_seen = {}		
-		inside_uk = 0
-		outside_uk = 0
-		
-		fp = open(join(sys.argv[1], filename), 'rb')
-		for line in fp.readlines():
-			elements = line.split('|')
-			if len(elements) != 3:
-				continue
-			timestamp, lat, lon = elements
-			#Would like to write date.strptime(timestamp, "%Y-%m-%d") but old python!
-			t = date.fromtimestamp(mktime(strptime(timestamp.split('T')[0], '%Y-%m-%d')))
-			lat = float(lat)
-			lon = float(lon)
+    if catalog != None:
+        summaries = update_locations(open_catalog(catalog), args[1], workers)
+    else:
+        filenames = [f for f in listdir(args[1]) if isfile(join(args[1], f))]
+        paths = [join(args[1], filename) for filename in filenames]
+        summaries = zip(filenames, (summary for path, summary in parse_device_results(summarise_location_file, paths, workers)))
 
-			dates_seen[t] = None			
-			
-			if lon < uk_lon_max and lon > uk_lon_min and \
-			   lat < uk_lat_max and lat > uk_lat_min:
-				inside_uk += 1
-			else:
-				outside_uk += 1
+    for device_count, (filename, summary) in enumerate(summaries, 1):
+        if summary.Days < 35:
+            continue #Not enough data for this device
+        #calculate proportion of days we have data for
+        prop_days_seen = float(summary.Days - 1) / int((summary.End - summary.Start).astype(np.int64))
+        if summary.End < np.datetime64('2014-01-01'):
+            continue #Too old
+        total = float(summary.InUK + summary.OutUK)
+        prop_inside_uk = (summary.InUK / total)
+        if prop_inside_uk < 0.5:
+            continue #Outside the UK too much
 
-		#calculate proportion of days we have data for
-		dates_list = dates_seen.keys()
-		dates_list.sort()
-		days_seen = len(dates_list)
-		if days_seen < 35:
-			continue #Not enough data for this device
-		date_start = dates_list[0]
-		date_end = dates_list[-1]
-		prop_days_seen =  float(days_seen - 1) / (date_end - date_start).days		
-		if date_end < date(2014, 1, 1):
-			continue #Too old
-		total = float(inside_uk + outside_uk)
-		prop_inside_uk = (inside_uk / total)
-		if prop_inside_uk < 0.5:
-			continue #Outside the UK too much
-						
-		print device_count, filename,
-		print date_start.strftime('%Y-%m-%d'), date_end.strftime('%Y-%m-%d'), 
-		print days_seen, prop_days_seen, inside_uk, outside_uk, prop_inside_uk
\ No newline at end of file
+        print(device_count, filename, str(summary.Start), str(summary.End), summary.Days, float_str(prop_days_seen),
+              summary.InUK, summary.OutUK, float_str(prop_inside_uk))
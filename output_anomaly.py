@@ -14,137 +14,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 import numpy as np
-import subprocess
-from collections import namedtuple, OrderedDict
-import dateutil.parser
-from datetime import datetime, timedelta
-from functools import reduce
+from collections import namedtuple
+from datetime import datetime
+from da_common import make_sure_path_exists, parse_windowed_device, pop_option, list_devices, parse_devices, open_result_store, AppIdIndex, AppHourlyCounts, date_day, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
 
+global output
 global no_of_ignored_files
 
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.TextIOWrapper(io.BufferedReader(gzip.open(path))) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield DARecord._make(repacked)
-    except:
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except:
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def get_t_gap(first, second):
-    return (dateutil.parser.parse(second) - dateutil.parser.parse(first)).total_seconds()
-
-def search_dates(file_path, lancs):
-    start_date = None
-    end_date = None
-
-    for row in (read_file_lancs(file_path) if lancs else read_file(file_path)):
-        date_time = row.Date
-        if '(invalid date)' in date_time:
-            continue
-
-        if start_date == None:
-            start_date = date_time
-
-        end_date = date_time
-
-    if start_date == None or end_date == None:
-        return None, None
-
-    return start_date[:-9], end_date[:-9]
-
-def get_start_end_dates(file_path, lancs):
-    start = None
-    end = None
-    if lancs:
-        # start = str(subprocess.check_output(['head', '-1', file_path])).split(';')[2][:-9]
-        # end = str(subprocess.check_output(['tail', '-1', file_path])).split(';')[2][:-9]
-        # if '(invalid date)' in start or '(invalid date)' in end:
-        start, end = search_dates(file_path, lancs)
-    else:
-        start, end = search_dates(file_path, lancs)
+# Per-device Saturday totals, computed by device_parser (possibly in a worker process)
+# and written out by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('FileName', 'FilePath', 'NoOfDays', 'SaturdayTotal'))
 
-    # If cannot find valid dates, return None to ignore this device in the analysis
-    if start == None or end == None:
-        return None, None
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app', 'screen', 'hf', 'net']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['no_of_ignored_files', 'output']
 
-    start_date_time = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
-    end_date_time = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S')
+def parse_device_file(device):
+    # The date window is found while the device file is parsed, so it is only read once
+    return parse_windowed_device(lambda start_date, end_date: device_parser(device.Path, device.FileName, start_date, end_date), device, logs_to_parse)
 
-    start_date_to_return = None
-    end_date_to_return = None
-    # If before 4am, then the date is fine - else add a day
-    if start_date_time.time().hour < 4:
-        start_date_to_return = start_date_time
-    else:
-        start_date_to_return = (start_date_time + timedelta(days=1))
-    # If after or equal to 4am, then the date is fine - else remove a day
-    if end_date_time.time().hour >= 4:
-        end_date_to_return = end_date_time
-    else:
-        end_date_to_return = (end_date_time - timedelta(days=1))
-
-    # Check the start and end dates are at least 12 days apart - if not, return None to ignore this device in the analysis
-    difference = end_date_to_return.date() - start_date_to_return.date()
-    if difference.days < 14:
-        return None, None
-
-    return (start_date_to_return.strftime('%Y-%m-%d'))+'T04:00:00', (end_date_to_return.strftime('%Y-%m-%d'))+'T04:00:00'
-
-def parse_file(file_path, lancs, fname, start_date, end_date):
+def ignore_device(fname):
     global no_of_ignored_files
 
-    logs_to_parse = ['app', 'screen', 'hf', 'net']
+    print("No start or end dates, or under 14 days of logging, for file: " + fname)
+    no_of_ignored_files+=1
 
+def device_parser(file_path, fname, start_date, end_date):
     current_hour = None
     current_day = None
     current_weekday = None
@@ -162,11 +61,15 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
 
     no_of_days_week = [0 for day in range(0,7)]
 
-    ids_names = {}
-    current_app_name_id_mapping = {}
+    app_ids = AppIdIndex()
+    # Last rx and tx bytes of each app, and the rx/tx byte deltas by day of the week and hour
     app_data = {}
+    app_bytes = AppHourlyCounts()
 
-    for row in (read_file_lancs(file_path) if lancs else read_file(file_path)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -181,11 +84,11 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
 
         if current_day != date_time[0]:
             current_day = date_time[0]
-            current_weekday = datetime.strptime(date_time[0], '%Y-%m-%d').weekday()
+            current_weekday = date_day(date_time[0])[1]
             no_of_days_week[current_weekday]+=1
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # An app is in the foreground so log its process id
         if 'importance' in entry_val and 'foreground' in row_value:
@@ -221,31 +124,30 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
         # App data
         elif row_entry_type.startswith('net|app'):
             app_id = entry_val[2]
-            app_name = None
-            for key, val in current_app_name_id_mapping.items():
-                if val == app_id:
-                    app_name = key
+            app_name = app_ids.name(app_id)
             if app_name == None:
                 continue
 
             if entry_val[3] == 'rx_bytes':
+                row_number = row.Number
                 app_last_rx = app_data[app_name][0]
                 if app_last_rx == None:
                     pass
-                elif int(row_value) > app_last_rx:
-                    app_data[app_name][1][current_weekday][current_hour].append(int(row_value) - app_last_rx)
-                elif int(row_value) < app_last_rx:
-                    app_data[app_name][1][current_weekday][current_hour].append(int(row_value))
-                app_data[app_name][0] = int(row_value)
+                elif row_number > app_last_rx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 0, row_number - app_last_rx)
+                elif row_number < app_last_rx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 0, row_number)
+                app_data[app_name][0] = row_number
             elif entry_val[3] == 'tx_bytes':
-                app_last_tx = app_data[app_name][2]
+                row_number = row.Number
+                app_last_tx = app_data[app_name][1]
                 if app_last_tx == None:
                     pass
-                elif int(row_value) > app_last_tx:
-                    app_data[app_name][3][current_weekday][current_hour].append(int(row_value) - app_last_tx)
-                elif int(row_value) < app_last_tx:
-                    app_data[app_name][3][current_weekday][current_hour].append(int(row_value))
-                app_data[app_name][2] = int(row_value)
+                elif row_number > app_last_tx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 1, row_number - app_last_tx)
+                elif row_number < app_last_tx:
+                    app_bytes.add(app_ids.rows[app_name], current_weekday, current_hour, 1, row_number)
+                app_data[app_name][1] = row_number
         # App installed logs
         elif row_entry_type.startswith('app|installed'):
             for app_entry in row_value.split(','):
@@ -254,86 +156,122 @@ def parse_file(file_path, lancs, fname, start_date, end_date):
                     temp_name = installed_details[0]
                     app_info = installed_details[1].split(':')
                     temp_app_id = app_info[len(app_info) - 2]
-                    if temp_name not in current_app_name_id_mapping:
-                        app_data[temp_name] = [None, [[[] for x in range(0,24)] for y in range(0,7)], None, [[[] for x in range(0,24)] for y in range(0,7)]]
+                    if temp_name not in app_ids:
+                        app_data[temp_name] = [None, None]
 
                     # Remove old mapping if it exists
-                    if temp_app_id not in ids_names:
-                        ids_names[temp_app_id] = temp_name
-                    elif ids_names[temp_app_id] != temp_name:
-                        for key, val in current_app_name_id_mapping.items():
-                            if val == temp_app_id and key != temp_name:
-                                current_app_name_id_mapping[key] = ''
-                        ids_names[temp_app_id] = temp_name
-
-                    current_app_name_id_mapping[temp_name] = temp_app_id
-
-    if no_of_days >= 14:
-        saturday_total_rx = [0 for i in range(0,24)]
-        saturday_total_tx = [0 for i in range(0,24)]
-        saturday_total = [0 for i in range(0,24)]
-
-        index_of_saturday = 5
-        no_of_saturdays = no_of_days_week[index_of_saturday]
-        
-        for app, data in app_data.items():
-            mean_rx = [0 for i in range(0,24)]
-            mean_tx = [0 for i in range(0,24)]
-
-            if no_of_saturdays != 0:
-                mean_rx = [(sum(ihour)/no_of_saturdays) for ihour in data[1][index_of_saturday]]
-                mean_tx = [(sum(ihour)/no_of_saturdays) for ihour in data[3][index_of_saturday]]
-
-                if not all(hour == 0 for hour in mean_rx):
-                    for hour in range(0,24):
-                        saturday_total_rx[hour] = saturday_total_rx[hour] + mean_rx[hour]
-                if not all(hour == 0 for hour in mean_tx):
-                    for hour in range(0,24):
-                        saturday_total_tx[hour] = saturday_total_tx[hour] + mean_tx[hour]
-        with open('anomaly_output/saturday_totals.csv', 'a') as f:
-            f.write(fname)
-            for hour in range(0,24):
-                saturday_total[hour] = saturday_total_rx[hour] + saturday_total_tx[hour]
-                f.write(',{0}'.format(str(saturday_total[hour])))
-            f.write('\n')
+                    app_ids.install(temp_name, temp_app_id)
+
+    if no_of_days < 14:
+        return DeviceResult(fname, file_path, no_of_days, None)
+
+    saturday_total_rx = [0 for i in range(0,24)]
+    saturday_total_tx = [0 for i in range(0,24)]
+    saturday_total = [0 for i in range(0,24)]
+
+    index_of_saturday = 5
+    no_of_saturdays = no_of_days_week[index_of_saturday]
+
+    if no_of_saturdays != 0:
+        # Saturday rx/tx means of each app by hour
+        saturday_means = app_bytes.totals(len(app_ids))[:, index_of_saturday] / no_of_saturdays
+        # Sum the means of the apps with some rx (tx) bytes, in install order
+        with_rx = saturday_means[:, :, 0].any(axis=1)
+        if with_rx.any():
+            saturday_total_rx = np.cumsum(saturday_means[with_rx, :, 0], axis=0)[-1].tolist()
+        with_tx = saturday_means[:, :, 1].any(axis=1)
+        if with_tx.any():
+            saturday_total_tx = np.cumsum(saturday_means[with_tx, :, 1], axis=0)[-1].tolist()
+    for hour in range(0,24):
+        saturday_total[hour] = saturday_total_rx[hour] + saturday_total_tx[hour]
+
+    return DeviceResult(fname, file_path, no_of_days, saturday_total)
+
+def merge_device_result(result):
+    global no_of_ignored_files
+    global output
 
-    else:
+    if result.NoOfDays < 14:
         no_of_ignored_files+=1
-        print('Not adding {0} to summary, as no. of actual data days: {1}'.format(file_path, no_of_days))
+        print('Not adding {0} to summary, as no. of actual data days: {1}'.format(result.FilePath, result.NoOfDays))
+        return
 
+    with output.open('anomaly_output/saturday_totals.csv', 'a') as f:
+        f.write(result.FileName)
+        for hour in range(0,24):
+            f.write(',{0}'.format(str(result.SaturdayTotal[hour])))
+        f.write('\n')
 
-if __name__ == '__main__':
+def init_report():
     global no_of_ignored_files
+    global output
 
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    lancs = bool(len(sys.argv) > 3)
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
     no_of_ignored_files = 0
 
-    startTime = datetime.now()
-
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('anomaly_output/')
 
-    with open('anomaly_output/saturday_totals.csv', 'w') as f:
+    with output.open('anomaly_output/saturday_totals.csv', 'w') as f:
         f.write('hour')
         for hour in range(0,24):
             f.write(',{0}'.format(str(hour)))
         f.write('\n')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        start_date, end_date = get_start_end_dates(fullfpath, lancs)
-        if start_date == None or end_date == None:
-            print("No start or end dates, or under 14 days of logging, for file: " + fname)
-            no_of_ignored_files+=1
+def finish_report():
+    global output
+
+    # Saturday totals are written out as each device is merged
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('output_anomaly', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    index = pop_option(args, '--index')
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    lancs = bool(len(args) > 3)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'output_anomaly')
+
+    init_report()
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache, index)
+    options = [str(lancs)]
+    checkpoint = open_checkpoint(checkpoint_path, 'output_anomaly', devices, [], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'output_anomaly', devices, [], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'output_anomaly', []), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'output_anomaly', devices, [], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'output_anomaly', []), progress, checkpoint)
+    for device, result in devices_results:
+        if result == None:
+            ignore_device(device.FileName)
         else:
-            parse_file(fullfpath, lancs, fname, start_date, end_date)
+            merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
@@ -14,106 +14,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 import numpy as np
-from collections import namedtuple, OrderedDict
-import dateutil.parser
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime
+from da_common import read_device_file, read_practice_table, practice_rollup, AppHourlySums, hourly_totals, make_sure_path_exists, feed_parser, pop_option, list_devices, parse_devices, open_result_store, AppIdIndex, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
 
+global output
 global apps_rx
 global apps_tx
 global foreground_use
-global app_practice_mapping
+global practice_table
 global p_practice_demand_contribution
 global p_practice_use_contribution
 global all_use_contribution
 global all_demand_contribution
 global contribution
 
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.BufferedReader(gzip.open(path, 'rU')) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield apply(DARecord._make, (repacked,))
-    except:
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except:
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-AppRecord = namedtuple('AppRecord', ('FullName', 'Name', 'Practice'))
-def read_app_mapping(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=';')
-        for row in map(AppRecord._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def get_practice_name(app):
-    global app_practice_mapping
-
-    if app not in app_practice_mapping:
-        return None
-    else:
-        return app_practice_mapping[app]
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app', 'screen', 'hf', 'net']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['apps_rx', 'apps_tx', 'foreground_use', 'p_practice_demand_contribution',
+                  'p_practice_use_contribution', 'all_use_contribution', 'all_demand_contribution',
+                  'contribution']
 
-def parse_file(file, lancs, fname):
-    global apps_rx
-    global apps_tx
-    global foreground_use
-    global p_practice_demand_contribution
-    global p_practice_use_contribution
-    global all_use_contribution
-    global all_demand_contribution
-    global contribution
+# Per-device hourly means, computed by device_parser (possibly in a worker process)
+# and added to the global accumulators by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('FileName', 'Foreground', 'AppData'))
 
-    logs_to_parse = ['app', 'screen', 'hf', 'net']
+def parse_device_file(device):
+    return feed_parser(device_parser(device.Path, device.FileName), read_device_file(device.Path, device.Lancs, device.Cache, logs_to_parse))
 
+def device_parser(file, fname):
     current_hour = None
     current_day = None
     no_of_days = 0
@@ -128,11 +61,13 @@ def parse_file(file, lancs, fname):
     all_data_rx = [[] for hour in range(0,24)]
     all_data_tx = [[] for hour in range(0,24)]
 
-    ids_names = {}
-    current_app_name_id_mapping = {}
+    app_ids = AppIdIndex()
     app_data = {}
 
-    for row in (read_file_lancs(file) if lancs else read_file(file)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -146,7 +81,7 @@ def parse_file(file, lancs, fname):
             current_day = date_time[0]
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # An app is in the foreground so log its process id
         if 'importance' in entry_val and 'foreground' in row_value:
@@ -182,31 +117,30 @@ def parse_file(file, lancs, fname):
         # App data
         elif row_entry_type.startswith('net|app'):
             app_id = entry_val[2]
-            app_name = None
-            for key, val in current_app_name_id_mapping.items():
-                if val == app_id:
-                    app_name = key
+            app_name = app_ids.name(app_id)
             if app_name == None:
                 continue
 
             if entry_val[3] == 'rx_bytes':
+                row_number = row.Number
                 app_last_rx = app_data[app_name][0]
                 if app_last_rx == None:
                     pass
-                elif int(row_value) > app_last_rx:
-                    app_data[app_name][1][current_hour].append(int(row_value) - app_last_rx)
-                elif int(row_value) < app_last_rx:
-                    app_data[app_name][1][current_hour].append(int(row_value))
-                app_data[app_name][0] = int(row_value)
+                elif row_number > app_last_rx:
+                    app_data[app_name][1][current_hour].append(row_number - app_last_rx)
+                elif row_number < app_last_rx:
+                    app_data[app_name][1][current_hour].append(row_number)
+                app_data[app_name][0] = row_number
             elif entry_val[3] == 'tx_bytes':
+                row_number = row.Number
                 app_last_tx = app_data[app_name][2]
                 if app_last_tx == None:
                     pass
-                elif int(row_value) > app_last_tx:
-                    app_data[app_name][3][current_hour].append(int(row_value) - app_last_tx)
-                elif int(row_value) < app_last_tx:
-                    app_data[app_name][3][current_hour].append(int(row_value))
-                app_data[app_name][2] = int(row_value)
+                elif row_number > app_last_tx:
+                    app_data[app_name][3][current_hour].append(row_number - app_last_tx)
+                elif row_number < app_last_tx:
+                    app_data[app_name][3][current_hour].append(row_number)
+                app_data[app_name][2] = row_number
         # App installed logs
         elif row_entry_type.startswith('app|installed'):
             for app_entry in row_value.split(','):
@@ -215,56 +149,70 @@ def parse_file(file, lancs, fname):
                     temp_name = installed_details[0]
                     app_info = installed_details[1].split(':')
                     temp_app_id = app_info[len(app_info) - 2]
-                    if temp_name not in current_app_name_id_mapping:
+                    if temp_name not in app_ids:
                         app_data[temp_name] = [None, [[] for x in range(0,24)], None, [[] for x in range(0,24)]]
 
                     # Remove old mapping if it exists
-                    if temp_app_id not in ids_names:
-                        ids_names[temp_app_id] = temp_name
-                    elif ids_names[temp_app_id] != temp_name:
-                        for key, val in current_app_name_id_mapping.items():
-                            if val == temp_app_id and key != temp_name:
-                                current_app_name_id_mapping[key] = ''
-                        ids_names[temp_app_id] = temp_name
-
-                    current_app_name_id_mapping[temp_name] = temp_app_id
-
-
-    if no_of_days != 0:
-        for app, data in app_foreground_use.items():
-            # Calculate hourly means for the device app foregound instances
-            mean_app_foreground_use = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
-            if not all(i == 0 for i in mean_app_foreground_use):
-                if app not in foreground_use:
-                    foreground_use[app] = [[] for x in range(0,24)]
-                [foreground_use[app][i].append(mean_app_foreground_use[i]) for i in range(0,24)]
-                # Add user to practice use contribution
-                practice = get_practice_name(app)
-                if practice != None:
-                    p_practice_use_contribution[practice].add(fname)
-                all_use_contribution.add(fname)
-                contribution.add(fname)
-
-        for app, data in app_data.items():
-            mean_rx = [(sum(ihour)/no_of_days) for ihour in data[1]]
-            mean_tx = [(sum(ihour)/no_of_days) for ihour in data[3]]
-            if not all(i == 0 for i in mean_rx):
-                if app not in apps_rx:
-                    apps_rx[app] = [[] for i in range(0,24)]
-                [apps_rx[app][i].append(mean_rx[i]) for i in range(0,24)]
-            if not all(i == 0 for i in mean_tx):
-                if app not in apps_tx:
-                    apps_tx[app] = [[] for i in range(0,24)]
-                [apps_tx[app][i].append(mean_tx[i]) for i in range(0,24)]
-            # Add user to practice demand contribution
-            if not all(i == 0 for i in mean_rx + mean_tx):
-                practice = get_practice_name(app)
-                if practice != None:
-                    p_practice_demand_contribution[practice].add(fname)
-                all_demand_contribution.add(fname)
-                contribution.add(fname)
+                    app_ids.install(temp_name, temp_app_id)
+
+
+    if no_of_days == 0:
+        return None
+
+    # Calculate hourly means for the device app foregound instances
+    foreground_means = []
+    for app, data in app_foreground_use.items():
+        mean_app_foreground_use = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
+        if not all(i == 0 for i in mean_app_foreground_use):
+            foreground_means.append((app, mean_app_foreground_use))
+
+    app_means = []
+    for app, data in app_data.items():
+        mean_rx = [(sum(ihour)/no_of_days) for ihour in data[1]]
+        mean_tx = [(sum(ihour)/no_of_days) for ihour in data[3]]
+        if not all(i == 0 for i in mean_rx + mean_tx):
+            app_means.append((app, mean_rx, mean_tx))
+
+    return DeviceResult(fname, foreground_means, app_means)
+
+def merge_device_result(result):
+    global practice_table
+    global apps_rx
+    global apps_tx
+    global foreground_use
+    global p_practice_demand_contribution
+    global p_practice_use_contribution
+    global all_use_contribution
+    global all_demand_contribution
+    global contribution
+
+    if result == None:
+        return
+    fname = result.FileName
+
+    for app, mean_app_foreground_use in result.Foreground:
+        foreground_use.add(app, mean_app_foreground_use)
+        # Add user to practice use contribution
+        practice = practice_table.practice_code(app)
+        if practice >= 0:
+            p_practice_use_contribution[practice].add(fname)
+        all_use_contribution.add(fname)
+        contribution.add(fname)
+
+    for app, mean_rx, mean_tx in result.AppData:
+        if not all(i == 0 for i in mean_rx):
+            apps_rx.add(app, mean_rx)
+        if not all(i == 0 for i in mean_tx):
+            apps_tx.add(app, mean_tx)
+        # Add user to practice demand contribution
+        practice = practice_table.practice_code(app)
+        if practice >= 0:
+            p_practice_demand_contribution[practice].add(fname)
+        all_demand_contribution.add(fname)
+        contribution.add(fname)
 
 def calculate_print_summaries():
+    global practice_table
     global apps_rx
     global apps_tx
     global foreground_use
@@ -273,228 +221,223 @@ def calculate_print_summaries():
     global all_use_contribution
     global all_demand_contribution
     global contribution
+    global output
 
-    with open('overall_summary/contribution.csv', 'w') as f:
+    with output.open('overall_summary/contribution.csv', 'w') as f:
         f.write('use,{0}\n'.format(len(all_use_contribution)))
         f.write('demand,{0}\n'.format(len(all_demand_contribution)))
         f.write('total no of devices,{0}\n'.format(len(contribution)))
 
-    with open('overall_summary/practice_demand_contribution.csv', 'w') as f:
+    with output.open('overall_summary/practice_demand_contribution.csv', 'w') as f:
         f.write('Category, no of devices\n')
 
-    with open('overall_summary/practice_use_contribution.csv', 'w') as f:
+    with output.open('overall_summary/practice_use_contribution.csv', 'w') as f:
         f.write('Category, no of devices\n')
 
-    for practice, devices in p_practice_demand_contribution.items():
-        with open('overall_summary/practice_demand_contribution.csv', 'a') as f:
+    for practice, devices in zip(practice_table.practices, p_practice_demand_contribution):
+        with output.open('overall_summary/practice_demand_contribution.csv', 'a') as f:
             f.write('"{0}",{1}\n'.format(practice, len(devices)))
 
-    for practice, devices in p_practice_use_contribution.items():
-        with open('overall_summary/practice_use_contribution.csv', 'a') as f:
+    for practice, devices in zip(practice_table.practices, p_practice_use_contribution):
+        with output.open('overall_summary/practice_use_contribution.csv', 'a') as f:
             f.write('"{0}",{1}\n'.format(practice, len(devices)))
 
-    foreground_total = [[] for i in range(0,24)]
-    practices_foreground = OrderedDict()
-
-    for app, data in foreground_use.items():
-        sum_use = [0 if not hour else sum(hour) for hour in data]
-        [foreground_total[i].append(sum_use[i]) for i in range(0,24)]
-        practice = get_practice_name(app)
-        if practice != None:
-            if practice not in practices_foreground:
-                practices_foreground[practice] = [[] for i in range(0,24)]
-            [practices_foreground[practice][i].append(sum_use[i]) for i in range(0,24)]
-
-    data_rx_total = [[] for i in range(0,24)]
-    data_tx_total = [[] for i in range(0,24)]
-    data_all_total = [[] for i in range(0,24)]
-    practices_rx = OrderedDict()
-    practices_tx = OrderedDict()
-    practices_data = OrderedDict()
-
-    for app, data in apps_rx.items():
-        sum_rx = [0 if not hour else sum(hour) for hour in data]
-        [data_rx_total[i].append(sum_rx[i]) for i in range(0,24)]
-        [data_all_total[i].append(sum_rx[i]) for i in range(0,24)]
-        practice = get_practice_name(app)
-        if practice != None:
-            if practice not in practices_rx:
-                practices_rx[practice] = [[] for i in range(0,24)]
-            [practices_rx[practice][i].append(sum_rx[i]) for i in range(0,24)]
-            if practice not in practices_data:
-                practices_data[practice] = [[] for i in range(0,24)]
-            [practices_data[practice][i].append(sum_rx[i]) for i in range(0,24)]
-
-    for app, data in apps_tx.items():
-        sum_tx = [0 if not hour else sum(hour) for hour in data]
-        [data_tx_total[i].append(sum_tx[i]) for i in range(0,24)]
-        [data_all_total[i].append(sum_tx[i]) for i in range(0,24)]
-        practice = get_practice_name(app)
-        if practice != None:
-            if practice not in practices_tx:
-                practices_tx[practice] = [[] for i in range(0,24)]
-            [practices_tx[practice][i].append(sum_tx[i]) for i in range(0,24)]
-            if practice not in practices_data:
-                practices_data[practice] = [[] for i in range(0,24)]
-            [practices_data[practice][i].append(sum_tx[i]) for i in range(0,24)]
-
-    overall_use_from_categories = 0
-    overall_demand_from_categories = 0
-    overall_use = 0
-    overall_demand = 0
-
-    with open('overall_summary/all_totals.csv', 'a') as f:
-        foreground_all = [0 if not hour else sum(hour) for hour in foreground_total]
-        overall_use = overall_use + sum(foreground_all)
-
-        rx_all = [0 if not hour else sum(hour) for hour in data_rx_total]
-        tx_all = [0 if not hour else sum(hour) for hour in data_tx_total]
-        data_all = [0 if not hour else sum(hour) for hour in data_all_total]
-        overall_demand = overall_demand + sum(data_all)
+    # Per-app hourly sums across devices, and the practice code of each app (-1 if not in the mapping)
+    foreground = foreground_use.totals()
+    rx = apps_rx.totals()
+    tx = apps_tx.totals()
+    foreground_codes = practice_table.practice_codes_of(foreground_use.names)
+    rx_codes = practice_table.practice_codes_of(apps_rx.names)
+    tx_codes = practice_table.practice_codes_of(apps_tx.names)
+    # Data of both directions, the rx of every app then the tx
+    data = np.concatenate((rx, tx))
+    data_codes = np.concatenate((rx_codes, tx_codes))
+
+    # Practice totals by hour, the practices in order of their first app
+    practices_foreground = practice_rollup(foreground_codes, foreground)
+    practices_rx = practice_rollup(rx_codes, rx)
+    practices_tx = practice_rollup(tx_codes, tx)
+    practices_data = practice_rollup(data_codes, data)
+
+    with output.open('overall_summary/all_totals.csv', 'a') as f:
+        foreground_all = hourly_totals(foreground)
+        overall_use = sum(foreground_all)
+
+        rx_all = hourly_totals(rx)
+        tx_all = hourly_totals(tx)
+        data_all = hourly_totals(data)
+        overall_demand = sum(data_all)
 
         f.write('{0};{1}\n'.format('foreground use', foreground_all))
         f.write('{0};{1}\n'.format('data rx', rx_all))
         f.write('{0};{1}\n'.format('data tx', tx_all))
         f.write('{0};{1}\n'.format('data all', data_all))
 
-    for practice, data in practices_foreground.items():
-        total_foreground_use = [0 if not hour else sum(hour) for hour in data]
-        overall_use_from_categories = overall_use_from_categories + sum(total_foreground_use)
-        with open('overall_summary/all_practice_use.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+    # Hours are summed in order as Python floats, so the totals match summing the hourly lists
+    use_totals = [(code, totals, sum(totals)) for code, totals in zip(practices_foreground[0], practices_foreground[1].tolist())]
+    demand_totals = [(code, totals, sum(totals)) for code, totals in zip(practices_data[0], practices_data[1].tolist())]
+    overall_use_from_categories = sum(use for code, totals, use in use_totals)
+    overall_demand_from_categories = sum(demand for code, totals, demand in demand_totals)
+
+    for code, total_foreground_use, use in use_totals:
+        with output.open('overall_summary/all_practice_use.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_foreground_use[i]))
             f.write('\n')
 
-    for practice, data in practices_rx.items():
-        total_rx = [0 if not hour else sum(hour) for hour in data]
+    for code, total_rx in zip(practices_rx[0], practices_rx[1].tolist()):
         # Write practice summaries to files
-        with open('overall_summary/all_practice_rx.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+        with output.open('overall_summary/all_practice_rx.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_rx[i]))
             f.write('\n')
 
-    for practice, data in practices_tx.items():
-        total_tx = [0 if not hour else sum(hour) for hour in data]
+    for code, total_tx in zip(practices_tx[0], practices_tx[1].tolist()):
         # Write practice summaries to files
-        with open('overall_summary/all_practice_tx.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+        with output.open('overall_summary/all_practice_tx.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_tx[i]))
             f.write('\n')
 
-    for practice, data in practices_data.items():
-        total_data = [0 if not hour else sum(hour) for hour in data]
-        overall_demand_from_categories = overall_demand_from_categories + sum(total_data)
+    for code, total_data, demand in demand_totals:
         # Write practice summaries to files
-        with open('overall_summary/all_practice_data.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+        with output.open('overall_summary/all_practice_data.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_data[i]))
             f.write('\n')
 
     # OVERALL SUMMARY FOR USE
-    with open('overall_summary/daily_practice_use.csv', 'w') as f:
+    with output.open('overall_summary/daily_practice_use.csv', 'w') as f:
         f.write('{0},{1}\n\n'.format('Overall use', overall_use))
         percentage_for_all_categories = (overall_use_from_categories/overall_use) * 100
         f.write('{0},{1},{2}\n\n'.format('Overall use from categories', overall_use_from_categories, percentage_for_all_categories))
         f.write('Category, use (instances), percentage of overall use (%)\n')
-    for practice, data in practices_foreground.items():
-        category_use = sum([0 if not hour else sum(hour) for hour in data])
-        category_percentage = (category_use/overall_use) * 100
-        with open('overall_summary/daily_practice_use.csv', 'a') as f:
-            f.write('"{0}",{1},{2}\n'.format(practice, category_use, category_percentage))
+    for code, total_foreground_use, use in use_totals:
+        category_percentage = (use/overall_use) * 100
+        with output.open('overall_summary/daily_practice_use.csv', 'a') as f:
+            f.write('"{0}",{1},{2}\n'.format(practice_table.practices[code], use, category_percentage))
 
     # OVERALL SUMMARY FOR DEMAND
-    with open('overall_summary/daily_practice_data.csv', 'w') as f:
+    with output.open('overall_summary/daily_practice_data.csv', 'w') as f:
         f.write('{0},{1}\n\n'.format('Overall demand', overall_demand))
         percentage_for_all_categories = (overall_demand_from_categories/overall_demand) * 100
         f.write('{0},{1},{2}\n\n'.format('Overall demand from categories', overall_demand_from_categories, percentage_for_all_categories))
         f.write('Category, demand (bytes), percentage of overall demand (%)\n')
-    for practice, data in practices_data.items():
-        category_demand = sum([0 if not hour else sum(hour) for hour in data])
-        category_percentage = (category_demand/overall_demand) * 100
-        with open('overall_summary/daily_practice_data.csv', 'a') as f:
-            f.write('"{0}",{1},{2}\n'.format(practice, category_demand, category_percentage))
+    for code, total_data, demand in demand_totals:
+        category_percentage = (demand/overall_demand) * 100
+        with output.open('overall_summary/daily_practice_data.csv', 'a') as f:
+            f.write('"{0}",{1},{2}\n'.format(practice_table.practices[code], demand, category_percentage))
 
 
-if __name__ == '__main__':
+def init_report(pathOfAppPracticeMapping):
     global apps_rx
     global apps_tx
     global foreground_use
-    global app_practice_mapping
+    global practice_table
     global p_practice_demand_contribution
     global p_practice_use_contribution
     global all_use_contribution
     global all_demand_contribution
     global contribution
+    global output
 
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    pathOfAppPracticeMapping = sys.argv[3]
-    lancs = bool(len(sys.argv) > 4)
-
-    startTime = datetime.now()
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
-    foreground_use = [[] for x in range(0,24)]
-    data_rx = [[] for x in range(0,24)]
-    data_tx = [[] for x in range(0,24)]
-
-    apps_rx = {}
-    apps_tx = {}
-    foreground_use = {}
+    # Hourly means of the devices summed by app
+    apps_rx = AppHourlySums()
+    apps_tx = AppHourlySums()
+    foreground_use = AppHourlySums()
 
     all_use_contribution = set()
     all_demand_contribution = set()
     contribution = set()
 
-    app_practice_mapping = {}
-    p_practice_demand_contribution = {}
-    p_practice_use_contribution = {}
-    for app in read_app_mapping(pathOfAppPracticeMapping):
-        app_practice_mapping[app.FullName] = app.Practice
-        if app.Practice not in p_practice_demand_contribution:
-            p_practice_demand_contribution[app.Practice] = set()
-        if app.Practice not in p_practice_use_contribution:
-            p_practice_use_contribution[app.Practice] = set()
+    # Devices contributing to each practice, by practice code
+    practice_table = read_practice_table(pathOfAppPracticeMapping)
+    p_practice_demand_contribution = [set() for practice in practice_table.practices]
+    p_practice_use_contribution = [set() for practice in practice_table.practices]
 
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('overall_summary/')
 
-    with open('overall_summary/all_practice_use.csv', 'w') as f:
+    with output.open('overall_summary/all_practice_use.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('overall_summary/all_practice_rx.csv', 'w') as f:
+    with output.open('overall_summary/all_practice_rx.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('overall_summary/all_practice_tx.csv', 'w') as f:
+    with output.open('overall_summary/all_practice_tx.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('overall_summary/all_practice_data.csv', 'w') as f:
+    with output.open('overall_summary/all_practice_data.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        parse_file(fullfpath, lancs, fname)
+def finish_report():
+    global output
 
     calculate_print_summaries()
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('overall_summary', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    pathOfAppPracticeMapping = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'overall_summary')
+
+    init_report(pathOfAppPracticeMapping)
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache)
+    options = [str(lancs)]
+    checkpoint = open_checkpoint(checkpoint_path, 'overall_summary', devices, [pathOfAppPracticeMapping], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'overall_summary', devices, [pathOfAppPracticeMapping], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'overall_summary', [pathOfAppPracticeMapping]), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'overall_summary', devices, [pathOfAppPracticeMapping], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'overall_summary', [pathOfAppPracticeMapping]), progress, checkpoint)
+    for device, result in devices_results:
+        merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
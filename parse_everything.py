@@ -14,130 +14,50 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 import numpy as np
-from collections import namedtuple, OrderedDict
-import dateutil.parser
-from datetime import datetime, timedelta
-from functools import reduce
+from collections import namedtuple
+from datetime import datetime
+from da_common import read_device_file, read_practice_table, practice_rollup, AppHourlySums, hourly_totals, make_sure_path_exists, feed_parser, pop_option, list_devices, parse_devices, open_result_store, AppIdIndex, time_gap, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
+from hourly_stats import HourlyStats, set_median_mode
 
+global output
 global apps_rx
 global apps_tx
 global foreground_use
-global app_practice_mapping
+global practice_table
 global p_practice_demand_contribution
 global p_practice_use_contribution
 global all_use_contribution
 global all_demand_contribution
 global contribution
-global sms_sent_hourly
-global sms_sent_total_hourly
-global sms_received_hourly
-global sms_received_total_hourly
-global mean_phone_call_durations_hourly
-global mean_no_of_phone_calls_hourly
-
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.TextIOWrapper(io.BufferedReader(gzip.open(path))) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield DARecord._make(repacked)
-    except:
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except:
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-AppRecord = namedtuple('AppRecord', ('FullName', 'Name', 'Practice'))
-def read_app_mapping(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=';')
-        for row in map(AppRecord._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def get_t_gap(first, second):
-    return (dateutil.parser.parse(second) - dateutil.parser.parse(first)).total_seconds()
-
-def get_practice_name(app):
-    global app_practice_mapping
-
-    if app not in app_practice_mapping:
-        return None
-    else:
-        return app_practice_mapping[app]
+global hourly_stats
 
-def parse_file(file, lancs, fname):
-    global apps_rx
-    global apps_tx
-    global foreground_use
-    global p_practice_demand_contribution
-    global p_practice_use_contribution
-    global all_use_contribution
-    global all_demand_contribution
-    global contribution
-    global sms_sent_hourly
-    global sms_sent_total_hourly
-    global sms_received_hourly
-    global sms_received_total_hourly
-    global mean_phone_call_durations_hourly
-    global mean_no_of_phone_calls_hourly
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['app', 'screen', 'hf', 'net', 'sms', 'phone']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['apps_rx', 'apps_tx', 'foreground_use', 'p_practice_demand_contribution',
+                  'p_practice_use_contribution', 'all_use_contribution', 'all_demand_contribution',
+                  'contribution', 'hourly_stats']
 
+# Per-device hourly means, computed by device_parser (possibly in a worker process)
+# and added to the global accumulators by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('FileName', 'Foreground', 'AppData', 'SmsSent', 'SmsReceived', 'CallDurations', 'NoOfCalls'))
+
+def parse_device_file(device):
+    return feed_parser(device_parser(device.Path, device.FileName), read_device_file(device.Path, device.Lancs, device.Cache, logs_to_parse))
+
+def device_parser(file, fname):
     last_s_sms = None
     last_r_sms = None
     sms_sent = [[] for x in range(0,24)]
     sms_received = [[] for x in range(0,24)]
 
     last_phone_state = None
-    last_phone_datetime = None
+    last_phone_row = None
     phone_calls = [[] for x in range(0,24)]
 
-    logs_to_parse = ['app', 'screen', 'hf', 'net', 'sms', 'phone']
 
     current_hour = None
     current_day = None
@@ -153,11 +73,13 @@ def parse_file(file, lancs, fname):
     all_data_rx = [[] for hour in range(0,24)]
     all_data_tx = [[] for hour in range(0,24)]
 
-    ids_names = {}
-    current_app_name_id_mapping = {}
+    app_ids = AppIdIndex()
     app_data = {}
 
-    for row in (read_file_lancs(file) if lancs else read_file(file)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -171,7 +93,7 @@ def parse_file(file, lancs, fname):
             current_day = date_time[0]
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # An app is in the foreground so log its process id
         if 'importance' in entry_val and 'foreground' in row_value:
@@ -207,31 +129,30 @@ def parse_file(file, lancs, fname):
         # App data
         elif row_entry_type.startswith('net|app'):
             app_id = entry_val[2]
-            app_name = None
-            for key, val in current_app_name_id_mapping.items():
-                if val == app_id:
-                    app_name = key
+            app_name = app_ids.name(app_id)
             if app_name == None:
                 continue
 
             if entry_val[3] == 'rx_bytes':
+                row_number = row.Number
                 app_last_rx = app_data[app_name][0]
                 if app_last_rx == None:
                     pass
-                elif int(row_value) > app_last_rx:
-                    app_data[app_name][1][current_hour].append(int(row_value) - app_last_rx)
-                elif int(row_value) < app_last_rx:
-                    app_data[app_name][1][current_hour].append(int(row_value))
-                app_data[app_name][0] = int(row_value)
+                elif row_number > app_last_rx:
+                    app_data[app_name][1][current_hour].append(row_number - app_last_rx)
+                elif row_number < app_last_rx:
+                    app_data[app_name][1][current_hour].append(row_number)
+                app_data[app_name][0] = row_number
             elif entry_val[3] == 'tx_bytes':
+                row_number = row.Number
                 app_last_tx = app_data[app_name][2]
                 if app_last_tx == None:
                     pass
-                elif int(row_value) > app_last_tx:
-                    app_data[app_name][3][current_hour].append(int(row_value) - app_last_tx)
-                elif int(row_value) < app_last_tx:
-                    app_data[app_name][3][current_hour].append(int(row_value))
-                app_data[app_name][2] = int(row_value)
+                elif row_number > app_last_tx:
+                    app_data[app_name][3][current_hour].append(row_number - app_last_tx)
+                elif row_number < app_last_tx:
+                    app_data[app_name][3][current_hour].append(row_number)
+                app_data[app_name][2] = row_number
         # App installed logs
         elif row_entry_type.startswith('app|installed'):
             for app_entry in row_value.split(','):
@@ -240,95 +161,116 @@ def parse_file(file, lancs, fname):
                     temp_name = installed_details[0]
                     app_info = installed_details[1].split(':')
                     temp_app_id = app_info[len(app_info) - 2]
-                    if temp_name not in current_app_name_id_mapping:
+                    if temp_name not in app_ids:
                         app_data[temp_name] = [None, [[] for x in range(0,24)], None, [[] for x in range(0,24)]]
 
                     # Remove old mapping if it exists
-                    if temp_app_id not in ids_names:
-                        ids_names[temp_app_id] = temp_name
-                    elif ids_names[temp_app_id] != temp_name:
-                        for key, val in current_app_name_id_mapping.items():
-                            if val == temp_app_id and key != temp_name:
-                                current_app_name_id_mapping[key] = ''
-                        ids_names[temp_app_id] = temp_name
-
-                    current_app_name_id_mapping[temp_name] = temp_app_id
+                    app_ids.install(temp_name, temp_app_id)
         # SMS
         elif row_entry_type.startswith('sms') and entry_val[1] == 'count':
             if entry_val[2] == 'inbox':
+                row_number = row.Number
                 if last_r_sms == None:
                     sms_received = [[] for x in range(0,24)]
-                elif int(row_value) > last_r_sms:
-                    sms_received[current_hour].append(int(int(row_value) - last_r_sms))
-                last_r_sms = int(row_value)
+                elif row_number > last_r_sms:
+                    sms_received[current_hour].append(int(row_number - last_r_sms))
+                last_r_sms = row_number
             elif entry_val[2] == 'sent':
+                row_number = row.Number
                 if last_s_sms == None:
                     sms_sent = [[] for x in range(0,24)]
-                elif int(row_value) > last_s_sms:
-                    sms_sent[current_hour].append(int(int(row_value) - last_s_sms))
-                last_s_sms = int(row_value)
+                elif row_number > last_s_sms:
+                    sms_sent[current_hour].append(int(row_number - last_s_sms))
+                last_s_sms = row_number
         # PHONE CALLS
         elif row_entry_type.startswith('phone'):
             currentPhoneState = row_entry_type.split('|')[1]
             if last_phone_state == 'offhook' and (currentPhoneState == 'idle' or currentPhoneState == 'calling' or currentPhoneState == 'ringing'):
-                phone_call_hour = int((last_phone_datetime.rsplit('T')[1]).split(':')[0])
-                phone_calls[phone_call_hour].append(get_t_gap(last_phone_datetime,row_date))
+                phone_call_hour = last_phone_row.Hour
+                phone_calls[phone_call_hour].append(time_gap(last_phone_row.Time, row.Time))
             if currentPhoneState == 'offhook' or currentPhoneState == 'idle' or currentPhoneState == 'calling' or currentPhoneState == 'ringing':
                 last_phone_state = currentPhoneState
-                last_phone_datetime = row_date
-
-
-    if no_of_days != 0:
-        for app, data in app_foreground_use.items():
-            # Calculate hourly means for the device app foregound instances
-            mean_app_foreground_use = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
-            if not all(i == 0 for i in mean_app_foreground_use):
-                if app not in foreground_use:
-                    foreground_use[app] = [[] for x in range(0,24)]
-                [foreground_use[app][i].append(mean_app_foreground_use[i]) for i in range(0,24)]
-                # Add user to practice use contribution
-                practice = get_practice_name(app)
-                if practice != None:
-                    p_practice_use_contribution[practice].add(fname)
-                all_use_contribution.add(fname)
-                contribution.add(fname)
-
-        for app, data in app_data.items():
-            mean_rx = [(sum(ihour)/no_of_days) for ihour in data[1]]
-            mean_tx = [(sum(ihour)/no_of_days) for ihour in data[3]]
-            if not all(i == 0 for i in mean_rx):
-                if app not in apps_rx:
-                    apps_rx[app] = [[] for i in range(0,24)]
-                [apps_rx[app][i].append(mean_rx[i]) for i in range(0,24)]
-            if not all(i == 0 for i in mean_tx):
-                if app not in apps_tx:
-                    apps_tx[app] = [[] for i in range(0,24)]
-                [apps_tx[app][i].append(mean_tx[i]) for i in range(0,24)]
-            # Add user to practice demand contribution
-            if not all(i == 0 for i in mean_rx + mean_tx):
-                practice = get_practice_name(app)
-                if practice != None:
-                    p_practice_demand_contribution[practice].add(fname)
-                all_demand_contribution.add(fname)
-                contribution.add(fname)
-
-        # Append this device's sms hourly averages to overall sms
-        mean_sent = [(sum(ihour)/no_of_days) for ihour in sms_sent]
-        mean_received = [(sum(ihour)/no_of_days) for ihour in sms_received]
-        if not all(i == 0 for i in mean_sent):
-            [sms_sent_hourly[i].append(mean_sent[i]) for i in range(0,24)]
-        if not all(i == 0 for i in mean_received):
-            [sms_received_hourly[i].append(mean_received[i]) for i in range(0,24)]
-
-        # Append this device's hourly phone call average durations and average no. of phone calls to overall phone calls
-        mean_phone_call_durations = [(sum(ihour)/no_of_days) for ihour in phone_calls]
-        mean_no_phone_calls = [(len(ihour)/no_of_days) for ihour in phone_calls]
-        if not all(i == 0 for i in mean_phone_call_durations):
-            [mean_phone_call_durations_hourly[i].append(mean_phone_call_durations[i]) for i in range(0,24)]
-        if not all(i == 0 for i in mean_no_phone_calls):
-            [mean_no_of_phone_calls_hourly[i].append(mean_no_phone_calls[i]) for i in range(0,24)]
+                last_phone_row = row
+
+
+    if no_of_days == 0:
+        return None
+
+    # Calculate hourly means for the device app foregound instances
+    foreground_means = []
+    for app, data in app_foreground_use.items():
+        mean_app_foreground_use = [(no_of_foreground_instances/no_of_days) for no_of_foreground_instances in data]
+        if not all(i == 0 for i in mean_app_foreground_use):
+            foreground_means.append((app, mean_app_foreground_use))
+
+    app_means = []
+    for app, data in app_data.items():
+        mean_rx = [(sum(ihour)/no_of_days) for ihour in data[1]]
+        mean_tx = [(sum(ihour)/no_of_days) for ihour in data[3]]
+        if not all(i == 0 for i in mean_rx + mean_tx):
+            app_means.append((app, mean_rx, mean_tx))
+
+    # This device's sms hourly averages
+    mean_sent = [(sum(ihour)/no_of_days) for ihour in sms_sent]
+    mean_received = [(sum(ihour)/no_of_days) for ihour in sms_received]
+
+    # This device's hourly phone call average durations and average no. of phone calls
+    mean_phone_call_durations = [(sum(ihour)/no_of_days) for ihour in phone_calls]
+    mean_no_phone_calls = [(len(ihour)/no_of_days) for ihour in phone_calls]
+
+    return DeviceResult(fname, foreground_means, app_means, mean_sent, mean_received, mean_phone_call_durations, mean_no_phone_calls)
+
+def merge_device_result(result):
+    global practice_table
+    global apps_rx
+    global apps_tx
+    global foreground_use
+    global p_practice_demand_contribution
+    global p_practice_use_contribution
+    global all_use_contribution
+    global all_demand_contribution
+    global contribution
+    global hourly_stats
+
+    if result == None:
+        return
+    fname = result.FileName
+
+    for app, mean_app_foreground_use in result.Foreground:
+        foreground_use.add(app, mean_app_foreground_use)
+        # Add user to practice use contribution
+        practice = practice_table.practice_code(app)
+        if practice >= 0:
+            p_practice_use_contribution[practice].add(fname)
+        all_use_contribution.add(fname)
+        contribution.add(fname)
+
+    for app, mean_rx, mean_tx in result.AppData:
+        if not all(i == 0 for i in mean_rx):
+            apps_rx.add(app, mean_rx)
+        if not all(i == 0 for i in mean_tx):
+            apps_tx.add(app, mean_tx)
+        # Add user to practice demand contribution
+        practice = practice_table.practice_code(app)
+        if practice >= 0:
+            p_practice_demand_contribution[practice].add(fname)
+        all_demand_contribution.add(fname)
+        contribution.add(fname)
+
+    # Append this device's sms hourly averages to overall sms
+    if not all(i == 0 for i in result.SmsSent):
+        hourly_stats.add('sms_sent', result.SmsSent)
+    if not all(i == 0 for i in result.SmsReceived):
+        hourly_stats.add('sms_received', result.SmsReceived)
+
+    # Append this device's hourly phone call average durations and average no. of phone calls to overall phone calls
+    if not all(i == 0 for i in result.CallDurations):
+        hourly_stats.add('call_durations', result.CallDurations)
+    if not all(i == 0 for i in result.NoOfCalls):
+        hourly_stats.add('no_of_calls', result.NoOfCalls)
 
 def calculate_print_summaries():
+    global practice_table
     global apps_rx
     global apps_tx
     global foreground_use
@@ -337,300 +279,268 @@ def calculate_print_summaries():
     global all_use_contribution
     global all_demand_contribution
     global contribution
+    global output
 
-    with open('everything/contribution.csv', 'w') as f:
+    with output.open('everything/contribution.csv', 'w') as f:
         f.write('use,{0}\n'.format(len(all_use_contribution)))
         f.write('demand,{0}\n'.format(len(all_demand_contribution)))
         f.write('total no of devices,{0}\n'.format(len(contribution)))
 
-    with open('everything/practice_demand_contribution.csv', 'w') as f:
+    with output.open('everything/practice_demand_contribution.csv', 'w') as f:
         f.write('Category, no of devices\n')
 
-    with open('everything/practice_use_contribution.csv', 'w') as f:
+    with output.open('everything/practice_use_contribution.csv', 'w') as f:
         f.write('Category, no of devices\n')
 
-    for practice, devices in p_practice_demand_contribution.items():
-        with open('everything/practice_demand_contribution.csv', 'a') as f:
+    for practice, devices in zip(practice_table.practices, p_practice_demand_contribution):
+        with output.open('everything/practice_demand_contribution.csv', 'a') as f:
             f.write('"{0}",{1}\n'.format(practice, len(devices)))
 
-    for practice, devices in p_practice_use_contribution.items():
-        with open('everything/practice_use_contribution.csv', 'a') as f:
+    for practice, devices in zip(practice_table.practices, p_practice_use_contribution):
+        with output.open('everything/practice_use_contribution.csv', 'a') as f:
             f.write('"{0}",{1}\n'.format(practice, len(devices)))
 
-    foreground_total = [[] for i in range(0,24)]
-    practices_foreground = OrderedDict()
-
-    for app, data in foreground_use.items():
-        sum_use = [0 if not hour else sum(hour) for hour in data]
-        [foreground_total[i].append(sum_use[i]) for i in range(0,24)]
-        practice = get_practice_name(app)
-        if practice != None:
-            if practice not in practices_foreground:
-                practices_foreground[practice] = [[] for i in range(0,24)]
-            [practices_foreground[practice][i].append(sum_use[i]) for i in range(0,24)]
-
-    data_rx_total = [[] for i in range(0,24)]
-    data_tx_total = [[] for i in range(0,24)]
-    data_all_total = [[] for i in range(0,24)]
-    practices_rx = OrderedDict()
-    practices_tx = OrderedDict()
-    practices_data = OrderedDict()
-
-    for app, data in apps_rx.items():
-        sum_rx = [0 if not hour else sum(hour) for hour in data]
-        [data_rx_total[i].append(sum_rx[i]) for i in range(0,24)]
-        [data_all_total[i].append(sum_rx[i]) for i in range(0,24)]
-        practice = get_practice_name(app)
-        if practice != None:
-            if practice not in practices_rx:
-                practices_rx[practice] = [[] for i in range(0,24)]
-            [practices_rx[practice][i].append(sum_rx[i]) for i in range(0,24)]
-            if practice not in practices_data:
-                practices_data[practice] = [[] for i in range(0,24)]
-            [practices_data[practice][i].append(sum_rx[i]) for i in range(0,24)]
-
-    for app, data in apps_tx.items():
-        sum_tx = [0 if not hour else sum(hour) for hour in data]
-        [data_tx_total[i].append(sum_tx[i]) for i in range(0,24)]
-        [data_all_total[i].append(sum_tx[i]) for i in range(0,24)]
-        practice = get_practice_name(app)
-        if practice != None:
-            if practice not in practices_tx:
-                practices_tx[practice] = [[] for i in range(0,24)]
-            [practices_tx[practice][i].append(sum_tx[i]) for i in range(0,24)]
-            if practice not in practices_data:
-                practices_data[practice] = [[] for i in range(0,24)]
-            [practices_data[practice][i].append(sum_tx[i]) for i in range(0,24)]
-
-    overall_use_from_categories = 0
-    overall_demand_from_categories = 0
-    overall_use = 0
-    overall_demand = 0
-
-    with open('everything/all_totals.csv', 'a') as f:
-        foreground_all = [0 if not hour else sum(hour) for hour in foreground_total]
-        overall_use = overall_use + sum(foreground_all)
-
-        rx_all = [0 if not hour else sum(hour) for hour in data_rx_total]
-        tx_all = [0 if not hour else sum(hour) for hour in data_tx_total]
-        data_all = [0 if not hour else sum(hour) for hour in data_all_total]
-        overall_demand = overall_demand + sum(data_all)
+    # Per-app hourly sums across devices, and the practice code of each app (-1 if not in the mapping)
+    foreground = foreground_use.totals()
+    rx = apps_rx.totals()
+    tx = apps_tx.totals()
+    foreground_codes = practice_table.practice_codes_of(foreground_use.names)
+    rx_codes = practice_table.practice_codes_of(apps_rx.names)
+    tx_codes = practice_table.practice_codes_of(apps_tx.names)
+    # Data of both directions, the rx of every app then the tx
+    data = np.concatenate((rx, tx))
+    data_codes = np.concatenate((rx_codes, tx_codes))
+
+    # Practice totals by hour, the practices in order of their first app
+    practices_foreground = practice_rollup(foreground_codes, foreground)
+    practices_rx = practice_rollup(rx_codes, rx)
+    practices_tx = practice_rollup(tx_codes, tx)
+    practices_data = practice_rollup(data_codes, data)
+
+    with output.open('everything/all_totals.csv', 'a') as f:
+        foreground_all = hourly_totals(foreground)
+        overall_use = sum(foreground_all)
+
+        rx_all = hourly_totals(rx)
+        tx_all = hourly_totals(tx)
+        data_all = hourly_totals(data)
+        overall_demand = sum(data_all)
 
         f.write('{0};{1}\n'.format('foreground use', foreground_all))
         f.write('{0};{1}\n'.format('data rx', rx_all))
         f.write('{0};{1}\n'.format('data tx', tx_all))
         f.write('{0};{1}\n'.format('data all', data_all))
 
-    for practice, data in practices_foreground.items():
-        total_foreground_use = [0 if not hour else sum(hour) for hour in data]
-        overall_use_from_categories = overall_use_from_categories + sum(total_foreground_use)
-        with open('everything/all_practice_use.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+    # Hours are summed in order as Python floats, so the totals match summing the hourly lists
+    use_totals = [(code, totals, sum(totals)) for code, totals in zip(practices_foreground[0], practices_foreground[1].tolist())]
+    demand_totals = [(code, totals, sum(totals)) for code, totals in zip(practices_data[0], practices_data[1].tolist())]
+    overall_use_from_categories = sum(use for code, totals, use in use_totals)
+    overall_demand_from_categories = sum(demand for code, totals, demand in demand_totals)
+
+    for code, total_foreground_use, use in use_totals:
+        with output.open('everything/all_practice_use.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_foreground_use[i]))
             f.write('\n')
 
-    for practice, data in practices_rx.items():
-        total_rx = [0 if not hour else sum(hour) for hour in data]
+    for code, total_rx in zip(practices_rx[0], practices_rx[1].tolist()):
         # Write practice summaries to files
-        with open('everything/all_practice_rx.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+        with output.open('everything/all_practice_rx.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_rx[i]))
             f.write('\n')
 
-    for practice, data in practices_tx.items():
-        total_tx = [0 if not hour else sum(hour) for hour in data]
+    for code, total_tx in zip(practices_tx[0], practices_tx[1].tolist()):
         # Write practice summaries to files
-        with open('everything/all_practice_tx.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+        with output.open('everything/all_practice_tx.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_tx[i]))
             f.write('\n')
 
-    for practice, data in practices_data.items():
-        total_data = [0 if not hour else sum(hour) for hour in data]
-        overall_demand_from_categories = overall_demand_from_categories + sum(total_data)
+    for code, total_data, demand in demand_totals:
         # Write practice summaries to files
-        with open('everything/all_practice_data.csv', 'a') as f:
-            f.write('"{0}"'.format(practice))
+        with output.open('everything/all_practice_data.csv', 'a') as f:
+            f.write('"{0}"'.format(practice_table.practices[code]))
             for i in range(0,24):
                 f.write(',{0}'.format(total_data[i]))
             f.write('\n')
 
     # OVERALL SUMMARY FOR USE
-    with open('everything/daily_practice_use.csv', 'w') as f:
+    with output.open('everything/daily_practice_use.csv', 'w') as f:
         f.write('{0},{1}\n\n'.format('Overall use', overall_use))
         percentage_for_all_categories = (overall_use_from_categories/overall_use) * 100
         f.write('{0},{1},{2}\n\n'.format('Overall use from categories', overall_use_from_categories, percentage_for_all_categories))
         f.write('Category, use (instances), percentage of overall use (%)\n')
-    for practice, data in practices_foreground.items():
-        category_use = sum([0 if not hour else sum(hour) for hour in data])
-        category_percentage = (category_use/overall_use) * 100
-        with open('everything/daily_practice_use.csv', 'a') as f:
-            f.write('"{0}",{1},{2}\n'.format(practice, category_use, category_percentage))
+    for code, total_foreground_use, use in use_totals:
+        category_percentage = (use/overall_use) * 100
+        with output.open('everything/daily_practice_use.csv', 'a') as f:
+            f.write('"{0}",{1},{2}\n'.format(practice_table.practices[code], use, category_percentage))
 
     # OVERALL SUMMARY FOR DEMAND
-    with open('everything/daily_practice_data.csv', 'w') as f:
+    with output.open('everything/daily_practice_data.csv', 'w') as f:
         f.write('{0},{1}\n\n'.format('Overall demand', overall_demand))
         percentage_for_all_categories = (overall_demand_from_categories/overall_demand) * 100
         f.write('{0},{1},{2}\n\n'.format('Overall demand from categories', overall_demand_from_categories, percentage_for_all_categories))
         f.write('Category, demand (bytes), percentage of overall demand (%)\n')
-    for practice, data in practices_data.items():
-        category_demand = sum([0 if not hour else sum(hour) for hour in data])
-        category_percentage = (category_demand/overall_demand) * 100
-        with open('everything/daily_practice_data.csv', 'a') as f:
-            f.write('"{0}",{1},{2}\n'.format(practice, category_demand, category_percentage))
+    for code, total_data, demand in demand_totals:
+        category_percentage = (demand/overall_demand) * 100
+        with output.open('everything/daily_practice_data.csv', 'a') as f:
+            f.write('"{0}",{1},{2}\n'.format(practice_table.practices[code], demand, category_percentage))
 
 def calculate_print_sms_summaries():
-    global sms_sent_hourly
-    global sms_received_hourly
+    global hourly_stats
+    global output
 
     # SMS SUMMARY
-    # Calculate sent sms summary - hourly totals, means, no of devices, mins, maxs, medians across devices
-    total_sms_sent = [0 if not hour else sum(hour) for hour in sms_sent_hourly]
-    mean_sms_sent = [0 if not hour else np.mean(hour) for hour in sms_sent_hourly]
-    devices_sent = [0 if not hour else len(hour) for hour in sms_sent_hourly]
-    min_sent = [0 if not hour else np.min(hour) for hour in sms_sent_hourly]
-    max_sent = [0 if not hour else np.max(hour) for hour in sms_sent_hourly]
-    med_sent = [0 if not hour else np.median(hour) for hour in sms_sent_hourly]
-    # Calculate received sms summary - hourly totals, means, no of devices, mins, maxs, medians across devices
-    total_sms_received = [0 if not hour else sum(hour) for hour in sms_received_hourly]
-    mean_sms_received = [0 if not hour else np.mean(hour) for hour in sms_received_hourly]
-    devices_received = [0 if not hour else len(hour) for hour in sms_received_hourly]
-    min_received = [0 if not hour else np.min(hour) for hour in sms_received_hourly]
-    max_received = [0 if not hour else np.max(hour) for hour in sms_received_hourly]
-    med_received = [0 if not hour else np.median(hour) for hour in sms_received_hourly]
+    # Calculate sent and received sms summaries - hourly totals, means, no of devices, mins, maxs, medians across devices
+    sent, received = hourly_stats.summaries(['sms_sent', 'sms_received'])
+    total_sms_sent, mean_sms_sent, devices_sent, min_sent, max_sent, med_sent = sent
+    total_sms_received, mean_sms_received, devices_received, min_received, max_received, med_received = received
 
     # Write SMS summary to file
-    with open('everything/sms_summary.csv', 'a') as f:
+    with output.open('everything/sms_summary.csv', 'a') as f:
         f.write('sms_sent;\ntotal sent;{0}\nmean sent;{1}\nno. devices sent;{2}\nmin sent;{3}\nmax sent;{4}\nmedian sent;{5}\n'.format(total_sms_sent, mean_sms_sent, devices_sent, min_sent, max_sent, med_sent))
         f.write('sms_received;\ntotal received;{0}\nmean received;{1}\nno. devices received;{2}\nmin received;{3}\nmax received;{4}\nmedian received;{5}\n'.format(total_sms_received, mean_sms_received, devices_received, min_received, max_received, med_received))
 
 def calculate_print_phone_call_summaries():
-    global mean_phone_call_durations_hourly
-    global mean_no_of_phone_calls_hourly
+    global hourly_stats
+    global output
 
     # PHONE CALLS SUMMARY
-    # Calculate phone call durations summary - hourly totals, means, no of devices, mins, maxs, medians across devices
-    dur_total_phone_calls = [0 if not hour else sum(hour) for hour in mean_phone_call_durations_hourly]
-    dur_mean_phone_calls = [0 if not hour else np.mean(hour) for hour in mean_phone_call_durations_hourly]
-    dur_devices_phone_calls = [0 if not hour else len(hour) for hour in mean_phone_call_durations_hourly]
-    dur_min_phone_calls = [0 if not hour else np.min(hour) for hour in mean_phone_call_durations_hourly]
-    dur_max_phone_calls = [0 if not hour else np.max(hour) for hour in mean_phone_call_durations_hourly]
-    dur_med_phone_calls = [0 if not hour else np.median(hour) for hour in mean_phone_call_durations_hourly]
-    # Calculate number of phone calls summary - hourly totals, means, no of devices, mins, maxs, medians across devices
-    no_total_phone_calls = [0 if not hour else sum(hour) for hour in mean_no_of_phone_calls_hourly]
-    no_mean_phone_calls = [0 if not hour else np.mean(hour) for hour in mean_no_of_phone_calls_hourly]
-    no_devices_phone_calls = [0 if not hour else len(hour) for hour in mean_no_of_phone_calls_hourly]
-    no_min_phone_calls = [0 if not hour else np.min(hour) for hour in mean_no_of_phone_calls_hourly]
-    no_max_phone_calls = [0 if not hour else np.max(hour) for hour in mean_no_of_phone_calls_hourly]
-    no_med_phone_calls = [0 if not hour else np.median(hour) for hour in mean_no_of_phone_calls_hourly]
+    # Calculate phone call durations and number of phone calls summaries - hourly totals, means, no of devices, mins, maxs, medians across devices
+    durations, no_of_calls = hourly_stats.summaries(['call_durations', 'no_of_calls'])
+    dur_total_phone_calls, dur_mean_phone_calls, dur_devices_phone_calls, dur_min_phone_calls, dur_max_phone_calls, dur_med_phone_calls = durations
+    no_total_phone_calls, no_mean_phone_calls, no_devices_phone_calls, no_min_phone_calls, no_max_phone_calls, no_med_phone_calls = no_of_calls
 
     # Write phone calls summary to file
-    with open('everything/phone_calls_summary.csv', 'a') as f:
+    with output.open('everything/phone_calls_summary.csv', 'a') as f:
         f.write('durations;\nduration totals;{0}\nmean durations;{1}\nno. devices;{2}\nmin duration;{3}\nmax duration;{4}\nmedian duration;{5}\n'.format(dur_total_phone_calls, dur_mean_phone_calls, dur_devices_phone_calls, dur_min_phone_calls, dur_max_phone_calls, dur_med_phone_calls))
         f.write('no. of calls;\nno. of calls totals;{0}\nmean no.;{1}\nno. devices;{2}\nmin no.;{3}\nmax no.;{4}\nmedian no.;{5}\n'.format(no_total_phone_calls, no_mean_phone_calls, no_devices_phone_calls, no_min_phone_calls, no_max_phone_calls, no_med_phone_calls))
 
 
-if __name__ == '__main__':
+def init_report(pathOfAppPracticeMapping):
     global apps_rx
     global apps_tx
     global foreground_use
-    global app_practice_mapping
+    global practice_table
     global p_practice_demand_contribution
     global p_practice_use_contribution
     global all_use_contribution
     global all_demand_contribution
     global contribution
-    global sms_sent_hourly
-    global sms_sent_total_hourly
-    global sms_received_hourly
-    global sms_received_total_hourly
-    global mean_phone_call_durations_hourly
-    global mean_no_of_phone_calls_hourly
-
-    sms_sent_hourly = [[] for x in range(0,24)]
-    sms_sent_total_hourly = [[] for x in range(0,24)]
-    sms_received_hourly = [[] for x in range(0,24)]
-    sms_received_total_hourly = [[] for x in range(0,24)]
-    mean_phone_call_durations_hourly = [[] for x in range(0,24)]
-    mean_no_of_phone_calls_hourly = [[] for x in range(0,24)]
-
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    pathOfAppPracticeMapping = sys.argv[3]
-    lancs = bool(len(sys.argv) > 4)
+    global hourly_stats
+    global output
 
-    startTime = datetime.now()
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
-    foreground_use = [[] for x in range(0,24)]
-    data_rx = [[] for x in range(0,24)]
-    data_tx = [[] for x in range(0,24)]
+    # Hourly sms and phone call values of each device
+    hourly_stats = HourlyStats()
 
-    apps_rx = {}
-    apps_tx = {}
-    foreground_use = {}
+    # Hourly means of the devices summed by app
+    apps_rx = AppHourlySums()
+    apps_tx = AppHourlySums()
+    foreground_use = AppHourlySums()
 
     all_use_contribution = set()
     all_demand_contribution = set()
     contribution = set()
 
-    app_practice_mapping = {}
-    p_practice_demand_contribution = {}
-    p_practice_use_contribution = {}
-    for app in read_app_mapping(pathOfAppPracticeMapping):
-        app_practice_mapping[app.FullName] = app.Practice
-        if app.Practice not in p_practice_demand_contribution:
-            p_practice_demand_contribution[app.Practice] = set()
-        if app.Practice not in p_practice_use_contribution:
-            p_practice_use_contribution[app.Practice] = set()
+    # Devices contributing to each practice, by practice code
+    practice_table = read_practice_table(pathOfAppPracticeMapping)
+    p_practice_demand_contribution = [set() for practice in practice_table.practices]
+    p_practice_use_contribution = [set() for practice in practice_table.practices]
 
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('everything/')
 
-    with open('everything/sms_summary.csv', 'w') as f:
+    with output.open('everything/sms_summary.csv', 'w') as f:
         f.write('')
 
-    with open('everything/phone_calls_summary.csv', 'w') as f:
+    with output.open('everything/phone_calls_summary.csv', 'w') as f:
         f.write('')
 
-    with open('everything/all_practice_use.csv', 'w') as f:
+    with output.open('everything/all_practice_use.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('everything/all_practice_rx.csv', 'w') as f:
+    with output.open('everything/all_practice_rx.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('everything/all_practice_tx.csv', 'w') as f:
+    with output.open('everything/all_practice_tx.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    with open('everything/all_practice_data.csv', 'w') as f:
+    with output.open('everything/all_practice_data.csv', 'w') as f:
         f.write('hour')
         for i in range(0,24):
             f.write(',{0}'.format(i))
         f.write('\n')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        parse_file(fullfpath, lancs, fname)
+def finish_report():
+    global output
 
     calculate_print_summaries()
     calculate_print_sms_summaries()
     calculate_print_phone_call_summaries()
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('parse_everything', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    median = pop_option(args, '--median', 'exact')
+    set_median_mode(median)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    pathOfAppPracticeMapping = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'parse_everything')
+
+    init_report(pathOfAppPracticeMapping)
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache)
+    options = [str(lancs), median]
+    checkpoint = open_checkpoint(checkpoint_path, 'parse_everything', devices, [pathOfAppPracticeMapping], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'parse_everything', devices, [pathOfAppPracticeMapping], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'parse_everything', [pathOfAppPracticeMapping]), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'parse_everything', devices, [pathOfAppPracticeMapping], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'parse_everything', [pathOfAppPracticeMapping]), progress, checkpoint)
+    for device, result in devices_results:
+        merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
-    print("All files summarised in {0}".format(str((endFilesTime - startTime))))
+    print("All files summarised in {0}".format(str((endFilesTime - startTime))))
\ No newline at end of file
@@ -14,105 +14,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import gzip
 import sys
-import os
-import csv
-import io
-import glob
 import numpy as np
 from collections import namedtuple
-import dateutil.parser
-from datetime import datetime, timedelta
+from datetime import datetime
+from da_common import read_device_file, read_app_mapping, PracticeTable, practice_rollup, make_sure_path_exists, feed_parser, pop_option, list_devices, parse_devices, open_result_store, AppIdIndex, OutputSink, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
 
+global output
 global apps_practices
+global practice_table
 
-fields_da = ('Entry','Num','Date','EntryType','Value')
-DARecord = namedtuple('DARecord', fields_da)
-def read_file(path):
-    try:
-        with io.BufferedReader(gzip.open(path, 'rU')) as data:
-            for line in data:
-                #Repack variable number of items per line into five expected items
-                #(Problem is internal DA format uses ';' to separate csv items as well
-                # as to separate app names inside the 'Value' field.)
-                e = line.split(';')
-                value = reduce(lambda x, y: x + ',' + y, e[4:])
-                repacked = e[0:4] + [value]
-                yield apply(DARecord._make, (repacked,))
-    except Exception as ex:
-        print(ex)
-        print('Failed to read file: ' + path)
-
-fields_filename = ('i', 'FileName', 'Start', 'End', 'Days', 'PropData', 'InUK', 'OutUK', 'PropUK')
-FileNameRecord = namedtuple('FileNameRecord', fields_filename)
-def read_file_names(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=' ')
-        for row in map(FileNameRecord._make, reader):
-            yield row
-
-fields_lancs = ('Entry','Num','Date','EntryType','Value')
-DARecordLancs = namedtuple('DARecordLancs', fields_lancs)
-def read_file_lancs(path):
-    try:
-        with open(path, 'rU') as data:
-            csv.field_size_limit(sys.maxsize)
-            reader = csv.reader(data, delimiter=';')
-            for row in map(DARecord._make, reader):
-                yield row
-    except Exception as ex:
-        print(ex)
-        print('Failed to read file: ' + path)
-
-FileNameRecordLancs = namedtuple('FileNameRecordLancs', ('FileName'))
-def read_file_names_lancs(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter='\n')
-        for row in map(FileNameRecordLancs._make, reader):
-            yield row
-
-AppRecord = namedtuple('AppRecord', ('FullName', 'Name', 'Practice'))
-def read_app_mapping(path):
-    with open(path, 'rU') as data:
-        csv.field_size_limit(sys.maxsize)
-        reader = csv.reader(data, delimiter=';')
-        for row in map(AppRecord._make, reader):
-            yield row
-
-def make_sure_path_exists(path):
-    try:
-        os.makedirs(path)
-    except OSError as exception:
-        print('Output path exists')
-
-def get_t_gap(first, second):
-    return (dateutil.parser.parse(second) - dateutil.parser.parse(first)).total_seconds()
-
-def parse_file(file, lancs):
-    global apps_practices
-    global sms_sent_hourly
-    global sms_sent_total_hourly
-    global sms_received_hourly
-    global sms_received_total_hourly
-    global mean_phone_call_durations_hourly
-    global mean_no_of_phone_calls_hourly
+# Logs used by device_parser, other rows are skipped when the device file is read
+logs_to_parse = ['net','app']
+# Globals the device results are merged into, saved by checkpoints
+merged_globals = ['apps_practices']
+
+# Per-device hourly means, computed by device_parser (possibly in a worker process)
+# and added to the global accumulators by merge_device_result
+DeviceResult = namedtuple('DeviceResult', ('AppData'))
+
+def parse_device_file(device):
+    return feed_parser(device_parser(device.Path, device.FileName), read_device_file(device.Path, device.Lancs, device.Cache, logs_to_parse))
 
-    logs_to_parse = ['net','app']
+def device_parser(file, fname):
+    global apps_practices
 
     current_hour = None
     current_day = None
     no_of_days = 0
 
-    ids_names = {}
-    current_app_name_id_mapping = {}
+    app_ids = AppIdIndex()
     app_data = {}
 
     current_hour = None
 
-    for row in (read_file_lancs(file) if lancs else read_file(file)):
+    while True:
+        row = yield
+        if row is None:
+            break
         row_entry_type = row.EntryType
         entry_val = row_entry_type.split('|')
         row_date = row.Date
@@ -126,36 +66,35 @@ def parse_file(file, lancs):
             current_day = date_time[0]
             no_of_days+=1
 
-        current_hour = int(date_time[1].split(':')[0])
+        current_hour = row.Hour
 
         # APP DATA
         if row_entry_type.startswith('net|app'):
             app_id = entry_val[2]
-            app_name = None
-            for key, val in current_app_name_id_mapping.items():
-                if val == app_id:
-                    app_name = key
+            app_name = app_ids.name(app_id)
             if app_name == None:
                 continue
 
             if entry_val[3] == 'rx_bytes':
+                row_number = row.Number
                 app_last_rx = app_data[app_name][0]
                 if app_last_rx == None:
                     pass
-                elif int(row_value) > app_last_rx:
-                    app_data[app_name][1][current_hour].append(int(row_value) - app_last_rx)
-                elif int(row_value) < app_last_rx:
-                    app_data[app_name][1][current_hour].append(int(row_value))
-                app_data[app_name][0] = int(row_value)
+                elif row_number > app_last_rx:
+                    app_data[app_name][1][current_hour].append(row_number - app_last_rx)
+                elif row_number < app_last_rx:
+                    app_data[app_name][1][current_hour].append(row_number)
+                app_data[app_name][0] = row_number
             elif entry_val[3] == 'tx_bytes':
+                row_number = row.Number
                 app_last_tx = app_data[app_name][2]
                 if app_last_tx == None:
                     pass
-                elif int(row_value) > app_last_tx:
-                    app_data[app_name][3][current_hour].append(int(row_value) - app_last_tx)
-                elif int(row_value) < app_last_tx:
-                    app_data[app_name][3][current_hour].append(int(row_value))
-                app_data[app_name][2] = int(row_value)
+                elif row_number > app_last_tx:
+                    app_data[app_name][3][current_hour].append(row_number - app_last_tx)
+                elif row_number < app_last_tx:
+                    app_data[app_name][3][current_hour].append(row_number)
+                app_data[app_name][2] = row_number
         # APP NAMES
         elif row_entry_type.startswith('app|installed'):
             for app_entry in row_value.split(','):
@@ -163,98 +102,142 @@ def parse_file(file, lancs):
                 if temp_name in apps_practices:
                     app_info = app_entry.split('@')[1].split(':')
                     temp_app_id = app_info[len(app_info) - 2]
-                    if temp_name not in current_app_name_id_mapping:
+                    if temp_name not in app_ids:
                         app_data[temp_name] = [None, [[] for x in range(0,24)], None, [[] for x in range(0,24)]]
 
                     # Remove old mapping if it exists
-                    if temp_app_id not in ids_names:
-                        ids_names[temp_app_id] = temp_name
-                    elif ids_names[temp_app_id] != temp_name:
-                        for key, val in current_app_name_id_mapping.items():
-                            if val == temp_app_id and key != temp_name:
-                                current_app_name_id_mapping[key] = ''
-                        ids_names[temp_app_id] = temp_name
-
-                    current_app_name_id_mapping[temp_name] = temp_app_id
-
-
-    if no_of_days != 0:
-        # Append this device's hourly app data to overall data
-        for app, data in app_data.items():
-            # Calculate hourly means for the device app
-            mean_rx = [(sum(ihour)/no_of_days) for ihour in data[1]]
-            mean_tx = [(sum(ihour)/no_of_days) for ihour in data[3]]
-            if not all(i == 0 for i in mean_rx):
-                [apps_practices[app][2][i].append(mean_rx[i]) for i in range(0,24)]
-            if not all(i == 0 for i in mean_tx):
-                [apps_practices[app][3][i].append(mean_tx[i]) for i in range(0,24)]
+                    app_ids.install(temp_name, temp_app_id)
 
-def calculate_print_app_practice_summaries():
-    global apps_practices
 
-    practices = {}
+    if no_of_days == 0:
+        return None
 
-    # APP SUMMARY
-    for app, data in apps_practices.items():
-        # Initialise the practice in the dictionary if it doesn't already exist
-        app_name = data[0]
-        practice_name = data[1]
-        if practice_name not in practices:
-            practices[data[1]]  = [[] for i in range(0,24)], [[] for i in range(0,24)]
+    # Calculate hourly means for the device apps
+    app_means = []
+    for app, data in app_data.items():
+        mean_rx = [(sum(ihour)/no_of_days) for ihour in data[1]]
+        mean_tx = [(sum(ihour)/no_of_days) for ihour in data[3]]
+        if not all(i == 0 for i in mean_rx + mean_tx):
+            app_means.append((app, mean_rx, mean_tx))
+
+    return DeviceResult(app_means)
 
-        # Calculate the overall hourly totals, means, no of devices, mins, maxs and medians for the apps across devices for rx
-        mean_rx = [0 if not hour else np.mean(hour) for hour in data[2]]
+def merge_device_result(result):
+    global apps_practices
 
-        # Calculate the overall hourly totals, means, no of devices, mins, maxs and medians for the apps across devices for tx
-        mean_tx = [0 if not hour else np.mean(hour) for hour in data[3]]
+    if result == None:
+        return
 
-        # Append app hourly means to the overall practices means
-        for i in range(0,24):
-            practices[practice_name][0][i].append(mean_rx[i])
-            practices[practice_name][1][i].append(mean_tx[i])
+    # Append this device's hourly app data to overall data
+    for app, mean_rx, mean_tx in result.AppData:
+        if not all(i == 0 for i in mean_rx):
+            [apps_practices[app][2][i].append(mean_rx[i]) for i in range(0,24)]
+        if not all(i == 0 for i in mean_tx):
+            [apps_practices[app][3][i].append(mean_tx[i]) for i in range(0,24)]
+
+def calculate_print_app_practice_summaries():
+    global apps_practices
+    global practice_table
+    global output
+
+    # APP SUMMARY
+    # Per app, in the order of practice_table.names: the hourly means across devices for rx
+    # and tx (0 without data), whether it has rx and tx data, and 1 to count the apps
+    app_values = np.zeros((len(apps_practices), 51))
+    app_values[:, 50] = 1
+    for code, data in enumerate(apps_practices.values()):
+        if data[2][0]:
+            app_values[code, :24] = [np.mean(hour) for hour in data[2]]
+            app_values[code, 48] = 1
+        if data[3][0]:
+            app_values[code, 24:48] = [np.mean(hour) for hour in data[3]]
+            app_values[code, 49] = 1
 
     # PRACTICE SUMMARY
-    for practice, data in practices.items():
-        # Calculate the overall hourly total of means for the apps across devices for rx and tx
-        total_rx = [0 if not hour else sum(hour) for hour in data[0]]
-        total_tx = [0 if not hour else sum(hour) for hour in data[1]]
-        no_of_apps = len(data[0][0])
+    # The overall hourly total of means for the apps across devices for rx and tx, summed by practice
+    codes, totals = practice_rollup(practice_table.app_practice, app_values)
+    for code, data in zip(codes, totals):
+        practice = practice_table.practices[code]
+        # A practice without data has int zeros, as numpy sums otherwise
+        total_rx = list(data[:24]) if data[48] else [0 for i in range(0,24)]
+        total_tx = list(data[24:48]) if data[49] else [0 for i in range(0,24)]
+        no_of_apps = int(data[50])
 
         # Write practice summaries to files
-        with open('out/practice_hourly_summaries.csv', 'a') as f:
+        with output.open('out/practice_hourly_summaries.csv', 'a') as f:
             f.write('{0};{1};{2}\n{3};{4};{5}\n'.format(practice, no_of_apps, 'rx_bytes;{0}'.format(total_rx), practice, no_of_apps, 'tx_bytes;{0}'.format(total_tx)))
 
 
-if __name__ == '__main__':
+def init_report(pathOfAppMappingFile):
     global apps_practices
+    global practice_table
+    global output
 
-    pathOfIdsFile = sys.argv[1]
-    pathOfFiles = sys.argv[2]
-    pathOfAppMappingFile = sys.argv[3]
-    lancs = bool(len(sys.argv) > 4)
-
-    startTime = datetime.now()
+    # Output files are written through the sink and moved into place by finish_report
+    output = OutputSink()
 
+    apps = list(read_app_mapping(pathOfAppMappingFile))
+    practice_table = PracticeTable(apps)
     apps_practices = {}
-    for app in read_app_mapping(pathOfAppMappingFile):
+    for app in apps:
         apps_practices[app.FullName] = (app.Name, app.Practice, [[] for x in range(0,24)], [[] for x in range(0,24)])
 
     # Make sure 'out/' folder exists and reset/create output files
     make_sure_path_exists('out/')
     output_files = ['practice_hourly_summaries.csv']
     for of_name in output_files:
-        with open('out/' + of_name, 'w') as f:
+        with output.open('out/' + of_name, 'w') as f:
             f.write('')
 
-    for file in (read_file_names_lancs(pathOfIdsFile) if lancs else read_file_names(pathOfIdsFile)):
-        fname = file.FileName
-        fullfpath = pathOfFiles + file.FileName + '.csv'
-        if not lancs:
-            fullfpath = fullfpath + '.gz'
-        print("Parsing file: " + fname)
-        parse_file(fullfpath, lancs)
+def finish_report():
+    global output
 
     calculate_print_app_practice_summaries()
+    output.close()
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('practice_data_demand', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    pathOfAppMappingFile = args[3]
+    lancs = bool(len(args) > 4)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'practice_data_demand')
+
+    init_report(pathOfAppMappingFile)
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache)
+    options = [str(lancs)]
+    checkpoint = open_checkpoint(checkpoint_path, 'practice_data_demand', devices, [pathOfAppMappingFile], options, [(globals(), merged_globals)], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'practice_data_demand', devices, [pathOfAppMappingFile], options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, open_result_store(store, 'practice_data_demand', [pathOfAppMappingFile]), progress))
+        output.discard()
+        finish_profile(profile, profile_stats, [output])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'practice_data_demand', devices, [pathOfAppMappingFile], options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, open_result_store(store, 'practice_data_demand', [pathOfAppMappingFile]), progress, checkpoint)
+    for device, result in devices_results:
+        merge_device_result(result)
+
+    finish_report()
+    finish_profile(profile, profile_stats, [output])
+    for path, rows, written in output.counters():
+        print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
 
     # **** For checking timings *****
     endFilesTime = datetime.now()
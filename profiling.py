@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Profile of a run of an analysis script (--profile). For each device file
+# it records the time spent decompressing, tokenizing, dispatching the rows
+# of each entry type to the device parsers and summarising the device, and
+# the no. of rows of each entry type in the part of the file read (seen, counted
+# from the decompressed stream as it is read) and read by the parsers (used). The times of finishing the report and writing the output
+# files are added at the end. With --profile-stats the run is also profiled
+# with cProfile and the stats dumped for pstats (or tools such as snakeviz,
+# gprof2dot and flameprof, which draw call graphs and flame graphs from them).
+
+import io
+import re
+import json
+import cProfile
+from collections import OrderedDict
+from time import perf_counter
+import da_common
+
+# Rows are counted and timed by these entry types, and other rows by their log
+PROFILED_TYPES = ['net|app', 'app|installed', 'screen|power', 'hf|locked', 'sms', 'phone']
+
+def profiled_type(entry_type):
+    for profiled in PROFILED_TYPES:
+        if entry_type == profiled or entry_type.startswith(profiled + '|'):
+            return profiled
+    return entry_type.partition('|')[0]
+
+# The first two '|' items of the EntryType field of each line, enough for profiled_type
+LINE_TYPE = re.compile(rb'^[^;\n]*;[^;\n]*;[^;\n]*;([^;|\n]*(?:\|[^;|\n]*)?)', re.M)
+
+class TimedStream(io.RawIOBase):
+    """
+    Adds the time spent reading the (decompressing) file object data to profile, and
+    counts the lines read by entry type (outside the timings) into a dict of profile.seen.
+    """
+    def __init__(self, data, profile):
+        self.data = data
+        self.profile = profile
+        self.seen = {}
+        self.rest = b''
+        profile.seen.append(self.seen)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        start = perf_counter()
+        n = self.data.readinto(b)
+        counting = perf_counter()
+        self.profile.decompression += counting - start
+        self.count(bytes(b[:n]) if n else None)
+        self.profile.counting += perf_counter() - counting
+        return n
+
+    def count(self, data):
+        # Lines are counted once read up to their '\n', or at the end of the data (data None)
+        if data == None:
+            data, self.rest = self.rest + b'\n', b''
+        else:
+            data = self.rest + data
+            end = data.rfind(b'\n') + 1
+            data, self.rest = data[:end], data[end:]
+        seen = self.seen
+        for entry_type in LINE_TYPE.findall(data):
+            seen[entry_type] = seen.get(entry_type, 0) + 1
+
+    def close(self):
+        if not self.closed:
+            self.data.close()
+        io.RawIOBase.close(self)
+
+class DeviceProfile(object):
+    """
+    Times and row counts of parsing one device file. Time spent getting the next row
+    from a reader is reading (decompression, and tokenizing for the rest), and time
+    until the reader is asked for the row after is dispatching that row.
+    """
+    def __init__(self):
+        self.decompression = 0.0
+        # Time spent counting the rows seen, taken out of the reading time
+        self.counting = 0.0
+        self.read = 0.0
+        self.dispatch = {}
+        self.used = {}
+        self.types = {}
+        # Rows seen by entry type, of each stream (or cache entry) of the device file read
+        self.seen = []
+
+    def rows(self, rows):
+        types = self.types
+        dispatch = self.dispatch
+        used = self.used
+        rows = iter(rows)
+        start = perf_counter()
+        for row in rows:
+            sent = perf_counter()
+            self.read += sent - start
+            yield row
+            start = perf_counter()
+            entry_type = row.EntryType
+            profiled = types.get(entry_type)
+            if profiled == None:
+                profiled = profiled_type(entry_type)
+                types[entry_type] = profiled
+            dispatch[profiled] = dispatch.get(profiled, 0.0) + start - sent
+            used[profiled] = used.get(profiled, 0) + 1
+        self.read += perf_counter() - start
+
+    def seen_rows(self):
+        """
+        No. of rows of each profiled type seen, from the stream which saw the most rows: a
+        device file read again (as a device whose dates are out of order, or a file which
+        fails to decode part way) is not counted twice.
+        """
+        seen = {}
+        counts = max(self.seen, key=lambda counts: sum(counts.values()), default={})
+        for entry_type, count in counts.items():
+            if isinstance(entry_type, bytes):
+                entry_type = entry_type.decode('utf-8', 'replace')
+            profiled = profiled_type(entry_type)
+            seen[profiled] = seen.get(profiled, 0) + count
+        return seen
+
+    def record(self, device, seconds):
+        seen = self.seen_rows()
+        rows = OrderedDict()
+        for profiled in PROFILED_TYPES + sorted(set(seen) | set(self.used)):
+            if profiled not in rows:
+                rows[profiled] = {'Seen': seen.get(profiled, 0), 'Used': self.used.get(profiled, 0)}
+        dispatch = sum(self.dispatch.values())
+        return OrderedDict([('Device', device.FileName), ('Seconds', seconds),
+                            ('Decompression', self.decompression), ('Tokenizing', self.read - self.decompression - self.counting),
+                            ('Dispatch', OrderedDict((profiled, self.dispatch.get(profiled, 0.0)) for profiled in rows)),
+                            ('Summarise', seconds - self.read - dispatch), ('Merge', 0.0), ('Rows', rows)])
+
+class ProfiledParser(object):
+    """
+    parse_device_file returning (result, profile record) of each device. Worker
+    processes use their own copy of da_common.profiler.
+    """
+    def __init__(self, parse_device_file):
+        self.parse_device_file = parse_device_file
+
+    def __call__(self, device):
+        profiler = da_common.profiler
+        profile = DeviceProfile()
+        profiler.current = profile
+        start = perf_counter()
+        try:
+            result = self.parse_device_file(device)
+        finally:
+            profiler.current = None
+        return result, profile.record(device, perf_counter() - start)
+
+class Profiler(object):
+    """
+    Profile of a run, installed as da_common.profiler: da_common passes the rows and
+    gzip streams of device files read while a device is parsed through rows() and
+    stream(), and parse_devices through parse_devices().
+    """
+    def __init__(self, name):
+        self.name = name
+        self.current = None
+        self.devices = []
+        self.start = perf_counter()
+        self.parsed = None
+
+    def rows(self, rows):
+        return rows if self.current == None else self.current.rows(rows)
+
+    def stream(self, data):
+        return data if self.current == None else TimedStream(data, self.current)
+
+    def cached_rows(self, counts):
+        # Rows by entry type of a cache entry read while a device is parsed
+        if self.current != None:
+            self.current.seen.append(counts)
+
+    def parser(self, parse_device_file):
+        return ProfiledParser(parse_device_file)
+
+    def parse_devices(self, devices_results):
+        # Yield (device, result) from devices_results of a ProfiledParser, timing the
+        # merge done by the caller before it asks for the next device
+        for device, (result, record) in devices_results:
+            self.devices.append(record)
+            start = perf_counter()
+            yield device, result
+            record['Merge'] = perf_counter() - start
+        self.parsed = perf_counter()
+
+    def report(self, outputs):
+        """
+        Return the profile of the run: the record of each device and their totals, with
+        the time of finishing the report (less writing) added to summarising, and the
+        time spent writing the output files of the OutputSinks outputs.
+        """
+        end = perf_counter()
+        output = sum(sink.seconds() for sink in outputs)
+        finish = end - (self.start if self.parsed == None else self.parsed)
+        totals = OrderedDict([('Seconds', end - self.start), ('Decompression', 0.0), ('Tokenizing', 0.0),
+                              ('Dispatch', OrderedDict()), ('Summarise', finish - output), ('Output', output), ('Rows', OrderedDict())])
+        for record in self.devices:
+            totals['Decompression'] += record['Decompression']
+            totals['Tokenizing'] += record['Tokenizing']
+            totals['Summarise'] += record['Summarise'] + record['Merge']
+            for profiled, seconds in record['Dispatch'].items():
+                totals['Dispatch'][profiled] = totals['Dispatch'].get(profiled, 0.0) + seconds
+            for profiled, counts in record['Rows'].items():
+                rows = totals['Rows'].setdefault(profiled, {'Seen': 0, 'Used': 0})
+                rows['Seen'] += counts['Seen']
+                rows['Used'] += counts['Used']
+        return OrderedDict([('Script', self.name), ('Totals', totals), ('Devices', self.devices)])
+
+global stats
+
+def start_profile(path, stats_path, name):
+    """
+    Start profiling the run of the script name if a profile path (--profile) or a
+    cProfile stats path (--profile-stats) is given.
+    """
+    global stats
+
+    stats = None
+    if path != None:
+        da_common.profiler = Profiler(name)
+    if stats_path != None:
+        stats = cProfile.Profile()
+        stats.enable()
+
+def finish_profile(path, stats_path, outputs):
+    """
+    Write the profile of the run to path and the cProfile stats to stats_path (if given),
+    after the report has finished writing the output files of the OutputSinks outputs.
+    """
+    global stats
+
+    if stats != None:
+        stats.disable()
+        stats.dump_stats(stats_path)
+        print('cProfile stats written to ' + stats_path)
+    profiler = da_common.profiler
+    if profiler == None or path == None:
+        return
+    da_common.profiler = None
+    profile = profiler.report(outputs)
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=1)
+
+    totals = profile['Totals']
+    print('Profile written to {0}: decompression {1:.2f}s, tokenizing {2:.2f}s, dispatch {3:.2f}s, summarise {4:.2f}s, output {5:.2f}s'.format(
+        path, totals['Decompression'], totals['Tokenizing'], sum(totals['Dispatch'].values()), totals['Summarise'], totals['Output']))
+    for profiled, seconds in sorted(totals['Dispatch'].items(), key=lambda item: -item[1]):
+        rows = totals['Rows'][profiled]
+        print('  {0}: dispatch {1:.2f}s, {2} rows used of {3} seen'.format(profiled, seconds, rows['Used'], rows['Seen']))
+    for record in sorted(profile['Devices'], key=lambda record: -record['Seconds'])[:5]:
+        print('  {0}: {1:.2f}s'.format(record['Device'], record['Seconds']))
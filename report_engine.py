@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Kelly Widdicks, Alastair R. Beresford
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Produce the output files of several analysis scripts in a single pass over
+# the device files. Each device file is decoded once and each row is sent to
+# the device parsers of the selected reports which read its entry type, so the
+# outputs are the same as running the scripts one after another. With --workers N
+# the devices are parsed in N worker processes and the results merged in device order.
+
+import sys
+import importlib
+from collections import namedtuple
+from datetime import datetime
+from da_common import read_device_file, RowRoutes, WindowedRows, WINDOW_OPEN, pop_option, start_parser, close_parser, list_devices, parse_devices, open_result_store, ProgressReporter, pop_flag, open_checkpoint, shard_devices, write_shard, read_shards
+from profiling import start_profile, finish_profile
+from hourly_stats import set_median_mode
+from device_index import load_device_index, device_window, read_device_window
+
+global selected_modules
+
+# Name: the analysis script providing init_report, device_parser and finish_report
+# Mapping: index of the mapping file passed to init_report (None if it takes none)
+# Windowed: the report only parses the 04:00 to 04:00 window of devices with 14+ days
+Report = namedtuple('Report', ('Name', 'Mapping', 'Windowed'))
+REPORTS = [
+    Report('parse_everything', 0, False),
+    Report('overall_summary', 0, False),
+    Report('app_use_time', 0, False),
+    Report('data_sms_phonecalls', 1, False),
+    Report('day_of_week_totals', 0, True),
+    Report('practice_data_demand', 0, False),
+    Report('output_anomaly', None, True),
+    Report('device_count_hours_days', None, False),
+    Report('app_installs', 0, True),
+]
+
+def select_reports(names):
+    if names == None:
+        return REPORTS
+    reports = []
+    for name in names.split(','):
+        matching = [report for report in REPORTS if report.Name == name]
+        if not matching:
+            print('Unknown report: ' + name)
+            sys.exit(1)
+        reports.append(matching[0])
+    return reports
+
+def init_reports(reports, mapping_paths):
+    modules = []
+    for report in reports:
+        module = importlib.import_module(report.Name)
+        if report.Mapping == None:
+            module.init_report()
+        else:
+            module.init_report(mapping_paths[report.Mapping])
+        modules.append((report, module))
+    return modules
+
+def module_logs_to_parse(module):
+    # The entry types a report reads, if narrower than its logs_to_parse
+    return getattr(module, 'entry_types_to_parse', getattr(module, 'logs_to_parse', None))
+
+def reports_logs_to_parse(modules):
+    # Rows needed by any of the reports, or None if a report reads every row
+    logs = set()
+    for report, module in modules:
+        if module_logs_to_parse(module) == None:
+            return None
+        logs.update(module_logs_to_parse(module))
+    return logs
+
+def reports_packages_to_parse(modules):
+    # Packages whose app|installed rows are needed, or None if a report needs them all
+    packages = set()
+    for report, module in modules:
+        if getattr(module, 'packages_to_parse', None) == None:
+            return None
+        packages.update(module.packages_to_parse)
+    return packages
+
+def report_routes(modules, parsers, indices=None):
+    # RowRoutes of the started parsers of modules (those at indices, if given)
+    indices = range(len(modules)) if indices == None else indices
+    return RowRoutes([(module_logs_to_parse(modules[index][1]), parsers[index].send) for index in indices if parsers[index] != None])
+
+def parse_indexed_device(modules, fullfpath, lancs, fname, cache, meta):
+    # parse_device with the window of the windowed reports taken from the device index
+    start_date, end_date = device_window(meta)
+    ignored = start_date == None
+    parsers = []
+    for report, module in modules:
+        if not report.Windowed:
+            parsers.append(start_parser(module.device_parser(fullfpath, fname)))
+        elif not ignored:
+            parsers.append(start_parser(module.device_parser(fullfpath, fname, start_date, end_date)))
+        else:
+            parsers.append(None)
+    routes = report_routes(modules, parsers)
+
+    # Only the days inside the window are read if every report is windowed
+    logs = reports_logs_to_parse(modules)
+    if not routes.parsers:
+        rows = []
+    elif all(report.Windowed for report, module in modules):
+        rows = read_device_window(fullfpath, lancs, cache, meta, start_date, end_date, logs)
+    else:
+        rows = read_device_file(fullfpath, lancs, cache, logs, reports_packages_to_parse(modules))
+    route = routes.sends
+    for row in rows:
+        for send in route(row.EntryType):
+            send(row)
+
+    results = []
+    for (report, module), parser in zip(modules, parsers):
+        results.append(None if report.Windowed and ignored else close_parser(parser))
+    return ignored, results
+
+def parse_device(modules, fullfpath, lancs, fname, cache=None, index=None):
+    """
+    Parse one device file for every report in modules and return (ignored, results):
+    ignored is True if the device has no 04:00 to 04:00 window for the windowed
+    reports, results holds the device parser result of each report (None if ignored).
+    The window is found while the file is read (see WindowedRows), so it is read once,
+    or taken from the device index if the device files are indexed.
+    """
+    windowed = [(index, module) for index, (report, module) in enumerate(modules) if report.Windowed]
+    meta = load_device_index(fullfpath, lancs, index) if windowed else None
+    if meta != None:
+        return parse_indexed_device(modules, fullfpath, lancs, fname, cache, meta)
+
+    parsers = [None if report.Windowed else start_parser(module.device_parser(fullfpath, fname)) for report, module in modules]
+    # Each row only goes to the parsers of the reports which read its entry type
+    route = report_routes(modules, parsers).sends
+
+    if not windowed:
+        for row in read_device_file(fullfpath, lancs, cache, reports_logs_to_parse(modules), reports_packages_to_parse(modules)):
+            for send in route(row.EntryType):
+                send(row)
+        return False, [close_parser(parser) for parser in parsers]
+
+    windowed_indices = [index for index, module in windowed]
+    def start_windowed_parsers(start_date):
+        for index, module in windowed:
+            parsers[index] = start_parser(module.device_parser(fullfpath, fname, start_date, WINDOW_OPEN))
+        return report_routes(modules, parsers, windowed_indices)
+
+    windowed_logs = reports_logs_to_parse([modules[index] for index, module in windowed])
+    window = WindowedRows(start_windowed_parsers, windowed_logs)
+    for row in read_device_file(fullfpath, lancs, cache):
+        window.add(row)
+        for send in route(row.EntryType):
+            send(row)
+    start_date, end_date = window.finish()
+    ignored = start_date == None or end_date == None
+
+    if not ignored and not window.exact:
+        # Parse the windowed reports again now the window is known
+        for index, module in windowed:
+            parsers[index] = start_parser(module.device_parser(fullfpath, fname, start_date, end_date))
+        window_route = report_routes(modules, parsers, windowed_indices).sends
+        for row in read_device_file(fullfpath, lancs, cache, windowed_logs):
+            for send in window_route(row.EntryType):
+                send(row)
+
+    results = []
+    for (report, module), parser in zip(modules, parsers):
+        results.append(None if report.Windowed and ignored else close_parser(parser))
+    return ignored, results
+
+def parse_device_file(device):
+    return parse_device(selected_modules, device.Path, device.Lancs, device.FileName, device.Cache, device.Index)
+
+def merge_device(modules, fname, ignored, results):
+    for (report, module), result in zip(modules, results):
+        if report.Windowed and ignored:
+            module.ignore_device(fname)
+        else:
+            module.merge_device_result(result)
+
+def finish_reports(modules):
+    for report, module in modules:
+        module.finish_report()
+        if report.Windowed:
+            print("No. of ignored files for {0}: {1}".format(report.Name, str(module.no_of_ignored_files)))
+
+if __name__ == '__main__':
+    args = list(sys.argv)
+    report_names = pop_option(args, '--reports')
+    workers = int(pop_option(args, '--workers', 1))
+    cache = pop_option(args, '--cache')
+    store = pop_option(args, '--store')
+    profile = pop_option(args, '--profile')
+    profile_stats = pop_option(args, '--profile-stats')
+    progress = ProgressReporter('report_engine', float(pop_option(args, '--progress', 10)), pop_option(args, '--status'))
+    checkpoint_path = pop_option(args, '--checkpoint')
+    checkpoint_interval = float(pop_option(args, '--checkpoint-interval', 300))
+    resume = pop_flag(args, '--resume')
+    shard = pop_option(args, '--shard')
+    merge = pop_option(args, '--merge')
+    index = pop_option(args, '--index')
+    median = pop_option(args, '--median', 'exact')
+    set_median_mode(median)
+
+    if len(args) < 5:
+        print('Usage: ' + args[0] + ' <device ids file> <path of device files> <Greater50InstallsApps.csv> <app-greater50-installs-on-devices-at-least-14-days.csv> [lancs] [--reports name,name,...] [--workers N] [--cache dir] [--median exact|tdigest] [--store dir] [--index dir] [--profile file] [--profile-stats file] [--progress seconds] [--status file] [--checkpoint file] [--checkpoint-interval seconds] [--resume] [--shard i/N] [--merge files]')
+        sys.exit(1)
+
+    pathOfIdsFile = args[1]
+    pathOfFiles = args[2]
+    pathOfAppPracticeMapping = args[3]
+    pathOfAppMappingFile = args[4]
+    lancs = bool(len(args) > 5)
+
+    startTime = datetime.now()
+    start_profile(profile, profile_stats, 'report_engine')
+
+    reports = select_reports(report_names)
+    selected_modules = init_reports(reports, (pathOfAppPracticeMapping, pathOfAppMappingFile))
+    # Stored results are only reused for the same selection of reports
+    result_store = open_result_store(store, 'report_engine', (pathOfAppPracticeMapping, pathOfAppMappingFile), [report.Name for report in reports])
+
+    devices = list_devices(pathOfIdsFile, pathOfFiles, lancs, cache, index)
+    options = [report.Name for report in reports] + [str(lancs), median]
+    checkpoint = open_checkpoint(checkpoint_path, 'report_engine', devices, (pathOfAppPracticeMapping, pathOfAppMappingFile), options,
+                                 [(vars(module), module.merged_globals) for report, module in selected_modules], checkpoint_interval, resume)
+    if shard != None:
+        write_shard(shard, 'report_engine', devices, (pathOfAppPracticeMapping, pathOfAppMappingFile), options, parse_devices(parse_device_file, shard_devices(devices, shard), workers, result_store, progress))
+        for report, module in selected_modules:
+            module.output.discard()
+        finish_profile(profile, profile_stats, [module.output for report, module in selected_modules])
+        sys.exit(0)
+    if merge != None:
+        devices_results = read_shards(merge, 'report_engine', devices, (pathOfAppPracticeMapping, pathOfAppMappingFile), options)
+    else:
+        devices_results = parse_devices(parse_device_file, devices, workers, result_store, progress, checkpoint)
+    for device, (ignored, results) in devices_results:
+        merge_device(selected_modules, device.FileName, ignored, results)
+
+    finish_reports(selected_modules)
+    finish_profile(profile, profile_stats, [module.output for report, module in selected_modules])
+    for report, module in selected_modules:
+        for path, rows, written in module.output.counters():
+            print("Wrote {0} rows ({1} bytes) to {2}".format(rows, written, path))
+
+    # **** For checking timings *****
+    endFilesTime = datetime.now()
+    print("All files summarised in {0}".format(str((endFilesTime - startTime))))
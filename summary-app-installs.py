@@ -13,74 +13,47 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-   
-def app_names(fp):
-	"""
-	Give a file pointer fp, extract app names from a DA analysed/apps-installed file
-	Assumes file is formated as 
-	"time | <count> | CSV of app names, each name colon separated with perms"
-	"""
-	app_dict = {}
-	for line in fp.readlines():
-		items = line.split("|")
-		if len(items) < 3:
-			print "Error, expecting line with at least three items", line[:20]+"..."
-			continue
-		apps = items[2]
-		for app in apps.split(","):
-			if len(app) > 2:
-				#string is of form "app_name:perms_list:market" since version 1.1.6 of DA
-				#we'll simply ignore data from older versions of DA.
-				app_details =  app.split(":")
-				if len(app_details) < 3:
-					continue
-					
-				fullname = app_details[0]
-				name = fullname.split("@")[0]
-				perms = app_details[1]
-				market = app_details[-1]
-				#for the moment, the last app status wins; does it matter if this changes over time?
-				app_dict[name] = (market, "android.permission.INTERNET" in perms)
-	return app_dict.items()
+#
+# Print the apps installed on at least <threshold> devices, from a directory of
+# DA analysed/apps-installed files (one per device), with the no. of devices
+# by market and by INTERNET permission. The files are read in --workers N
+# processes and counted in an AppCensus (app_census.py). With --top K only the
+# K apps on most devices are printed, and --mapping and --applist write the
+# apps printed as a mapping file and as an app list file.
+
+import sys
+from os import listdir
+from os.path import isfile, join
+from da_common import pop_option, parse_device_results
+from app_census import AppCensus, summarise_apps_file, write_mapping, write_applist
 
 if __name__ == '__main__':
-	"""
-	Given a directory, process all files in it.
-	"""
-	import sys
-	from os import listdir
-	from os.path import isfile, join
-	
-	if len(sys.argv) != 3:
-		print "Usage:", sys.argv[0], " <dir of device app files> <threshold>"
-		sys.exit(1)
-		
-	app_count = {}
-	filenames = [f for f in listdir(sys.argv[1]) if isfile(join(sys.argv[1], f))]
-	for filename in filenames:
-		fp = open(join(sys.argv[1], filename), "rb")
-		for app, (market, has_internet) in app_names(fp):
-			#This is horrible; rework!
-			if app_count.has_key(app):
-				total, counters = app_count[app]
-				if counters.has_key(market):
-					counters[market] += 1
-				else:
-					counters[market] = 1
-				if counters.has_key("Internet_"+str(has_internet)):
-					counters["Internet_"+str(has_internet)] += 1
-				else:
-					counters["Internet_"+str(has_internet)] = 1
-				app_count[app] = (total + 1, counters)
-			else:
-				app_count[app] = (1, {market: 1, "Internet_"+str(has_internet): 1})
-	
-	app_list = []
-	for app, (count, detail) in app_count.items():
-		app_list.append((count, app, detail))
-	app_list.sort()
-	app_list.reverse()
-	
-	for count, app, detail in app_list:
-		if count >= int(sys.argv[2]):
-			print app + ", " + str(count) + ",", detail
+    """
+    Given a directory, process all files in it.
+    """
+    args = list(sys.argv)
+    workers = int(pop_option(args, '--workers', 1))
+    top = pop_option(args, '--top')
+    mapping = pop_option(args, '--mapping')
+    practices = pop_option(args, '--practices')
+    applist = pop_option(args, '--applist')
+
+    if len(args) != 3:
+        print('Usage: ' + args[0] + ' <dir of device app files> <threshold> [--top K] [--workers N] [--mapping file [--practices mapping file]] [--applist file]')
+        sys.exit(1)
+
+    census = AppCensus()
+    filenames = [f for f in listdir(args[1]) if isfile(join(args[1], f))]
+    for path, apps in parse_device_results(summarise_apps_file, [join(args[1], filename) for filename in filenames], workers):
+        census.add_device(apps)
+
+    rows = census.select(int(args[2]), None if top == None else int(top))
+    for row in rows:
+        print(census.names[row] + ', ' + str(census.counts[row]) + ',', census.detail(row))
+
+    if mapping != None:
+        with open(mapping, 'w') as f:
+            write_mapping(f, census, rows, practices)
+    if applist != None:
+        with open(applist, 'w') as f:
+            write_applist(f, census, rows)